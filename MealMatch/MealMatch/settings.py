@@ -276,6 +276,38 @@ EMAIL_HOST_USER = 'confirmation.mealmatch@gmail.com'
 EMAIL_HOST_PASSWORD = 'hallongr8'
 EMAIL_PORT = 587
 
+### Search engine settings
+MATCH_ENGINE = True #serve retrieveRecipes from the in-process index (recipes/matching.py), falls back to mapped.key_frequency
+MATCH_INDEX_RELOAD = 600 #seconds before a worker reloads the index from mongo, in a background thread while searches use the loaded one
+MATCH_DECODED_POSTINGS = 2000000 #postings of the recently queried ingredients each worker keeps decoded, 8 bytes each (recipes/matching.py)
+CARD_STORE_REFRESH = 30 #seconds between incremental refreshes of the recipe card columns (recipes/cardstore.py)
+QUERY_CACHE_SIZE = 1024 #ranked results kept per worker (recipes/querycache.py), counters at /recipes/searchstats
+QUERY_CACHE_TTL = 300 #seconds
+QUERY_CACHE_CLICK_DELTA = 50 #clicks a recipe has to move before the cached queries containing it are dropped
+QUERY_CACHE_RATING_DELTA = 0.5 #same for the average rating
+CURSOR_SNAPSHOTS = 512 #frozen result rankings kept per worker for ?cursor= page requests (recipes/cursors.py)
+CURSOR_TTL = 1800 #seconds a cursor stays valid
+#STAPLE_INGREDIENTS = [...] #staples scored from a per-recipe mask instead of merged, defaults to the default pantry
+STAPLE_DOCUMENT_FREQUENCY = None #e.g. 0.5, ingredients listed by this share of all recipes are staples too, off by default since a query matching only staples brings in no candidates
+MAPPED_BUCKET_SIZE = 1000 #recipe ids per mapped document, posting lists of staples are split into buckets (recipes/indexing.py)
+MATCH_SNAPSHOT_DIR = None #directory of mmapped index snapshots written by manage.py buildsnapshot (recipes/snapshot.py), workers load the published one instead of mongo
+MATCH_SNAPSHOT_CHECK = 5 #seconds between checks for a newly published snapshot
+MATCH_PARTITIONS = 0 #scoring processes each worker forks for broad queries, one per ordinal range (recipes/partitions.py), 0 or 1 scores in the worker
+MATCH_PARTITION_MIN_POSTINGS = 50000 #postings a query has to touch before it is scattered to the partitions
+MATCH_PARTITION_REFORK = 30 #seconds between forks of the partitions once recipe saves have left them behind
+MATCH_PARTITION_CHANNELS = 4 #queries a worker can have in its partitions at once, one set of pipes each
+PANTRY_WEIGHT = 0.5 #what an ingredient from the user's pantry adds to a match with ?pantry=1, against 1 for one in the query (recipes/pantries.py)
+PANTRY_CACHE_SIZE = 4096 #normalized pantries kept per worker
+PANTRY_CACHE_TTL = 300 #seconds before a pantry is read from the profile again, editpantry drops it right away in its own worker
+INGREDIENT_SYNONYMS = {} #e.g. {"tomat": "Tomato"}, spelling -> food_ref name, on top of case, accent and plural folding (recipes/canonical.py)
+CANONICAL_RELOAD = 3600 #seconds before a worker reads food_ref into its canonicalization table again
+AUTOCORRECT_LIMIT = 10 #completions per keystroke, the ingredients most recipes list first (recipes/completion.py)
+AUTOCOMPLETE_MAX_AGE = 300 #seconds browsers and proxies may reuse an answer of /recipes/autocomplete/
+FUZZY_MAX_DISTANCE = 2 #typos corrected in a query ingredient of five letters or more, one in shorter ones (recipes/fuzzy.py)
+RANKING_WEIGHTS = None #e.g. {"match": 1, "clicks": 0.2, "rating": 0.5}, rank by a weighted sum of recipe columns instead of match score, clicks, rating (recipes/scoring.py)
+RANKING_HALF_LIFE = 30 #days in which the recency column of RANKING_WEIGHTS halves
+START_PAGE_RECIPES = 6 #most clicked recipes on the start page, read from the in-memory clicks order (recipes/orderings.py)
+
 #DJANGO REGISTRATION SETTINGS#
 ACCOUNT_ACTIVATION_DAYS = 1
 REGISTRATION_AUTO_LOGIN = True
@@ -37,6 +37,8 @@ class user_test(models.Model):
 
 
 
+DEFAULT_PANTRY = ['Salt', 'Sea salt', 'Pepper','White pepper', 'Vinegar', 'Flour', 'Oil', 'Sugar', 'Pasta', 'Baking powder', 'Soy sauce', 'Broth', 'Honey', 'Tomato purée', 'Cinnamon', 'Oregano', 'Curry']
+
 class Profile(DynamicDocument):
     user_id_reference = IntField(unique=True)
     full_name = StringField()
@@ -51,7 +53,7 @@ class Profile(DynamicDocument):
     my_info = StringField()
     age = IntField()
     sex = StringField()
-    Pantry = ListField(default= ['Salt', 'Sea salt', 'Pepper','White pepper', 'Vinegar', 'Flour', 'Oil', 'Sugar', 'Pasta', 'Baking powder', 'Soy sauce', 'Broth', 'Honey', 'Tomato purée', 'Cinnamon', 'Oregano', 'Curry'])
+    Pantry = ListField(default=lambda: list(DEFAULT_PANTRY))
 
 
 
@@ -14,6 +14,7 @@ from datetime import datetime, date
 
 
 from recipes.models import recipe
+from recipes import pantries, cookable
 import re
 
 
@@ -33,6 +34,8 @@ def editpantry(request):
         user_profile = Profile.objects.get(user_id_reference=user_id)
         user_profile.Pantry = input
         user_profile.save()
+        pantries.cache.invalidate(user_id) #searches with ?pantry=1 use the new pantry right away
+        cookable.pantry_changed(user_id, input) #only the added and removed ingredients are counted
 
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
     else:
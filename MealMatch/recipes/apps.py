@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from . import indexing, matching, cookable, canonical  # connects the recipe save/delete signals that keep mapped, the search index, the cook now feeds and the canonical table current
@@ -0,0 +1,244 @@
+## Compressed bitmaps over recipe ordinals ##
+# Roaring layout: ordinals are split on their high 16 bits into chunks of 65536, and each chunk is
+# stored in whichever container is smallest for it:
+#   array  - sorted array('H') of the low bits, for sparse chunks (up to 4096 values, 2 bytes each)
+#   bitmap - one 65536 bit int, for dense chunks (8 kB), AND/OR/ANDNOT/popcount run word by word in C
+#   run    - (start, length) pairs, for chunks made of long consecutive stretches (after run_optimize)
+# Set operations work chunk by chunk on matching keys, so a query touches only the chunks both
+# sides have.
+
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import repeat
+from operator import sub
+
+CHUNK = 1 << 16
+ARRAY_MAX = 4096  # above this an array container is bigger than a bitmap
+FULL = (1 << CHUNK) - 1
+
+_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]  # set bits of every byte value
+
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+
+def _bits_to_values(bits):  # int bitmap -> sorted low values
+    values = array("H")
+    for position, byte in enumerate(bits.to_bytes(CHUNK // 8, "little")):
+        if byte:
+            base = position << 3
+            values.extend(base + bit for bit in _BITS[byte])
+    return values
+
+
+def _values_to_bits(values):  # set the value's binary digit, counted from the right, then parse them in one go
+    digits = bytearray(b"0") * CHUNK
+    deque(map(digits.__setitem__, map(sub, repeat(CHUNK - 1), values), repeat(ord("1"))), maxlen=0)
+    return int(digits, 2)
+
+
+class ArrayContainer(object):
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values  # sorted array("H")
+
+    def cardinality(self):
+        return len(self.values)
+
+    def contains(self, low):
+        i = bisect_left(self.values, low)
+        return i < len(self.values) and self.values[i] == low
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def bits(self):
+        return _values_to_bits(self.values)
+
+    def nbytes(self):
+        return 2 * len(self.values)
+
+
+class BitmapContainer(object):
+    __slots__ = ("bits_", "count")
+
+    def __init__(self, bits, count=None):
+        self.bits_ = bits
+        self.count = popcount(bits) if count is None else count
+
+    def cardinality(self):
+        return self.count
+
+    def contains(self, low):
+        return self.bits_ >> low & 1 == 1
+
+    def __iter__(self):
+        return iter(_bits_to_values(self.bits_))
+
+    def bits(self):
+        return self.bits_
+
+    def nbytes(self):
+        return CHUNK // 8
+
+
+class RunContainer(object):
+    __slots__ = ("runs",)
+
+    def __init__(self, runs):
+        self.runs = runs  # sorted, non touching [(start, length)]
+
+    def cardinality(self):
+        return sum(length for start, length in self.runs)
+
+    def contains(self, low):
+        i = bisect_left(self.runs, (low + 1,)) - 1
+        return i >= 0 and self.runs[i][0] <= low < self.runs[i][0] + self.runs[i][1]
+
+    def __iter__(self):
+        for start, length in self.runs:
+            for value in range(start, start + length):
+                yield value
+
+    def bits(self):
+        bits = 0
+        for start, length in self.runs:
+            bits |= ((1 << length) - 1) << start
+        return bits
+
+    def nbytes(self):
+        return 4 * len(self.runs)
+
+
+def _runs(values):
+    runs = []
+    for value in values:
+        if runs and runs[-1][0] + runs[-1][1] == value:
+            runs[-1][1] += 1
+        else:
+            runs.append([value, 1])
+    return [tuple(run) for run in runs]
+
+
+def _container(values=None, bits=None):  # smallest of array/bitmap for the chunk, None when empty
+    if bits is not None:
+        count = popcount(bits)
+        if count == 0:
+            return None
+        if count <= ARRAY_MAX:
+            return ArrayContainer(_bits_to_values(bits))
+        return BitmapContainer(bits, count)
+    if not values:
+        return None
+    if len(values) <= ARRAY_MAX:
+        return ArrayContainer(array("H", values))
+    return BitmapContainer(_values_to_bits(values), len(values))
+
+
+def _and(a, b):
+    if isinstance(a, ArrayContainer) and isinstance(b, ArrayContainer):
+        return _container(values=sorted(set(a.values).intersection(b.values)))
+    if isinstance(b, ArrayContainer):
+        a, b = b, a
+    if isinstance(a, ArrayContainer):  # probe the array against the other side
+        return _container(values=[value for value in a.values if b.contains(value)])
+    return _container(bits=a.bits() & b.bits())
+
+
+def _or(a, b):
+    if isinstance(a, ArrayContainer) and isinstance(b, ArrayContainer) and len(a.values) + len(b.values) <= ARRAY_MAX:
+        return _container(values=sorted(set(a.values).union(b.values)))
+    return _container(bits=a.bits() | b.bits())
+
+
+def _andnot(a, b):
+    if isinstance(a, ArrayContainer):
+        return _container(values=[value for value in a.values if not b.contains(value)])
+    return _container(bits=a.bits() & ~b.bits() & FULL)
+
+
+class RoaringBitmap(object):
+
+    def __init__(self, containers=None):
+        self.containers = containers or {}  # high 16 bits -> container
+
+    @classmethod
+    def from_sorted(cls, ordinals):  # ascending ordinals, e.g. a posting list
+        ordinals = ordinals if isinstance(ordinals, array) else array("I", ordinals)
+        containers = {}
+        start = 0
+        while start < len(ordinals):  # one slice per chunk, the low bits taken off in C
+            high = ordinals[start] >> 16
+            end = bisect_left(ordinals, (high + 1) << 16, start)
+            containers[high] = _container(values=array("H", map(sub, ordinals[start:end], repeat(high << 16))))
+            start = end
+        return cls(containers)
+
+    def __len__(self):
+        return sum(container.cardinality() for container in self.containers.values())
+
+    def cardinality(self):
+        return len(self)
+
+    def __contains__(self, ordinal):
+        container = self.containers.get(ordinal >> 16)
+        return container is not None and container.contains(ordinal & 0xFFFF)
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            base = high << 16
+            for low in self.containers[high]:
+                yield base + low
+
+    def nbytes(self):
+        return sum(container.nbytes() for container in self.containers.values())
+
+    def run_optimize(self):  # switch dense chunks to run containers where that is smaller
+        for high, container in list(self.containers.items()):
+            if not isinstance(container, BitmapContainer):
+                continue
+            runs = popcount(container.bits_ & ~(container.bits_ << 1))  # bits whose lower neighbour is clear
+            if 4 * runs < container.nbytes():
+                self.containers[high] = RunContainer(_runs(iter(container)))
+        return self
+
+    def _combine(self, other, op, keys):
+        containers = {}
+        for high in keys:
+            result = op(self.containers.get(high), other.containers.get(high))
+            if result is not None:
+                containers[high] = result
+        return RoaringBitmap(containers)
+
+    def __and__(self, other):
+        keys = set(self.containers).intersection(other.containers)
+        return self._combine(other, _and, keys)
+
+    def __or__(self, other):
+        keys = set(self.containers).union(other.containers)
+        return self._combine(other, lambda a, b: b if a is None else a if b is None else _or(a, b), keys)
+
+    def __sub__(self, other):  # ANDNOT
+        return self._combine(other, lambda a, b: a if b is None else _andnot(a, b), self.containers)
+
+    @classmethod
+    def union(cls, bitmaps):
+        result = cls()
+        for bitmap in bitmaps:
+            result = result | bitmap
+        return result
+
+    @classmethod
+    def intersection(cls, bitmaps):
+        bitmaps = sorted(bitmaps, key=len)  # smallest first, the rest only gets probed
+        if not bitmaps:
+            return cls()
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result = result & bitmap
+            if not result.containers:
+                break
+        return result
@@ -0,0 +1,109 @@
+## Ingredient canonicalization ##
+# "Tomato", "tomatoes" and "tomat" used to be three ingredients: three mapped lists, three cache keys.
+# Every token, from a query or from a recipe's ingredients_list, now goes through canonical(): the
+# old sanitize patterns (compiled once), Swedish-aware folding and one lookup in a table built from
+# food_ref. Folding casefolds and drops accents (purée, puree) but keeps å, ä and ö, which are
+# letters of their own in Swedish (and reads æ and ø as ä and ö). The table maps the folded name of
+# every food_ref entry and of the INGREDIENT_SYNONYMS setting, and their plural forms, to the food_ref
+# spelling; a token it doesn't know stays folded. Every name gets the English plurals and -a -> -or,
+# the Swedish -ar and -er only names with å, ä or ö and the synonyms, so list a Swedish spelling
+# without them (tomat) or an irregular plural in INGREDIENT_SYNONYMS. The index has to be built
+# with the same table as the queries, so run buildmapped after changing food_ref or the synonyms.
+
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from mongoengine import signals
+
+from .models import food_ref
+
+
+_UNDERSCORE = re.compile("_")
+_JUNK = re.compile("[^a-öA-Ö],[^-]")  # removes non alphabetic characters but allows whitespace and single dash
+_DASHES = re.compile("--")  # double dash, to prevent injections
+_SPACES = re.compile(r"\s+")
+
+_KEEP = "åäöÅÄÖ"
+_FOLD = dict((code, unicodedata.normalize("NFD", chr(code))[0]) for code in range(0xC0, 0x250)
+             if chr(code) not in _KEEP and len(unicodedata.normalize("NFD", chr(code))) > 1)
+_FOLD.update((ord(letter), swedish) for letter, swedish in zip("æøÆØ", "äöÄÖ"))
+
+_PLURALS = (("y", "ies"), ("", "s"), ("", "es"),  # berry, berries; carrot, carrots; potato, potatoes
+            ("a", "or"))  # gurka, gurkor
+_SWEDISH_PLURALS = (("e", "ar"), ("", "ar"), ("", "er"))  # lök, lökar; tomat, tomater, only for Swedish names
+
+
+def clean(token):  # what sanitize did, underscores to spaces and no injection characters
+    token = _UNDERSCORE.sub(" ", token)
+    token = _JUNK.sub("", token)
+    return _DASHES.sub("", token)
+
+
+def fold(token):
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", token).translate(_FOLD).casefold()).strip()
+
+
+def swedish(folded):
+    return any(letter in folded for letter in "åäö")
+
+
+def plurals(folded, swedish_stem=False):  # -ar and -er would make pear a Pea and corner a Corn, so they need a Swedish stem
+    for singular, plural in _PLURALS + _SWEDISH_PLURALS if swedish_stem else _PLURALS:
+        if folded.endswith(singular):
+            yield folded[:len(folded) - len(singular)] + plural
+
+
+def build_table(foods, synonyms):  # folded form -> canonical spelling, real names win over generated forms
+    table = {}
+    for food in foods:
+        table.setdefault(fold(food), food)
+    for synonym, food in synonyms.items():
+        table[fold(synonym)] = table.get(fold(food), food)
+    for name in list(foods) + list(synonyms):  # a synonym is taken for a Swedish spelling, e.g. tomat
+        for plural in plurals(fold(name), name in synonyms or swedish(fold(name))):
+            table.setdefault(plural, table[fold(name)])
+    return table
+
+
+##### WORKER SINGLETON #####
+_table = None
+_loaded_at = 0
+_lock = threading.Lock()
+
+
+def get_table():
+    global _table, _loaded_at
+    if _table is None or time.time() - _loaded_at > getattr(settings, "CANONICAL_RELOAD", 3600):
+        with _lock:
+            if _table is None or time.time() - _loaded_at > getattr(settings, "CANONICAL_RELOAD", 3600):
+                foods = [doc["food"] for doc in food_ref._get_collection().find({}, {"food": 1}) if doc.get("food")]
+                _table = build_table(foods, getattr(settings, "INGREDIENT_SYNONYMS", {}))
+                _loaded_at = time.time()
+    return _table
+
+
+def pin():  # Pool initializer, the processes of a build keep the table they were forked with
+    global _loaded_at
+    _loaded_at = float("inf")
+
+
+def canonical(token):
+    folded = fold(clean(token))
+    return get_table().get(folded, folded)
+
+
+def canonical_set(tokens):
+    table = get_table()
+    return set(table.get(folded, folded) for folded in (fold(clean(token)) for token in tokens or []) if folded)
+
+
+def food_changed(sender, document, **kwargs):  # reload in the worker that edited food_ref, the others within CANONICAL_RELOAD
+    global _table
+    _table = None
+
+
+signals.post_save.connect(food_changed, sender=food_ref)
+signals.post_delete.connect(food_changed, sender=food_ref)
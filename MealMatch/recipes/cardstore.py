@@ -0,0 +1,233 @@
+## Resident recipe-card stats ##
+# Column store of the fields a result card and the ranking need (clicks, average rating, title,
+# image, ingredient count and prep time), keyed by a dense recipe ordinal. It is loaded once per worker and
+# then refreshed from the recipe.modified change marker, and from the deleted_recipe tombstones for
+# deletes, so searches never have to hydrate recipe documents through get_stats.
+
+import re
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from django.conf import settings
+from mongoengine import signals
+
+from .models import recipe, deleted_recipe
+from . import indexing
+
+
+CARD_FIELDS = {"clicks": 1, "rating": 1, "title": 1, "image": 1, "ingredients_complete": 1, "ingredients_list": 1,
+               "time": 1, "modified": 1}
+MISSING = 1 << 30  # ing_count of ordinals without a recipe document, they sort last and never score
+NO_TIME = (1 << 32) - 1  # minutes of a recipe whose time says nothing, it sorts last by prep time
+
+_HOURS = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:h|tim)", re.IGNORECASE)  # 1 h, 1,5 tim, 2 timmar, 1 hour
+_MINUTES = re.compile(r"(\d+)\s*m", re.IGNORECASE)  # 30 min, 45 minuter
+_NUMBER = re.compile(r"\d+")
+
+listeners = []  # called as listener(store, ordinal, ingredients, old) for every recipe a refresh or a save in
+                # this worker picks up, old is the previous (clicks, rating, ing_count) or None for a recipe new
+                # to the store. A deleted recipe comes with no ingredients.
+
+
+def created_at(recipe_id):  # seconds since the epoch, ObjectIds start with the time they were made
+    binary = getattr(recipe_id, "binary", None)
+    return int.from_bytes(binary[:4], "big") if binary else 0
+
+
+def prep_minutes(text):  # recipe.time as minutes, "1 h 30 min" -> 90, a bare number is minutes
+    text = str(text or "")
+    hours, minutes = _HOURS.findall(text), _MINUTES.findall(text)
+    if not hours and not minutes:
+        numbers = _NUMBER.findall(text)
+        return int(numbers[0]) if numbers else NO_TIME
+    return int(round(60 * sum(float(hour.replace(",", ".")) for hour in hours))) + sum(int(minute) for minute in minutes)
+
+
+def average_rating(ratings):  # rating is stored both as plain numbers and as embedded rating documents
+    values = []
+    for item in ratings or []:
+        if isinstance(item, dict):
+            item = item.get("rating")
+        try:
+            values.append(float(item))
+        except (TypeError, ValueError):
+            pass
+    if not values:
+        return 0
+    return sum(values) / len(values)
+
+
+class CardStore(object):
+
+    def __init__(self):
+        self.recipe_ids = []  # ordinal -> ObjectId
+        self.ordinals = {}  # ObjectId -> ordinal
+
+        ## columns, all indexed by ordinal ##
+        self.clicks = array("l")
+        self.rating = array("d")
+        self.ing_count = array("I")
+        self.created = array("l")  # from the ObjectId, for the recency column of RANKING_WEIGHTS (scoring.py)
+        self.minutes = array("I")  # prep time, for ?sort=time (orderings.py)
+        self.title = []
+        self.image = []
+        self.modified = []  # recipe.modified of the version held, refresh skips what it already has
+
+        self.marker = None  # newest recipe.modified seen
+        self.deleted_marker = None  # newest tombstone seen
+        self.refreshed_at = None
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def ordinal(self, recipe_id):
+        ordinal = self.ordinals.get(recipe_id)
+        if ordinal is None:
+            ordinal = len(self.recipe_ids)
+            self.ordinals[recipe_id] = ordinal
+            self.recipe_ids.append(recipe_id)
+            self.clicks.append(0)
+            self.rating.append(0)
+            self.ing_count.append(MISSING)
+            self.created.append(created_at(recipe_id))
+            self.minutes.append(NO_TIME)
+            self.title.append(None)
+            self.image.append(None)
+            self.modified.append(None)
+        return ordinal
+
+    def alive(self, ordinal):
+        return self.ing_count[ordinal] != MISSING
+
+    def put(self, doc, notify=False):
+        ordinal = self.ordinal(doc["_id"])
+        old = None
+        if self.alive(ordinal):
+            old = (self.clicks[ordinal], self.rating[ordinal], self.ing_count[ordinal])
+        self.ing_count[ordinal] = len(doc.get("ingredients_complete") or [])
+        self.clicks[ordinal] = doc.get("clicks", 1)
+        self.rating[ordinal] = average_rating(doc.get("rating"))
+        self.minutes[ordinal] = prep_minutes(doc.get("time"))
+        self.title[ordinal] = doc.get("title")
+        self.image[ordinal] = doc.get("image")
+
+        self.modified[ordinal] = doc.get("modified")
+
+        if notify:
+            for listener in listeners:
+                listener(self, ordinal, indexing.ingredients_of(doc), old)
+        return ordinal
+
+    def seen(self, doc):  # moves the marker, only for what load and refresh read: a save here can be newer than
+        # changes other workers made since the last refresh, which a marker moved past them would never read
+        modified = doc.get("modified")
+        if modified is not None and (self.marker is None or modified > self.marker):
+            self.marker = modified
+
+    def drop(self, recipe_id):
+        ordinal = self.ordinals.get(recipe_id)
+        if ordinal is not None and self.alive(ordinal):
+            old = (self.clicks[ordinal], self.rating[ordinal], self.ing_count[ordinal])
+            self.ing_count[ordinal] = MISSING
+            for listener in listeners:
+                listener(self, ordinal, [], old)
+
+    def load(self):
+        self.deleted_marker = datetime.now()  # what was deleted before isn't read
+        for doc in recipe._get_collection().find({}, CARD_FIELDS):
+            self.put(doc)
+            self.seen(doc)
+        self.refreshed_at = time.time()
+        return self
+
+    def load_snapshot(self, snapshot):  # columns copied out of a mapped snapshot (snapshot.py), then refreshed from its marker
+        self.recipe_ids = snapshot.recipe_ids()
+        self.ordinals = dict((recipe_id, ordinal) for ordinal, recipe_id in enumerate(self.recipe_ids))
+        self.clicks = array("l", snapshot.section("clicks", "q"))
+        self.rating = array("d", snapshot.section("rating", "d"))
+        self.ing_count = array("I", snapshot.section("ing_count", "I"))
+        self.created = array("l", map(created_at, self.recipe_ids))
+        self.minutes = array("I", snapshot.section("minutes", "I"))
+        self.title = snapshot.strings("title", len(self.recipe_ids))
+        self.image = snapshot.strings("image", len(self.recipe_ids))
+        self.modified = [None] * len(self.recipe_ids)
+        self.marker = self.deleted_marker = snapshot.marker
+        self.refreshed_at = 0  # the first get_store() catches up with the recipes saved since
+        return self
+
+    def refresh(self):  # only what changed since the marker, $gte so a recipe saved in the same instant isn't missed
+        query = {"modified": {"$ne": None} if self.marker is None else {"$gte": self.marker}}
+        changed = 0
+        for doc in recipe._get_collection().find(query, CARD_FIELDS):
+            self.seen(doc)
+            if self.holds(doc):  # the $gte matches the newest recipes again, and the ones saved in this worker
+                continue
+            self.put(doc, notify=True)
+            changed += 1
+        query = {} if self.deleted_marker is None else {"deleted": {"$gte": self.deleted_marker}}
+        for doc in deleted_recipe._get_collection().find(query):
+            if self.deleted_marker is None or doc["deleted"] > self.deleted_marker:
+                self.deleted_marker = doc["deleted"]
+            ordinal = self.ordinals.get(doc["recipe_id"])
+            if ordinal is not None and self.alive(ordinal):
+                self.drop(doc["recipe_id"])
+                changed += 1
+        self.refreshed_at = time.time()
+        return changed
+
+    def holds(self, doc):  # the store already has this version of the recipe
+        ordinal = self.ordinals.get(doc["_id"])
+        return ordinal is not None and self.alive(ordinal) and self.modified[ordinal] is not None and \
+            doc.get("modified") is not None and doc["modified"] <= self.modified[ordinal]
+
+    def card(self, ordinal):  # dict in the shape mappedQuerysSet.get_stats produces
+        return {"clicks": self.clicks[ordinal], "rating": self.rating[ordinal], "title": self.title[ordinal],
+                "ing_count": self.ing_count[ordinal], "image": self.image[ordinal]}
+
+    def cards(self, keys):  # get_stats without the round trip
+        reduced_result = {}
+        for key in keys:
+            ordinal = self.ordinals.get(key)
+            if ordinal is not None and self.alive(ordinal):
+                reduced_result[key] = self.card(ordinal)
+        return reduced_result
+
+
+##### WORKER SINGLETON #####
+_store = None
+_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _lock:
+        if _store is None:
+            _store = CardStore().load()
+        elif time.time() - _store.refreshed_at > getattr(settings, "CARD_STORE_REFRESH", 30):
+            _store.refresh()
+    return _store
+
+
+def reset_store(store=None):  # store is the one get_store() returns from now on, with None the next call loads one
+    global _store
+    with _lock:
+        _store = store
+
+
+def recipe_saved(sender, document, **kwargs):  # this worker sees its own writes before the next refresh
+    with _lock:  # like a refresh, two new recipes mustn't get the same ordinal or repack the same list at once
+        if _store is not None:
+            _store.put(document.to_mongo(), notify=True)
+
+
+def recipe_deleted(sender, document, **kwargs):  # other workers drop it on their next refresh, from the tombstone
+    deleted_recipe._get_collection().insert({"recipe_id": document.id, "deleted": datetime.now()})
+    with _lock:
+        if _store is not None:
+            _store.drop(document.id)
+
+
+signals.post_save.connect(recipe_saved, sender=recipe)
+signals.post_delete.connect(recipe_deleted, sender=recipe)
@@ -0,0 +1,79 @@
+## Autocorrect completions ##
+# autocorrect used to send food__istartswith, an unanchored case-insensitive regex with no limit, to
+# mongo on every keystroke. The completions are now a flattened trie in the worker: a dict from
+# every folded prefix of every canonical name (canonical.py) to the AUTOCORRECT_LIMIT names under
+# it that most recipes list, worked out once when the table or the match index is (re)loaded. A
+# keystroke is one dict lookup and the answer never grows past the limit. The GET endpoint's answers
+# for the prefixes of up to SHORT letters, most of the traffic, are serialized and tagged up front too.
+
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+
+from . import canonical, matching
+
+
+SHORT = 3
+
+
+def serialize(names):  # (JSON body, ETag), the tag follows the content so every worker hands out the same one
+    body = json.dumps(list(names)).encode("utf-8")
+    return body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+class Completions(object):
+
+    def __init__(self, table, postings, limit=10):
+        self.table = table  # the canonical table and the posting lists the ranking comes from
+        self.postings = postings
+        self.limit = limit
+        frequency = lambda name: len(postings[name]) if name in postings else 0
+        names = sorted(set(table.values()), key=lambda name: (-frequency(name), name))
+        self.nodes = {}  # folded prefix -> best names under it, most listed first
+        for name in names:
+            folded = canonical.fold(name)
+            for end in range(1, len(folded) + 1):
+                node = self.nodes.setdefault(folded[:end], [])
+                if len(node) < limit:
+                    node.append(name)
+        self.responses = {}  # folded prefix of up to SHORT letters -> (body, etag)
+        for prefix, node in self.nodes.items():
+            self.nodes[prefix] = tuple(node)
+            if len(prefix) <= SHORT:
+                self.responses[prefix] = serialize(node)
+
+    def complete(self, prefix):
+        return self.nodes.get(canonical.fold(canonical.clean(prefix)), ())
+
+    def response(self, prefix):
+        folded = canonical.fold(canonical.clean(prefix))
+        response = self.responses.get(folded)
+        return response if response is not None else serialize(self.nodes.get(folded, ()))
+
+
+##### WORKER SINGLETON #####
+_completions = None
+_lock = threading.Lock()
+
+
+def get_completions():  # rebuilt when the canonical table or the match index was reloaded
+    global _completions
+    table = canonical.get_table()
+    postings = matching.postings()  # empty when the match engine is off, ranked by name alone
+    completions = _completions
+    if completions is None or completions.table is not table or completions.postings is not postings:
+        with _lock:
+            completions = _completions
+            if completions is None or completions.table is not table or completions.postings is not postings:
+                _completions = completions = Completions(table, postings, getattr(settings, "AUTOCORRECT_LIMIT", 10))
+    return completions
+
+
+def complete(prefix):  # canonical names starting with prefix, at most AUTOCORRECT_LIMIT
+    return list(get_completions().complete(prefix))
+
+
+def response(prefix):  # (JSON body, ETag) of complete(prefix)
+    return get_completions().response(prefix)
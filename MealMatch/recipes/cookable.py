@@ -0,0 +1,156 @@
+## Materialized "cook now" feeds ##
+# The recipes a user can cook with nothing but their pantry, the ones ?subset=1 would list for the
+# pantry as query, are kept ranked in one cookable_feed document per user, so the feed page is a single
+# read on user_id_reference instead of scoring the corpus. A feed is counted once from the index and
+# then kept up to date by deltas: editpantry drops the recipes listing a removed ingredient and only
+# counts the recipes listing an added one, and a saved recipe is pushed into the feeds whose pantry
+# holds all its ingredients ($all on the multikey pantry index) and pulled from the ones it left.
+# Every entry carries the rank key it joined with, so a save is two multi updates that mongo sorts
+# into place, however many feeds and entries there are.
+
+from collections import Counter
+
+from bson.son import SON
+from mongoengine import signals
+
+from .models import cookable_feed, recipe
+from account_functions.models import Profile
+from . import matching, cardstore, indexing, bitmaps, canonical, scoring
+
+
+KEY_FIELDS = ("score", "clicks", "rating")  # scoring.formula.key, as many as it has
+ORDER = SON([(field, -1) for field in KEY_FIELDS] + [("recipe", -1)])  # best first, then the newest recipe
+
+
+def rank_key(store, ordinal):  # the subset ranking, every ingredient matched (scoring.py)
+    return scoring.formula.key(store, ordinal, store.ing_count[ordinal])
+
+
+def entry(store, ordinal):  # {"recipe": id, "score": ..., ...} of a feed
+    fields = dict(zip(KEY_FIELDS, rank_key(store, ordinal)))
+    fields["recipe"] = store.recipe_ids[ordinal]
+    return fields
+
+
+def ranked(store, ordinals):  # entries best first, in ORDER
+    entries = [entry(store, ordinal) for ordinal in set(ordinals) if store.alive(ordinal)]
+    return sorted(entries, key=lambda fields: tuple(fields[field] for field in ORDER if field in fields), reverse=True)
+
+
+def covered(index, pantry):  # ordinals the whole pantry covers, one counting pass
+    return index.covered(pantry, missing=0)[0]
+
+
+def grown(index, pantry, added):  # ordinals covered by the pantry that list one of the added ingredients
+    store = index.store
+    pantry = [ingredient for ingredient in pantry if ingredient in index.postings]
+    candidates = bitmaps.RoaringBitmap.from_sorted([ordinal for ordinal in index.candidates(any_of=added)
+                                                    if store.ing_count[ordinal] <= len(pantry)])
+    counts = Counter()
+    for ingredient in pantry:
+        counts.update(candidates & index.bitmap(ingredient))
+    return [ordinal for ordinal, count in counts.items() if count >= store.ing_count[ordinal]]
+
+
+def build(user_id, pantry):  # the whole feed, for a user without one
+    index = matching.get_index()
+    pantry = sorted(canonical.canonical_set(pantry))
+    entries = ranked(index.store, covered(index, pantry))
+    cookable_feed._get_collection().update({"user_id_reference": user_id},
+                                      {"$set": {"pantry": pantry, "entries": entries}, "$unset": {"recipes": ""}}, upsert=True)
+    return [fields["recipe"] for fields in entries]
+
+
+def pantry_changed(user_id, pantry):  # editpantry, applies the delta from the pantry the feed was computed for
+    feed = cookable_feed._get_collection().find_one({"user_id_reference": user_id})
+    try:
+        index = matching.get_index()
+    except Exception as e:  # the profile is saved already, feed() builds the feed again from it
+        print("match engine unavailable, dropping the cook now feed: ", e)
+        cookable_feed._get_collection().remove({"user_id_reference": user_id})
+        return None
+    pantry = sorted(canonical.canonical_set(pantry))
+    if feed is None or "entries" not in feed:  # none yet, or one from before the entries had their keys
+        return build(user_id, pantry)
+
+    store = index.store
+    added = set(pantry) - set(feed.get("pantry") or [])
+    removed = set(feed.get("pantry") or []) - set(pantry)
+    ordinals = [store.ordinals.get(fields["recipe"]) for fields in feed["entries"]]
+    ordinals = [ordinal for ordinal in ordinals if ordinal is not None]
+    if removed:
+        gone = index.candidates(any_of=removed)
+        ordinals = [ordinal for ordinal in ordinals if ordinal not in gone]
+    if added:
+        ordinals += grown(index, pantry, added)
+    entries = ranked(store, ordinals)  # the keys of the ones kept are brought up to date too
+    cookable_feed._get_collection().update({"_id": feed["_id"]}, {"$set": {"pantry": pantry, "entries": entries}})
+    return [fields["recipe"] for fields in entries]
+
+
+class Feed(object):  # ranked [id, card] sequence of a user's feed, sliceable by Paginator
+
+    def __init__(self, pantry, recipes):
+        self.pantry = pantry
+        self.recipes = recipes
+        self.store = cardstore.get_store()
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def count(self):
+        return len(self.recipes)
+
+    def card(self, recipe_id):
+        ordinal = self.store.ordinals.get(recipe_id)
+        if ordinal is None or not self.store.alive(ordinal):
+            return None
+        card = self.store.card(ordinal)
+        card["frequency"] = card["ing_count"]
+        card["ratio"] = 100
+        return card
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [(recipe_id, self.card(recipe_id)) for recipe_id in self.recipes[index]]
+        return (self.recipes[index], self.card(self.recipes[index]))
+
+
+def feed(user_id):  # the user's Feed, built from their profile on the first visit
+    doc = cookable_feed._get_collection().find_one({"user_id_reference": user_id}, {"pantry": 1, "entries.recipe": 1})
+    if doc is None or "entries" not in doc:
+        profile = Profile.objects(user_id_reference=user_id).only("Pantry").first()
+        pantry = sorted(canonical.canonical_set(profile.Pantry if profile is not None else []))
+        try:
+            return Feed(pantry, build(user_id, pantry))
+        except Exception as e:  # not stored, the next visit builds it
+            print("match engine unavailable, listing the cook now feed from mapped: ", e)
+            return Feed(pantry, [recipe_id for recipe_id, card in matching.search(pantry, missing=0)])
+    return Feed(doc.get("pantry") or [], [fields["recipe"] for fields in doc["entries"]])
+
+
+##### SIGNALS #####
+def recipe_saved(sender, document, **kwargs):  # join the feeds whose pantry covers the recipe, leave the others
+    doc = document.to_mongo()
+    ingredients = list(indexing.ingredients_of(doc))
+    collection = cookable_feed._get_collection()
+    covers = ingredients and len(ingredients) >= len(doc.get("ingredients_complete") or [])
+
+    leaving = {"entries.recipe": document.id}
+    if covers:
+        leaving["pantry"] = {"$not": {"$all": ingredients}}
+    collection.update(leaving, {"$pull": {"entries": {"recipe": document.id}}}, multi=True)
+    if covers:  # ranked from the saved document, a worker without an index ranks it the same
+        store = cardstore.CardStore()
+        joined = entry(store, store.put(doc))
+        collection.update({"pantry": {"$all": ingredients}, "entries": {"$exists": True}, "entries.recipe": {"$ne": document.id}},
+                          {"$push": {"entries": {"$each": [joined], "$sort": ORDER}}}, multi=True)
+
+
+def recipe_deleted(sender, document, **kwargs):
+    cookable_feed._get_collection().update({"entries.recipe": document.id}, {"$pull": {"entries": {"recipe": document.id}}},
+                                           multi=True)
+
+
+signals.post_save.connect(recipe_saved, sender=recipe)
+signals.post_delete.connect(recipe_deleted, sender=recipe)
@@ -0,0 +1,109 @@
+## Continuation tokens for ranked result pages ##
+# The first page of a search freezes its ranking in a snapshot and hands out an opaque, signed token
+# for it. Next/previous page requests carrying the token slice the snapshot instead of ranking again,
+# so they cost a page worth of work and keep their order while clicks move. Snapshots live in the
+# worker that made them and only while its index is in use; a worker that doesn't have one rebuilds it
+# under the same id.
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import signing
+
+from .querycache import query_key
+
+
+SALT = "recipes.cursors"
+
+
+class Snapshot(object):  # frozen ranked [id, card] sequence, sliceable by Paginator
+
+    def __init__(self, result):
+        self.result = result  # the live ranked result, only asked again for pages past the frozen prefix
+        self.total = len(result)
+        self.ranked = []
+        self.ids = set()
+        self.exhausted = False
+
+    def __len__(self):
+        return self.total
+
+    def count(self):
+        return self.total
+
+    def extend(self, stop):
+        if stop <= len(self.ranked) or self.exhausted:
+            return
+        k = max(stop, 2 * len(self.ranked))
+        fresh = self.result[0:k]
+        for item in fresh:  # keep the order already shown, append whatever is new
+            if item[0] not in self.ids:
+                self.ids.add(item[0])
+                self.ranked.append(item)
+        self.exhausted = len(fresh) < k
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self.extend(self.total if index.stop is None else index.stop)
+        else:
+            self.extend(index + 1)
+        return self.ranked[index]
+
+
+class SnapshotTable(object):  # LRU of this worker's snapshots
+
+    def __init__(self, maxsize=512, ttl=1800):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.snapshots = OrderedDict()  # id -> (expires, snapshot)
+        self.lock = threading.Lock()
+
+    def get(self, snapshot_id):
+        with self.lock:
+            entry = self.snapshots.get(snapshot_id)
+            if entry is None or entry[0] < time.time():
+                return None
+            self.snapshots.move_to_end(snapshot_id)
+            return entry[1]
+
+    def put(self, snapshot_id, snapshot):
+        with self.lock:
+            self.snapshots[snapshot_id] = (time.time() + self.ttl, snapshot)
+            self.snapshots.move_to_end(snapshot_id)
+            while len(self.snapshots) > self.maxsize:
+                self.snapshots.popitem(last=False)
+
+    def clear(self):  # the index was swapped, the live results would keep the old one loaded
+        with self.lock:
+            self.snapshots.clear()
+
+
+table = SnapshotTable(getattr(settings, "CURSOR_SNAPSHOTS", 512), getattr(settings, "CURSOR_TTL", 1800))
+
+
+def open_cursor(ingredients, token, search, **options):
+    # returns (snapshot, token) for the request, search(ingredients, **options) is only called when there
+    # is no usable snapshot. A token for another query, a forged one or an expired one starts a new snapshot.
+    key = hashlib.sha1(repr(query_key(ingredients, **options)).encode("utf-8")).hexdigest()
+    snapshot_id = None
+    if token:
+        try:
+            state = signing.loads(token, salt=SALT, max_age=table.ttl)
+        except signing.BadSignature:
+            state = None
+        if state is not None and state.get("q") == key:
+            snapshot_id = state["s"]
+            snapshot = table.get(snapshot_id)
+            if snapshot is not None:
+                return snapshot, token
+
+    if snapshot_id is None:
+        snapshot_id = uuid.uuid4().hex
+        token = signing.dumps({"s": snapshot_id, "q": key}, salt=SALT)
+    snapshot = Snapshot(search(ingredients, **options))
+    table.put(snapshot_id, snapshot)
+    return snapshot, token
@@ -0,0 +1,109 @@
+## Typo-tolerant ingredient resolution ##
+# A query token the canonical table doesn't know and no recipe lists is most likely misspelled. It
+# is corrected with a SymSpell index over the canonical names (food_ref and INGREDIENT_SYNONYMS):
+# every name is filed under each string its first PREFIX letters turn into with up to
+# FUZZY_MAX_DISTANCE letters deleted, so a token is looked up by generating its own deletes, a few
+# dozen dict probes, and only the names sharing one get a bounded edit distance check. The index is
+# built once per canonical table, in memory, and a request never reads food_ref.
+
+import threading
+
+from django.conf import settings
+
+from . import canonical, matching
+
+
+PREFIX = 7
+
+
+def deletes(term, distance):  # term's prefix with up to distance letters deleted, the prefix itself included
+    result = {term[:PREFIX]}
+    edge = result
+    for step in range(distance):
+        edge = set(word[:i] + word[i + 1:] for word in edge for i in range(len(word)))
+        result |= edge
+    return result
+
+
+def edit_distance(a, b, limit):  # optimal string alignment distance, limit + 1 once it is certainly above limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:  # transposition
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit and min(previous) >= limit:  # a transposition reaches back one more row
+            return limit + 1
+    return current[-1]
+
+
+class FuzzyIndex(object):
+
+    def __init__(self, table, synonyms, max_distance=2):
+        self.table = table  # the canonical table it was built from
+        self.max_distance = max_distance
+        self.names = set(table.values())  # canonical spellings
+        self.terms = dict((canonical.fold(name), name) for name in self.names)  # folded -> canonical
+        for synonym in synonyms:
+            self.terms.setdefault(canonical.fold(synonym), table.get(canonical.fold(synonym)))
+        self.deletes = {}  # delete of a term's prefix -> folded terms
+        for term in self.terms:
+            for delete in deletes(term, max_distance):
+                self.deletes.setdefault(delete, []).append(term)
+
+    def limit(self, token):  # one typo in a short word, FUZZY_MAX_DISTANCE in longer ones
+        return 0 if len(token) < 3 else 1 if len(token) <= 4 else self.max_distance
+
+    def lookup(self, token, frequency=None):
+        # closest canonical name to the folded token, the one most recipes list (frequency(name)) among
+        # equally close names, None when nothing is within the limit
+        limit = self.limit(token)
+        if not limit:
+            return None
+        candidates = set()
+        for delete in deletes(token, limit):
+            candidates.update(self.deletes.get(delete, ()))
+        best = None
+        for term in candidates:
+            distance = edit_distance(token, term, limit)
+            if distance <= limit:
+                key = (distance, -(frequency(self.terms[term]) if frequency else 0), term)
+                if best is None or key < best[0]:
+                    best = (key, self.terms[term])
+        return best and best[1]
+
+
+##### WORKER SINGLETON #####
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():  # rebuilt only when the canonical table was reloaded
+    global _index
+    table = canonical.get_table()
+    if _index is None or _index.table is not table:
+        with _lock:
+            if _index is None or _index.table is not table:
+                _index = FuzzyIndex(table, getattr(settings, "INGREDIENT_SYNONYMS", {}),
+                                    getattr(settings, "FUZZY_MAX_DISTANCE", 2))
+    return _index
+
+
+def resolver(postings=None):
+    # token -> canonical ingredient, corrected when neither the canonical table nor the posting lists
+    # (ingredient -> recipes, the match index's by default) know it; among corrections the most listed one wins
+    if postings is None:  # empty when the match engine is off, corrected without the recipe counts
+        postings = matching.postings()
+    index = get_index()
+    frequency = lambda name: len(postings[name]) if name in postings else 0
+
+    def resolve(token):
+        ingredient = canonical.canonical(token)
+        if not ingredient or ingredient in index.names or ingredient in postings:
+            return ingredient
+        return index.lookup(ingredient, frequency) or ingredient
+    return resolve
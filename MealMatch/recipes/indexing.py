@@ -0,0 +1,281 @@
+## Maintenance of the mapped inverted collection ##
+# mapped holds the recipe ids listing each ingredient in ingredients_list (what the old
+# MapReduce/mapreduce.js used to build), split into buckets of at most MAPPED_BUCKET_SIZE sorted ids
+# so staples like salt don't grow into one huge document. A bucket records its ingredient, its
+# sequence number, its id count and the first and last id it covers, so readers fetch only the buckets
+# they need and an update touches a single bucket. Saving or deleting a recipe updates only the
+# buckets it is in, in the same request, so new recipes are searchable without rerunning the whole
+# build.
+
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from django.conf import settings
+from mongoengine import signals
+
+from .models import mapped, recipe, deleted_recipe
+from . import canonical
+
+
+def bucket_size():
+    return getattr(settings, "MAPPED_BUCKET_SIZE", 1000)
+
+
+def ingredients_of(doc):  # the ingredients a recipe is indexed under, canonical (canonical.py)
+    return canonical.canonical_set(doc.get("ingredients_list"))
+
+
+def legacy(collection):  # mapped still holds what mapreduce.js wrote, {_id: ingredient, value: [recipe ids]}
+    doc = collection.find_one({}, {"ingredient": 1})
+    return doc is not None and "ingredient" not in doc
+
+
+def ingredient_query(collection, ingredients):  # selects the documents of the ingredients, in either format
+    if legacy(collection):
+        return {"_id": {"$in": list(ingredients)}}
+    return {"ingredient": {"$in": list(ingredients)}}
+
+
+def read_postings(collection, ingredients=None):  # (ingredient, [recipe ids]) merged over the buckets, in ingredient order
+    if legacy(collection):  # until buildmapped swaps the buckets in
+        return read_legacy(collection, ingredients)
+    return read_buckets(collection, {} if ingredients is None else {"ingredient": {"$in": list(ingredients)}})
+
+
+def read_buckets(collection, query):
+    ingredient, ids = None, []
+    for doc in collection.find(query, {"ingredient": 1, "value": 1}).sort([("ingredient", 1), ("bucket", 1)]):
+        if doc["ingredient"] != ingredient:
+            if ingredient is not None:
+                yield ingredient, ids
+            ingredient, ids = doc["ingredient"], []
+        ids.extend(doc.get("value") or [])
+    if ingredient is not None:
+        yield ingredient, ids
+
+
+def read_legacy(collection, ingredients=None):  # the mapreduce.js names aren't canonical, names that fold together are merged
+    postings = {}
+    for doc in collection.find({} if ingredients is None else {"_id": {"$in": list(ingredients)}}, {"value": 1}):
+        for ingredient in canonical.canonical_set([doc["_id"]]):
+            postings.setdefault(ingredient, set()).update(doc.get("value") or [])
+    for ingredient in sorted(postings):
+        if ingredients is None or ingredient in ingredients:
+            yield ingredient, sorted(postings[ingredient])
+
+
+def sync_recipe(recipe_id, ingredients):  # make mapped list recipe_id under exactly these ingredients
+    collection = mapped._get_collection()
+    if legacy(collection):  # no buckets to update yet, the build replays the saves made since it started
+        return set(), set()
+    indexed = set(doc["ingredient"] for doc in collection.find({"value": recipe_id}, {"ingredient": 1}))
+    added = ingredients - indexed
+    removed = indexed - ingredients
+    if not added and not removed:
+        return added, removed
+
+    ## pick the bucket covering recipe_id for every added ingredient, from the bucket metadata only ##
+    buckets = {}
+    for doc in collection.find({"ingredient": {"$in": list(added)}}, {"ingredient": 1, "bucket": 1, "count": 1,
+                                                                      "first": 1, "last": 1}):
+        buckets.setdefault(doc["ingredient"], []).append(doc)
+
+    bulk = collection.initialize_unordered_bulk_op()
+    for ingredient in added:
+        ordered = sorted(buckets.get(ingredient, []), key=lambda doc: doc["bucket"])
+        covering = [doc for doc in ordered if doc["first"] <= recipe_id]
+        target = covering[-1] if covering else (ordered[0] if ordered else None)
+        if target is None or (target is ordered[-1] and target["count"] >= bucket_size() and recipe_id > target["last"]):
+            # new ingredient, or a new id past a full last bucket: start the next bucket
+            bulk.find({"ingredient": ingredient, "bucket": target["bucket"] + 1 if target else 0}).upsert().update_one(
+                {"$push": {"value": recipe_id}, "$inc": {"count": 1}, "$set": {"first": recipe_id, "last": recipe_id}})
+        else:
+            bulk.find({"_id": target["_id"], "value": {"$ne": recipe_id}}).update_one(
+                {"$push": {"value": {"$each": [recipe_id], "$sort": 1}}, "$inc": {"count": 1},
+                 "$min": {"first": recipe_id}, "$max": {"last": recipe_id}})
+    for ingredient in removed:
+        bulk.find({"ingredient": ingredient, "value": recipe_id}).update_one({"$pull": {"value": recipe_id},
+                                                                             "$inc": {"count": -1}})
+    bulk.execute()
+
+    if added:  # ids pushed into a bucket that isn't the last one can fill it past the size
+        for doc in collection.find({"ingredient": {"$in": list(added)}, "count": {"$gt": bucket_size()}}, {"_id": 1}):
+            split_bucket(collection, doc["_id"])
+    if removed:  # buckets left empty, and the first or last id of the others
+        collection.remove({"ingredient": {"$in": list(removed)}, "count": {"$lte": 0}})
+        for doc in collection.find({"ingredient": {"$in": list(removed)}, "$or": [{"first": recipe_id}, {"last": recipe_id}]},
+                                   {"value": 1}):
+            value = doc.get("value") or []
+            if value:
+                collection.update({"_id": doc["_id"]}, {"$set": {"first": value[0], "last": value[-1]}})
+    return added, removed
+
+
+def split_bucket(collection, bucket_id):  # moves the upper half of an overfull bucket into a new next bucket
+    doc = collection.find_one({"_id": bucket_id})
+    value = (doc or {}).get("value") or []
+    if len(value) <= bucket_size():
+        return
+    ingredient, number = doc["ingredient"], doc["bucket"]
+    for later in collection.find({"ingredient": ingredient, "bucket": {"$gt": number}}, {"bucket": 1}).sort("bucket", -1):
+        collection.update({"_id": later["_id"]}, {"$inc": {"bucket": 1}})  # last first, the numbers stay unique
+    half = len(value) // 2
+    lower, upper = value[:half], value[half:]
+    collection.insert({"ingredient": ingredient, "bucket": number + 1, "count": len(upper), "first": upper[0],
+                       "last": upper[-1], "value": upper})
+    # only the moved ids are pulled, an id pushed meanwhile stays where it went
+    collection.update({"_id": bucket_id}, {"$pullAll": {"value": upper}, "$inc": {"count": -len(upper)},
+                                           "$set": {"last": lower[-1]}})
+
+
+def full_rebuild(batch_size=1000):  # ingredient -> set of recipe ids, what a full rebuild would write
+    postings = {}
+    for doc in recipe._get_collection().find({}, {"ingredients_list": 1}).batch_size(batch_size):
+        for ingredient in ingredients_of(doc):
+            postings.setdefault(ingredient, set()).add(doc["_id"])
+    return postings
+
+
+def verify_mapped():  # differences between mapped and a full rebuild, as ingredient -> (missing ids, extra ids)
+    expected = full_rebuild()
+    differences = {}
+    for ingredient, ids in read_postings(mapped._get_collection()):
+        indexed = set(ids)
+        wanted = expected.pop(ingredient, set())
+        if indexed != wanted or len(ids) != len(indexed):  # an id in two buckets is a difference too
+            differences[ingredient] = (wanted - indexed, indexed - wanted)
+    for ingredient, wanted in expected.items():  # ingredients mapped doesn't have at all
+        differences[ingredient] = (wanted, set())
+    return differences
+
+
+##### FULL BUILD #####
+# Replaces the removed MapReduce/mapreduce.js. recipe is streamed in _id order in batches, the batches are inverted
+# in a process pool and appended to the last bucket of each ingredient in a shadow collection, which
+# is renamed over mapped only when the build is complete, so readers never see a half built index.
+# Since ids arrive in order the buckets come out sorted. The last recipe id merged is checkpointed
+# after every batch; an interrupted build first pulls anything merged past the checkpoint out of
+# the shadow buckets and then continues from there.
+# A mapped collection left by mapreduce.js ({_id: ingredient, value: [recipe ids]}) can't take the
+# unique (ingredient, bucket) index. Searches keep reading it while the first build runs, and the
+# swap renames it to mapped_mapreduce just before the shadow takes its place.
+SHADOW = "mapped_shadow"
+CHECKPOINTS = "mapped_build"
+LEGACY = "mapped_mapreduce"
+
+
+def invert(batch):  # runs in the pool, [(recipe id, ingredients_list)] -> ingredient -> recipe ids
+    postings = {}
+    for recipe_id, ingredients in batch:
+        for ingredient in ingredients_of({"ingredients_list": ingredients}):
+            postings.setdefault(ingredient, []).append(recipe_id)
+    return batch[-1][0], len(batch), postings
+
+
+def read_batches(start_after, batch_size):
+    query = {} if start_after is None else {"_id": {"$gt": start_after}}
+    cursor = recipe._get_collection().find(query, {"ingredients_list": 1}).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    for doc in cursor:
+        batch.append((doc["_id"], doc.get("ingredients_list") or []))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def resume_tails(shadow, last_id):  # roll the shadow back to the checkpoint, ingredient -> [last bucket, ids in it]
+    if last_id is not None:
+        shadow.update({}, {"$pull": {"value": {"$gt": last_id}}}, multi=True)
+        shadow.remove({"value": {"$size": 0}})
+    tails = {}
+    for doc in shadow.find({}, {"ingredient": 1, "bucket": 1, "value": 1}):
+        tail = tails.get(doc["ingredient"])
+        if tail is None or doc["bucket"] > tail[0]:
+            tails[doc["ingredient"]] = [doc["bucket"], len(doc.get("value") or [])]
+    return tails
+
+
+def append_postings(bulk, tails, ingredient, recipe_ids):
+    tail = tails.setdefault(ingredient, [0, 0])
+    while recipe_ids:
+        if tail[1] >= bucket_size():
+            tail[0], tail[1] = tail[0] + 1, 0
+        room = bucket_size() - tail[1]
+        part, recipe_ids = recipe_ids[:room], recipe_ids[room:]
+        bulk.find({"ingredient": ingredient, "bucket": tail[0]}).upsert().update_one(
+            {"$push": {"value": {"$each": part}}})
+        tail[1] += len(part)
+
+
+def migrate_mapped():  # the bucket indexes, a mapped still in the mapreduce.js format gets them with the shadow
+    if not legacy(mapped._get_collection()):
+        mapped.ensure_indexes()
+
+
+def build_mapped(batch_size=1000, processes=None, restart=False, progress=None):
+    migrate_mapped()
+    db = mapped._get_db()
+    shadow = db[SHADOW]
+    checkpoints = db[CHECKPOINTS]
+    if restart:
+        shadow.drop()
+        checkpoints.remove({"_id": SHADOW})
+    state = checkpoints.find_one({"_id": SHADOW}) or {"_id": SHADOW, "last_id": None, "recipes": 0,
+                                                        "started": datetime.now()}
+    tails = resume_tails(shadow, state["last_id"])
+
+    started = time.time()
+    done = 0
+    canonical.get_table()
+    pool = Pool(processes, initializer=canonical.pin)  # forked with the table, the whole build uses the same one
+    try:
+        for last_id, count, postings in pool.imap(invert, read_batches(state["last_id"], batch_size)):
+            bulk = shadow.initialize_unordered_bulk_op()
+            for ingredient, recipe_ids in postings.items():
+                append_postings(bulk, tails, ingredient, recipe_ids)
+            if postings:
+                bulk.execute()
+
+            state["last_id"] = last_id
+            state["recipes"] += count
+            checkpoints.save(state)
+            done += count
+            if progress is not None:
+                progress(state["recipes"], done / max(time.time() - started, 1e-6))
+    finally:
+        pool.close()
+        pool.join()
+
+    ## bucket metadata, then swap ##
+    for doc in shadow.find({}, {"value": 1}):
+        value = doc.get("value") or []
+        shadow.update({"_id": doc["_id"]}, {"$set": {"count": len(value), "first": value[0], "last": value[-1]}})
+    shadow.ensure_index([("ingredient", 1), ("bucket", 1)], unique=True)
+    shadow.ensure_index("value")
+    if legacy(mapped._get_collection()):  # kept aside, searches read it up to here
+        mapped._get_collection().rename(LEGACY, dropTarget=True)
+    shadow.rename(mapped._get_collection_name(), dropTarget=True)  # atomic swap
+    checkpoints.remove({"_id": SHADOW})
+
+    # recipes saved or deleted while the build ran may have been merged before the change, replay them
+    for doc in recipe._get_collection().find({"modified": {"$gte": state["started"]}}, {"ingredients_list": 1}):
+        sync_recipe(doc["_id"], ingredients_of(doc))
+    for doc in deleted_recipe._get_collection().find({"deleted": {"$gte": state["started"]}}, {"recipe_id": 1}):
+        sync_recipe(doc["recipe_id"], set())
+    return state["recipes"], done / max(time.time() - started, 1e-6)
+
+
+##### SIGNALS #####
+def recipe_saved(sender, document, **kwargs):
+    sync_recipe(document.id, ingredients_of(document.to_mongo()))
+
+
+def recipe_deleted(sender, document, **kwargs):
+    sync_recipe(document.id, set())
+
+
+signals.post_save.connect(recipe_saved, sender=recipe)
+signals.post_delete.connect(recipe_deleted, sender=recipe)
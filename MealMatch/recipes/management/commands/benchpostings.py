@@ -0,0 +1,97 @@
+import random
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import matching, ranking
+
+
+class Command(BaseCommand):
+    help = "Reports the size of the packed posting lists, all the index holds, and what decoding and intersecting them costs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=5, help="times every list is decoded")
+        parser.add_argument('--pairs', type=int, default=1000, help="random ingredient pairs intersected")
+        parser.add_argument('--broad', type=int, default=5, help="most listed ingredients in the broad query")
+
+    def resident(self, index):  # (part, bytes) of what the index holds in this process, the snapshot file aside
+        store = index.store
+        snapshotted = index.snapshot is not None
+        sizes = [
+            ("postings", 0 if snapshotted else sum(index.postings[ingredient].nbytes() for ingredient in index.postings)),
+            ("impact", 0 if snapshotted else sum(index.impact[ingredient].nbytes() for ingredient in index.impact)),
+            ("forward", 0 if snapshotted else index.forward.nbytes()),
+            ("changed", sum(sys.getsizeof(listed) + sum(map(sys.getsizeof, listed)) for listed in index.listed.values()) +
+                        sys.getsizeof(index.listed)),
+            ("staple masks", sys.getsizeof(index.staple_mask) + sum(sys.getsizeof(mask) for mask in index.staple_mask if mask > 256)),
+            ("decoded", sum(postings.itemsize * (len(postings) + len(impact))
+                            for packed, postings, impact in index.decoded.values())),
+            ("bitmaps", sum(bitmap.nbytes() for bitmap in index.bitmaps.values())),
+            ("card columns", sum(column.itemsize * len(column) for column in
+                                 (store.clicks, store.rating, store.ing_count, store.created, store.minutes))),
+            ("card strings", sum(sys.getsizeof(column) + sum(map(sys.getsizeof, filter(None, column)))
+                                 for column in (store.title, store.image))),
+            ("recipe ids", sys.getsizeof(store.recipe_ids) + sys.getsizeof(store.ordinals) +
+                           sum(map(sys.getsizeof, store.recipe_ids)) + sys.getsizeof(store.modified)),
+        ]
+        return sizes
+
+    def handle(self, *args, **options):
+        started = time.time()
+        index = matching.get_index()
+        self.stdout.write("index loaded in %.2fs (%s)" % (time.time() - started,
+                                                           index.snapshot.path if index.snapshot else "mongo"))
+
+        ingredients = list(index.postings)
+        postings = sum(len(index.postings[ingredient]) for ingredient in ingredients)
+        packed = sum(index.postings[ingredient].nbytes() for ingredient in ingredients)
+        impact = sum(index.impact[ingredient].nbytes() for ingredient in ingredients)
+        self.stdout.write("%d ingredients, %d postings" % (len(ingredients), postings))
+        self.stdout.write("packed postings:  %10d bytes, %.2f bytes/posting" % (packed, packed / max(postings, 1)))
+        self.stdout.write("  as uint32:      %10d bytes, %.1fx" % (4 * postings, 4.0 * postings / max(packed, 1)))
+        self.stdout.write("  as ObjectIds:   %10d bytes, %.1fx (12 bytes an id, as in mapped.value)" %
+                          (12 * postings, 12.0 * postings / max(packed, 1)))
+        self.stdout.write("packed impact:    %10d bytes, %.2f bytes/posting" % (impact, impact / max(postings, 1)))
+        resident = self.resident(index)
+        for name, size in resident:
+            self.stdout.write("  %-16s%10d bytes, %.2f bytes/posting" % (name + ":", size, size / max(postings, 1)))
+        total = sum(size for name, size in resident)
+        self.stdout.write("resident:         %10d bytes, %.2f bytes/posting, %.1f bytes/recipe" %
+                          (total, total / max(postings, 1), total / max(len(index.store), 1)))
+
+        started = time.time()
+        for round in range(options['rounds']):
+            for ingredient in ingredients:
+                index.postings[ingredient].decode()
+        elapsed = time.time() - started
+        decoded = options['rounds'] * postings
+        self.stdout.write("decode:    %.1f ms per million postings" % (1e9 * elapsed / max(decoded, 1)))
+
+        pairs = [random.sample(ingredients, 2) for pair in range(options['pairs'])] if len(ingredients) > 1 else []
+        started = time.time()
+        intersected = 0
+        for pair in pairs:
+            index.bitmaps.clear()  # measure decode + intersect, not the bitmap cache
+            intersected += sum(len(index.postings[ingredient]) for ingredient in pair)
+            index.candidates(all_of=pair)
+        elapsed = time.time() - started
+        self.stdout.write("intersect: %.1f ms per million postings, %d pairs" %
+                          (1e9 * elapsed / max(intersected, 1), len(pairs)))
+
+        # the worst case of the pruned ranker, the most listed ingredients with every staple, next to a counting pass
+        broad = sorted((ingredient for ingredient in ingredients if ingredient not in index.staples),
+                       key=lambda ingredient: len(index.postings[ingredient]), reverse=True)[:options['broad']]
+        mask = sum(index.staples.values())
+        if broad:
+            lists = [index.lists(ingredient) for ingredient in broad]
+            extra, extra_max = index.extra(mask)
+            started = time.time()
+            ranked = index.ranked(broad, mask, 12)
+            pruned = time.time() - started
+            started = time.time()
+            counted = ranking.counted_top_k([p for p, i in lists], index.store.ing_count, index.tiebreak, 12, extra)
+            elapsed = time.time() - started
+            self.stdout.write("rank %s + %d staples: %.1f ms, counting every posting %.1f ms%s" %
+                              (", ".join(broad), bin(mask).count("1"), 1e3 * pruned, 1e3 * elapsed,
+                               "" if ranked == counted else " (results differ)"))
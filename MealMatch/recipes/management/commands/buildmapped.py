@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes.indexing import build_mapped
+
+
+class Command(BaseCommand):
+    help = "Builds the mapped collection from recipe in a shadow collection and swaps it in, resuming an interrupted build"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--processes', type=int, default=None, help="pool size, defaults to the number of cores")
+        parser.add_argument('--restart', action='store_true', help="throw away the checkpoint of an interrupted build")
+
+    def handle(self, *args, **options):
+        def progress(recipes, rate):
+            self.stdout.write("%d recipes indexed, %.0f recipes/s" % (recipes, rate))
+
+        recipes, rate = build_mapped(options['batch_size'], options['processes'], options['restart'], progress)
+        self.stdout.write("mapped rebuilt from %d recipes (%.0f recipes/s)" % (recipes, rate))
@@ -0,0 +1,37 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import cardstore, matching, snapshot
+
+
+class Command(BaseCommand):
+    help = "Writes the match index from mongo to a new snapshot in MATCH_SNAPSHOT_DIR and publishes it to the workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=3, help="snapshots to keep, older ones are removed")
+
+    def handle(self, *args, **options):
+        directory = snapshot.snapshot_dir()
+        if not directory:
+            raise CommandError("MATCH_SNAPSHOT_DIR is not set")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        started = time.time()
+        index = matching.MatchIndex(cardstore.CardStore().load()).load()
+        generation = int(time.time() * 1000)
+        path = os.path.join(directory, "index-%d.snap" % generation)
+        snapshot.write_snapshot(index, path, generation)
+        self.stdout.write("wrote %s, %d recipes and %d ingredients in %.1fs" % (path, len(index.store), len(index.postings),
+                                                                             time.time() - started))
+
+        started = time.time()  # what a worker pays to pick it up
+        snap = snapshot.Snapshot(path)
+        matching.MatchIndex(cardstore.CardStore().load_snapshot(snap)).load_snapshot(snap)
+        self.stdout.write("loads in %.3fs, %d bytes" % (time.time() - started, os.path.getsize(path)))
+
+        snapshot.publish(directory, path)
+        snapshot.prune(directory, options['keep'])
+        self.stdout.write("published generation %d" % generation)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.indexing import verify_mapped
+
+
+class Command(BaseCommand):
+    help = "Checks that the mapped collection is equivalent to a full rebuild from recipe.ingredients_list"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show', type=int, default=10, help="number of differing ingredients to print")
+
+    def handle(self, *args, **options):
+        differences = verify_mapped()
+        for ingredient in sorted(differences)[:options['show']]:
+            missing, extra = differences[ingredient]
+            self.stdout.write("%s: %d missing, %d extra" % (ingredient, len(missing), len(extra)))
+        if differences:
+            raise CommandError("mapped differs from a full rebuild for %d ingredients" % len(differences))
+        self.stdout.write("mapped is equivalent to a full rebuild")
@@ -0,0 +1,502 @@
+## In-process match engine ##
+# Keeps the posting lists of the mapped collection in memory as compact arrays of recipe ordinals
+# (a dense int per recipe instead of an ObjectId key, shared with the card store), so a search is
+# a pass over a few arrays instead of item_frequencies("value") followed by the get_stats round trip.
+# The lists are kept packed (packing.py), a query decodes only the ones it names and those of the
+# last queries stay decoded.
+
+import threading
+import time
+from array import array
+from bisect import insort
+from collections import Counter, OrderedDict
+from itertools import filterfalse
+
+from django.conf import settings
+
+from .models import mapped, recipe
+from account_functions.models import DEFAULT_PANTRY
+from . import ranking, cardstore, querycache, cursors, indexing, bitmaps, snapshot, packing, partitions, pantries, canonical, scoring, orderings
+
+
+class Forward(object):  # ordinal -> ingredients it is listed under, packed like the snapshot's forward sections
+    # 4 bytes a posting and 4 a recipe, where a set of names per recipe costs ~90 bytes a posting
+
+    def __init__(self, postings, size):
+        self.ingredients = sorted(postings)
+        counts = array("I", bytes(4 * size))
+        for ingredient in self.ingredients:
+            for ordinal in postings[ingredient]:
+                counts[ordinal] += 1
+        self.forward, total = array("I", [0]), 0
+        for count in counts:
+            total += count
+            self.forward.append(total)
+        self.forward_ids = array("I", bytes(4 * total))
+        filled = array("I", self.forward[:-1])  # next free slot of every ordinal
+        for number, ingredient in enumerate(self.ingredients):
+            for ordinal in postings[ingredient]:
+                self.forward_ids[filled[ordinal]] = number
+                filled[ordinal] += 1
+
+    def listed_under(self, ordinal):
+        if ordinal + 1 >= len(self.forward):
+            return set()
+        return set(self.ingredients[number] for number in self.forward_ids[self.forward[ordinal]:self.forward[ordinal + 1]])
+
+    def nbytes(self):
+        return self.forward.itemsize * len(self.forward) + self.forward_ids.itemsize * len(self.forward_ids)
+
+
+class MatchIndex(object):
+
+    def __init__(self, store):
+        self.store = store  # recipe ordinals and card columns (cardstore.py)
+        self.postings = {}  # ingredient -> sorted ordinals, packed
+        self.impact = {}  # ingredient -> the same ordinals, best possible score first (ascending ing_count), packed
+        self.staples = {}  # staple ingredient -> its bit in staple_mask
+        self.staple_mask = []  # ordinal -> bits of the staples the recipe lists
+        self.bitmaps = {}  # ingredient -> RoaringBitmap of its posting list, built on first use
+        self.decoded = OrderedDict()  # ingredient -> (packed impact, postings, impact) of the recently queried lists, decoded
+        self.decoded_size = 0  # postings held in decoded
+        self.decoded_lock = threading.Lock()
+        self.snapshot = None  # the mapped snapshot the lists come from, None when loaded from mongo
+        self.forward = None  # ordinal -> ingredients as loaded, a Forward or the snapshot
+        self.listed = {}  # ordinal -> ingredients of the recipes changed since
+        self.version = 0  # bumped whenever a list or a staple mask changes
+        self.partitions = None  # scoring processes forked from this index (partitions.py)
+        self.forked_at = 0
+        self.loaded_at = None
+
+    def load(self):
+        ## posting lists ##
+        for ingredient, recipe_ids in indexing.read_postings(mapped._get_collection()):
+            ordinals = set(self.store.ordinal(recipe_id) for recipe_id in recipe_ids)
+            self.postings[ingredient] = packing.pack(sorted(ordinals))
+
+        self.forward = Forward(self.postings, len(self.store))
+        self.order_impact()
+        self.find_staples()
+        self.loaded_at = time.time()
+        return self
+
+    def load_snapshot(self, snap):  # near zero copy, the packed lists stay in the mapped file
+        self.snapshot = self.forward = snap
+        self.postings = snapshot.Postings(snap)
+        self.impact = snap.impact()
+        self.find_staples()
+        self.loaded_at = self.checked_at = time.time()
+        return self
+
+    def find_staples(self):
+        # Staples (the default pantry, and with STAPLE_DOCUMENT_FREQUENCY anything most recipes list)
+        # have the longest posting lists and tell recipes apart the least. They are scored from a
+        # per-recipe bit mask instead of being merged, so adding "Salt" to a query costs nothing.
+        configured = canonical.canonical_set(getattr(settings, "STAPLE_INGREDIENTS", DEFAULT_PANTRY))
+        staples = set(ingredient for ingredient in configured if ingredient in self.postings)
+        frequency = getattr(settings, "STAPLE_DOCUMENT_FREQUENCY", None)
+        if frequency:  # off by default, at 0.2 Egg, Onion or Butter would stop bringing in candidates
+            common = frequency * max(len(self.store), 1)
+            staples.update(ingredient for ingredient, impact in self.impact.items() if len(impact) >= common)
+
+        self.staples = dict((ingredient, 1 << bit) for bit, ingredient in enumerate(sorted(staples)))
+        self.staple_mask = [0] * len(self.store)
+        for ingredient, bit in self.staples.items():
+            for ordinal in self.impact[ingredient]:
+                self.staple_mask[ordinal] |= bit
+
+    def staple_count(self, ordinal, mask):  # how many of the query's staples the recipe lists
+        if ordinal >= len(self.staple_mask):
+            return 0
+        return bin(self.staple_mask[ordinal] & mask).count("1")
+
+    def impact_key(self, ordinal):  # ordinal order within an ing_count keeps the impact lists packable
+        return (self.store.ing_count[ordinal], ordinal)
+
+    def order_impact(self):  # impact ordered copies of the posting lists for the pruned ranker
+        for ingredient, postings in self.postings.items():
+            self.impact[ingredient] = packing.pack(sorted(postings, key=self.impact_key))
+
+    def listed_under(self, ordinal):  # ingredients whose lists hold the ordinal
+        listed = self.listed.get(ordinal)
+        if listed is None:
+            return self.forward.listed_under(ordinal) if self.forward is not None else set()
+        return listed
+
+    def update_recipe(self, ordinal, ingredients, moved=True):
+        # Lists the recipe under exactly these ingredients and, when its ing_count changed (moved),
+        # moves it to its new place in the impact order. Only lists whose membership or order changes
+        # are repacked, not changed in place, so searches that are already running keep a consistent view.
+        if ordinal >= len(self.staple_mask):
+            self.staple_mask.extend([0] * (ordinal + 1 - len(self.staple_mask)))
+        mask = sum(self.staples.get(ingredient, 0) for ingredient in ingredients)
+        if mask != self.staple_mask[ordinal]:
+            self.staple_mask[ordinal] = mask
+            self.version += 1
+
+        touched = self.listed_under(ordinal) | ingredients
+        self.listed[ordinal] = set(ingredients)
+        for ingredient in touched:
+            packed = self.postings.get(ingredient)
+            listed = packed is not None and ordinal in packed
+            wanted = ingredient in ingredients
+            if listed == wanted and (not listed or not moved):
+                continue
+            if listed != wanted:
+                self.bitmaps.pop(ingredient, None)
+            postings = packed.decode() if packed is not None else array("I")
+            impact = self.impact[ingredient].decode() if packed is not None else array("I")
+            if listed:
+                impact.remove(ordinal)
+            else:
+                insort(postings, ordinal)
+            if wanted:
+                ranking.insort_key(impact, ordinal, self.impact_key)
+            else:
+                postings.remove(ordinal)
+            self.postings[ingredient], self.impact[ingredient] = packing.pack(postings), packing.pack(impact)
+            self.version += 1
+
+    def lists(self, ingredient):
+        # (postings, impact) of an ingredient, decoded. A query would otherwise decode the whole of every
+        # list it names before the ranker can skip anything, so the lists of the last queries are kept,
+        # up to MATCH_DECODED_POSTINGS postings, until they are repacked. Read only, callers copy.
+        packed = self.impact[ingredient]
+        with self.decoded_lock:
+            entry = self.decoded.get(ingredient)
+            if entry is not None and entry[0] is packed:
+                self.decoded.move_to_end(ingredient)
+                return entry[1], entry[2]
+        postings, impact = self.postings[ingredient].decode(), packed.decode()
+        limit = getattr(settings, "MATCH_DECODED_POSTINGS", 2000000)
+        if len(impact) <= limit:
+            with self.decoded_lock:
+                old = self.decoded.pop(ingredient, None)
+                if old is not None:
+                    self.decoded_size -= len(old[2])
+                self.decoded[ingredient] = (packed, postings, impact)
+                self.decoded_size += len(impact)
+                while self.decoded_size > limit:
+                    self.decoded_size -= len(self.decoded.popitem(last=False)[1][2])
+        return postings, impact
+
+    def tiebreak(self, ordinal):  # the recipe id last, ordinals differ between workers and reloads
+        return (self.store.clicks[ordinal], self.store.rating[ordinal], self.store.recipe_ids[ordinal])
+
+    def extra(self, mask, added=None):  # (extra, extra_max) for the ranker: the query's staples, then the pantry at its weight
+        if added is None:
+            return ((lambda ordinal: self.staple_count(ordinal, mask)) if mask else None), bin(mask).count("1")
+        count, most, weight = added
+        return (lambda ordinal: self.staple_count(ordinal, mask) + weight * count(ordinal)), bin(mask).count("1") + weight * most
+
+    def card(self, ordinal, frequency):  # card in the shape mappedQuerysSet.join produces
+        card = self.store.card(ordinal)
+        card["frequency"] = frequency
+        card["ratio"] = int(100 * frequency / max(card["ing_count"], 1))
+        return card
+
+    def split_staples(self, ingredients):  # (ingredients whose lists are merged, mask of the staples scored from bits)
+        ingredients = [ingredient for ingredient in set(ingredients) if ingredient in self.postings]
+        merged = [ingredient for ingredient in ingredients if ingredient not in self.staples]
+        if not merged:  # only staples, they are all there is to match on
+            return ingredients, 0
+        return merged, sum(self.staples[ingredient] for ingredient in ingredients if ingredient in self.staples)
+
+    def restrict(self, postings, impact, required, excluded):  # the lists cut down to the allowed recipes, before scoring
+        if required:
+            allowed = set(self.candidates(all_of=required, none_of=excluded)).__contains__
+            keep = lambda ordinals: array("I", filter(allowed, ordinals))
+        else:
+            forbidden = set(self.candidates(any_of=excluded)).__contains__
+            keep = lambda ordinals: array("I", filterfalse(forbidden, ordinals))
+        return [keep(ordinals) for ordinals in postings], [keep(ordinals) for ordinals in impact]
+
+    def scored(self, postings, extra, k):  # top k by a weighted formula, which the pruned ranker has no bound for
+        counts = Counter()
+        for ordinals in postings:
+            counts.update(ordinals)
+        ordinals = sorted(counts)
+        frequencies = [counts[ordinal] + extra(ordinal) for ordinal in ordinals] if extra else [counts[ordinal] for ordinal in ordinals]
+        return scoring.formula.top(self.store, ordinals, frequencies, k)
+
+    def ranked(self, ingredients, mask, k, required=(), excluded=(), added=None):  # (key, ordinal, frequency) best first
+        if not required and not excluded and added is None and not scoring.formula.weighted:
+            scattered = partitions.scatter(self, ingredients, mask, k)
+            if scattered is not None:  # partial top k lists scored without the tiebreak, finish them here
+                return ranking.top_k(((score + self.tiebreak(ordinal), ordinal, frequency)
+                                      for score, ordinal, frequency in scattered), k, key=lambda entry: entry[0])
+
+        lists = [self.lists(ingredient) for ingredient in ingredients]
+        postings, impact = [p for p, i in lists], [i for p, i in lists]
+        if required or excluded:
+            postings, impact = self.restrict(postings, impact, required, excluded)
+        extra, extra_max = self.extra(mask, added)
+        if scoring.formula.weighted:
+            return self.scored(postings, extra, k)
+        return ranking.pruned_top_k(postings, impact, self.store.ing_count, self.tiebreak, k, extra, extra_max)
+
+    def cards(self, ranked, added=None):  # [id, card] pairs of (key, ordinal, frequency) entries
+        result = []
+        for key, ordinal, frequency in ranked:
+            if self.store.alive(ordinal):  # listed in mapped but no longer in recipe
+                if added is not None:  # scored at the pantry weight, but the user has every one of them
+                    count, most, weight = added
+                    frequency = int(round(frequency + (1 - weight) * count(ordinal)))
+                result.append((self.store.recipe_ids[ordinal], self.card(ordinal, frequency)))
+        return result
+
+    def added(self, pantry, ingredients, mask):  # (count, most, weight) of the pantry ingredients the query leaves out
+        if pantry is None:
+            return None
+        return pantry.matches(ingredients, mask) + (pantry.weight,)
+
+    def top(self, ingredients, k, required=(), excluded=(), pantry=None):  # exact top k [id, card] pairs
+        ingredients, mask = self.split_staples(ingredients)
+        added = self.added(pantry, ingredients, mask)
+        return self.cards(self.ranked(ingredients, mask, k, required, excluded, added), added)
+
+    def covered(self, ingredients, missing=None, coverage=None, required=(), excluded=(), added=None):
+        # (ordinals, frequencies) of every recipe the ingredients cover: missing at most `missing` of
+        # its ing_count and matched to at least `coverage` percent, from one counting pass. A recipe
+        # can't match more ingredients than the query has, so only the impact order prefix with an
+        # ing_count that could still pass is counted, the staples' lists too: a recipe of staples alone
+        # is covered as well. Pantry ingredients count in full towards the cover, at their weight
+        # towards the score.
+        present = set(ingredient for ingredient in ingredients if ingredient in self.postings)
+        count, most, weight = added or (None, 0, 1)
+        matched = len(present) + most
+        limit = cardstore.MISSING - 1
+        if missing is not None:
+            limit = min(limit, matched + missing)
+        if coverage:
+            limit = min(limit, int(100 * matched / coverage))
+
+        ing_count = self.store.ing_count.__getitem__
+        prefixes = []
+        for ingredient in present:
+            impact = self.lists(ingredient)[1]
+            prefixes.append(impact[:ranking.bisect_key(impact, limit, ing_count)])
+        if required or excluded:
+            prefixes = self.restrict([], prefixes, required, excluded)[1]
+
+        counts = Counter()
+        for prefix in prefixes:
+            counts.update(prefix)
+        ordinals, frequencies = [], []
+        for ordinal, frequency in counts.items():
+            have = frequency + count(ordinal) if count else frequency
+            ing = ing_count(ordinal)
+            if (missing is None or ing - have <= missing) and (not coverage or 100 * have >= coverage * ing):
+                ordinals.append(ordinal)
+                frequencies.append(frequency + weight * (have - frequency))
+        return ordinals, frequencies
+
+    def bitmap(self, ingredient):
+        bitmap = self.bitmaps.get(ingredient)
+        if bitmap is None:
+            postings = self.postings.get(ingredient)
+            bitmap = bitmaps.RoaringBitmap.from_sorted(postings.decode() if postings else ()).run_optimize()
+            self.bitmaps[ingredient] = bitmap
+        return bitmap
+
+    def candidates(self, any_of=(), all_of=(), none_of=()):  # set algebra over the posting lists
+        result = bitmaps.RoaringBitmap.union(self.bitmap(ingredient) for ingredient in set(any_of))
+        if all_of:
+            required = bitmaps.RoaringBitmap.intersection([self.bitmap(ingredient) for ingredient in set(all_of)])
+            result = required if not any_of else result & required
+        if none_of:
+            result = result - bitmaps.RoaringBitmap.union(self.bitmap(ingredient) for ingredient in set(none_of))
+        return result
+
+    def total(self, ingredients, required=(), excluded=()):  # number of candidates, for the paginator
+        return len(self.candidates(self.split_staples(ingredients)[0], required, excluded))
+
+    def ordered(self, sort, ordinals, k, frequency, added=None):  # [id, card] pairs of the first k ordinals by a sort column
+        first = orderings.get_orderings(self.store).top(sort, ordinals, k)
+        return self.cards([(None, ordinal, frequency(ordinal)) for ordinal in first], added)
+
+    def frequency(self, ingredients, added):  # ordinal -> what the ranker would have counted for it
+        merged, mask = self.split_staples(ingredients)
+        extra = self.extra(mask, added)[0]
+        return lambda ordinal: sum(1 for ingredient in merged if ordinal in self.bitmap(ingredient)) + (extra(ordinal) if extra else 0)
+
+    def search(self, ingredients, required=(), excluded=(), missing=None, coverage=None, pantry=None, sort=None):
+        # required ingredients must be among the ingredients, missing or coverage switch to subset matching,
+        # pantry is the user's Pantry (pantries.py), sort one of orderings.SORTS instead of the match score
+        if missing is not None or coverage:
+            covered = [None, None]  # counted once, on the first page asked for
+            added = self.added(pantry, *self.split_staples(ingredients))
+
+            def qualifying():
+                if covered[0] is None:
+                    covered[0] = self.covered(ingredients, missing, coverage, required, excluded, added)
+                return covered[0]
+
+            def frequency(ordinal):
+                if covered[1] is None:
+                    covered[1] = dict(zip(*qualifying()))
+                return covered[1][ordinal]
+
+            if sort:
+                return ranking.LazyRankedResult(lambda k: self.ordered(sort, qualifying()[0], k, frequency, added),
+                                                lambda: len(qualifying()[0]))
+            return ranking.LazyRankedResult(lambda k: self.cards(scoring.formula.top(self.store, *qualifying(), k=k), added),
+                                            lambda: len(qualifying()[0]))
+        if sort:
+            added = self.added(pantry, *self.split_staples(ingredients))
+            candidates = lambda: self.candidates(self.split_staples(ingredients)[0], required, excluded)
+            return ranking.LazyRankedResult(lambda k: self.ordered(sort, candidates(), k, self.frequency(ingredients, added), added),
+                                            lambda: self.total(ingredients, required, excluded))
+        return ranking.LazyRankedResult(lambda k: self.top(ingredients, k, required, excluded, pantry),
+                                        lambda: self.total(ingredients, required, excluded))
+
+
+##### WORKER SINGLETON #####
+_index = None
+_lock = threading.Lock()
+_reloading = threading.Lock()  # held by the thread building the next index
+
+
+def load_index():
+    # the next index on a card store of its own, from the published snapshot when there is one,
+    # otherwise from mongo. Nothing is published here, requests keep using the current index and
+    # store until swap().
+    path = snapshot.published()
+    if path is not None:
+        try:
+            snap = snapshot.Snapshot(path)
+            return MatchIndex(cardstore.CardStore().load_snapshot(snap)).load_snapshot(snap)
+        except Exception as e:
+            print("index snapshot %s unusable, loading from mongo: " % path, e)
+    return MatchIndex(cardstore.CardStore().load()).load()
+
+
+def stale(index):
+    if index.snapshot is None:  # rebuilt now and then, drops the dead ordinals and picks up a rebuilt mapped (buildmapped)
+        return time.time() - index.loaded_at > getattr(settings, "MATCH_INDEX_RELOAD", 600)
+    if time.time() - index.checked_at > getattr(settings, "MATCH_SNAPSHOT_CHECK", 5):  # a newer one published?
+        index.checked_at = time.time()
+        return snapshot.published() != index.snapshot.path
+    return False
+
+
+def swap(index):  # makes index the one searches use, the caller holds _lock
+    global _index
+    old, _index = _index, index  # swapping the reference is all a running search sees
+    cardstore.reset_store(index.store)  # saves made while it loaded come back through its first refresh
+    querycache.reset()
+    pantries.cache.clear()
+    cursors.table.clear()  # their live results hold the old index, the next page ranks again under the same id
+    if old is not None and old.partitions is not None:
+        old.partitions.close()
+
+
+def reload(index):  # runs in a thread of its own, searches keep using index until the next one is loaded
+    try:
+        fresh = load_index()
+        with _lock:
+            if _index is index:
+                swap(fresh)
+    except Exception as e:
+        print("match index reload failed, keeping the loaded one: ", e)
+        index.loaded_at = time.time()  # tried again after MATCH_INDEX_RELOAD
+    finally:
+        _reloading.release()
+
+
+def get_index():
+    index = _index
+    if index is None:  # nothing to search yet, the first load is waited for
+        with _lock:
+            if _index is None:
+                swap(load_index())
+            index = _index
+    elif stale(index) and _reloading.acquire(False):
+        threading.Thread(target=reload, args=(index,), daemon=True).start()
+
+    cardstore.get_store()  # incremental refresh of the card columns, changed recipes come back through recipe_changed
+    return index
+
+
+def recipe_changed(store, ordinal, ingredients, old):  # card store listener
+    index = _index
+    if index is not None and index.store is store:
+        ingredients = set(ingredients) if store.alive(ordinal) else set()
+        listed = index.listed_under(ordinal)  # before the update, what the cached results were ranked with
+        moved = old is None or not store.alive(ordinal) or old[2] != store.ing_count[ordinal]
+        if moved or listed != ingredients:  # the queries of the lists it left as well as the ones it joined
+            querycache.cache.invalidate(listed | ingredients)
+        index.update_recipe(ordinal, ingredients, moved)
+
+
+def search(ingredients, required=(), excluded=(), missing=None, coverage=None, pantry=None, sort=None):
+    # ranked [id, card] sequence for the paginator. Recipes have to list every required ingredient and
+    # none of the excluded ones, required ingredients are matched and scored like the others. With
+    # missing or coverage set only recipes the ingredients (nearly) cover are returned: at most missing
+    # of their ingredients not in the query, at least coverage percent of them in it. pantry is a user
+    # id whose pantry counts too (pantries.py), the mongo path ranks without it. sort lists the recipes by
+    # one of orderings.SORTS instead, the mongo path only by rating or clicks.
+    ingredients = list(ingredients) + list(required)
+    if getattr(settings, "MATCH_ENGINE", True):
+        try:
+            index = get_index()
+            pantry = pantries.cache.get(pantry, index)
+            if pantry is not None and not pantry.ingredients:
+                pantry = None
+            key = querycache.query_key(ingredients, required=required, excluded=excluded, missing=missing,
+                                       coverage=coverage, pantry=pantry and pantry.ingredients, sort=sort)
+            result = querycache.cache.get(key)
+            if result is None:
+                result = index.search(querycache.query_key(ingredients), querycache.query_key(required),
+                                      querycache.query_key(excluded), missing, coverage, pantry, sort)
+                querycache.cache.put(key, result)
+            return result
+        except Exception as e:  # fall back to the mongo path if the index can't be built
+            print("match engine unavailable, using mapped.key_frequency: ", e)
+
+    collection = mapped._get_collection()
+    items = mapped.objects(__raw__=indexing.ingredient_query(collection, ingredients)).only('value').key_frequency().items()
+    if required or excluded:  # same constraints on the mongo path, from the buckets of the constrained ingredients
+        constrained = set(required) | set(excluded)
+        listed = dict((ingredient, set(ids)) for ingredient, ids in indexing.read_postings(collection, constrained))
+        items = [(recipe_id, card) for recipe_id, card in items
+                 if all(recipe_id in listed.get(ingredient, ()) for ingredient in required) and
+                 not any(recipe_id in listed.get(ingredient, ()) for ingredient in excluded)]
+    if missing is not None or coverage:
+        items = [(recipe_id, card) for recipe_id, card in items
+                 if (missing is None or card["ing_count"] - card["frequency"] <= missing) and
+                 (not coverage or card["ratio"] >= coverage)]
+    if sort in ("rating", "clicks"):
+        return ranking.RankedResult(items, key=lambda item: item[1][sort])
+    return ranking.RankedResult(items)
+
+
+_no_postings = {}
+
+
+def postings():  # ingredient -> recipes of the loaded index, for ranking names by use; empty with MATCH_ENGINE off
+    if getattr(settings, "MATCH_ENGINE", True):
+        try:
+            return get_index().postings
+        except Exception as e:
+            print("match engine unavailable, ranking names without it: ", e)
+    return _no_postings  # always the same dict, so caches built on it aren't rebuilt
+
+
+def popular(n):  # [id, card] pairs of the n most clicked recipes, for the start page
+    if getattr(settings, "MATCH_ENGINE", True):
+        try:
+            get_index()  # refreshes the card store, and with it the clicks permutation (orderings.py)
+            return orderings.leading(cardstore.get_store(), "clicks", n)
+        except Exception as e:
+            print("match engine unavailable, querying recipe: ", e)
+
+    result = []
+    for doc in recipe._get_collection().find({}, cardstore.CARD_FIELDS).sort("clicks", -1).limit(n):  # the -clicks index
+        result.append((doc["_id"], {"clicks": doc.get("clicks", 1), "rating": cardstore.average_rating(doc.get("rating")),
+                                    "title": doc.get("title"), "ing_count": len(doc.get("ingredients_complete") or []),
+                                    "image": doc.get("image")}))
+    return result
+
+
+cardstore.listeners.append(recipe_changed)
@@ -1,9 +1,9 @@
 from mongoengine import *
 from mongoengine import queryset_manager
 import time
+import heapq
 from django import forms
 from .models import *
-from collections import OrderedDict
 from datetime import datetime
 from django.contrib import admin
 
@@ -13,9 +13,15 @@ class mappedQuerysSet(QuerySet):  # Work similar to item_frequency and mapreduce
 
     def get_stats(keys):
 
+        try:
+            from .cardstore import get_store #imported here since cardstore imports this module
+            return get_store().cards(keys) #reads the resident card columns, no round trip
+        except Exception as e:
+            print("card store unavailable, querying recipe: ", e)
+
         reduced_result = {}
         start = time.time()
-        clicks_rating = recipe.objects.filter(id__in=keys).exclude('ingredients_list').exclude('directions')#Exclude speeds up the query process
+        clicks_rating = recipe.unordered.filter(id__in=keys).exclude('ingredients_list').exclude('directions')#Exclude speeds up the query process
         for item in clicks_rating:
 
             reduced_result[item.id] = {"clicks": item.clicks, "rating": item.rating, "title": item.title, "ing_count": len(item.ingredients_complete), "image": item.image}
@@ -33,13 +39,20 @@ class mappedQuerysSet(QuerySet):  # Work similar to item_frequency and mapreduce
 
         return reduced_result
 
+    def buckets(self, ingredient, first=None, last=None): #only the buckets of an ingredient that overlap [first, last]
+        query = self.filter(ingredient=ingredient)
+        if first is not None:
+            query = query.filter(last__gte=first)
+        if last is not None:
+            query = query.filter(first__lte=last)
+        return query.order_by('bucket')
+
     def key_frequency(self): #maybe to be renamed
 
         freq = self.item_frequencies("value") ##key frequency
-        freq = OrderedDict(reversed(sorted(freq.items(),key=lambda x: (x[1])))) ##sorts by key frequency
 
 
-        query_keys = list(freq.keys())[0:1000]
+        query_keys = [key for key, count in heapq.nlargest(1000, freq.items(), key=lambda x: x[1])] ##1000 most frequent keys, without sorting all of them
 
 
         reduced_result = mappedQuerysSet.get_stats(query_keys)
@@ -102,27 +115,54 @@ class recipe(DynamicDocument):
     author = StringField(default='By MealMatch')
     comments = ListField(EmbeddedDocumentField('Comment'))
     pictures = StringField()
+    modified = DateTimeField() #change marker, the card store refreshes everything saved after its last refresh
     #id = ObjectIdField(primary_key=True)
 
-    meta = {'strict': False}  # What is this?
+    meta = {'strict': False, 'indexes': ['-clicks']}  # What is this? -clicks serves the ordered listings from the index
+
+    def save(self, *args, **kwargs):
+        self.modified = datetime.now()
+        return super(recipe, self).save(*args, **kwargs)
 
     @queryset_manager
-    def objects(self, queryset): #sets default ordering when calling 'objects' on a collection
+    def objects(self, queryset): #sets default ordering when calling 'objects' on a collection, for listings
 
         return queryset.order_by("-clicks")
 
+    @queryset_manager
+    def unordered(self, queryset): #point and batch lookups (get, id__in), mongo doesn't sort what nobody needs sorted
+
+        return queryset
+
 #class Recipes(models.Model):
         #user = models.ForeignKey(settings.AUTH_USER_MODEL, default=1)
 
+class deleted_recipe(Document): #tombstone, the card stores of the other workers drop the recipe on their next refresh (cardstore.py)
+    recipe_id = ObjectIdField(required=True)
+    deleted = DateTimeField(required=True)
+    meta = {'indexes': [{'fields': ['deleted'], 'expireAfterSeconds': 7 * 86400}]}  # a worker is reloaded well within a week
+
 ## mapped models ##
 class mapped_id(Document):
     id = ObjectIdField(primary_key=True)
 
-class mapped(Document):
-    value = ListField(ObjectIdField(primary_key=True))
+class mapped(Document): #one bucket of an ingredient's posting list, see indexing.py
+    ingredient = StringField(required=True)
+    bucket = IntField(default=0) #sequence number within the ingredient
+    count = IntField(default=0)
+    first = ObjectIdField() #smallest and largest recipe id the bucket covers
+    last = ObjectIdField()
+    value = ListField(ObjectIdField()) #sorted recipe ids
     #value = ListField(EmbeddedDocumentField('mapped_id'))
     #value = DictField() <--- restore this to get working queryset
-    meta = {'queryset_class': mappedQuerysSet}  # Defines a custom queryet
+    meta = {'queryset_class': mappedQuerysSet, 'indexes': [{'fields': ['ingredient', 'bucket'], 'unique': True}, 'value'],
+            'auto_create_index': False}  # Defines a custom queryet, value is indexed for the incremental updates in indexing.py, the indexes are built by buildmapped (indexing.migrate_mapped)
+
+class cookable_feed(Document): #materialized "cook now" feed of a user, the recipes their pantry covers, see cookable.py
+    user_id_reference = IntField(unique=True)
+    pantry = ListField(StringField()) #sorted, the pantry the feed was computed for
+    entries = ListField(DictField()) #ranked {recipe: id, score, clicks, rating}, the rank key each recipe joined with
+    meta = {'indexes': ['pantry', 'entries.recipe']}  # multikey, saved recipes find the feeds they join or leave
 
 class food_ref(Document):
     food = StringField(required=True)
@@ -0,0 +1,107 @@
+## Alternative result orderings ##
+# ?sort=rating, clicks or time lists a search's candidates by one card column instead of by match
+# score. Every sortable column keeps a permutation of all recipe ordinals, best first (order: rank ->
+# ordinal), and its inverse (rank: ordinal -> rank), both compact array("I")s built once per card
+# store. A sorted page is then the k smallest ranks among the candidates, one heapq.nsmallest over
+# ints, whatever the filters left. The card store listener keeps them current: a changed recipe is
+# taken out and bisected back in, and only the ranks between its old and new place are renumbered.
+
+import heapq
+import threading
+from array import array
+
+from . import cardstore, ranking
+
+
+SORTS = {  # name -> sort value of an ordinal, smallest first
+    "rating": lambda store, ordinal: -store.rating[ordinal],
+    "clicks": lambda store, ordinal: -store.clicks[ordinal],
+    "time": lambda store, ordinal: store.minutes[ordinal],
+}
+
+
+class Ordering(object):  # one column's permutation
+
+    def __init__(self, store, value):
+        self.store = store
+        self.value = value
+        self.order = array("I", sorted(range(len(store)), key=self.key))
+        self.rank = array("I", bytes(4 * len(store)))
+        for position, ordinal in enumerate(self.order):
+            self.rank[ordinal] = position
+
+    def key(self, ordinal):  # recipes without a document last, ties by ordinal
+        return (not self.store.alive(ordinal), self.value(self.store, ordinal), ordinal)
+
+    def move(self, ordinal):  # puts a recipe new to the store, or one whose value changed, in its place
+        if ordinal < len(self.rank):
+            old = self.rank[ordinal]
+            del self.order[old]
+        else:
+            old = len(self.order)
+            self.rank.append(old)
+        new = ranking.bisect_key(self.order, self.key(ordinal), self.key)
+        self.order.insert(new, ordinal)
+        for position in range(min(old, new), max(old, new) + 1):
+            self.rank[self.order[position]] = position
+
+    def top(self, ordinals, k):  # the first k of the ordinals in this order
+        order = self.order
+        return [order[position] for position in heapq.nsmallest(k, map(self.rank.__getitem__, ordinals))]
+
+
+class Orderings(object):  # the permutations of one card store
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()  # a move leaves the permutation inconsistent for a moment
+        self.orderings = dict((name, Ordering(store, value)) for name, value in SORTS.items())
+
+    def grow(self):  # ordinals the store made without a listener call, ids only a posting list knows
+        for ordering in self.orderings.values():
+            while len(ordering.rank) < len(self.store):
+                ordering.move(len(ordering.rank))
+
+    def changed(self, ordinal):
+        with self.lock:
+            self.grow()
+            for ordering in self.orderings.values():
+                ordering.move(ordinal)
+
+    def top(self, sort, ordinals, k):
+        with self.lock:
+            self.grow()
+            return self.orderings[sort].top(ordinals, k)
+
+    def first(self, sort, n):  # the first n recipes of the whole store
+        with self.lock:
+            self.grow()
+            return list(self.orderings[sort].order[:n])
+
+
+##### WORKER SINGLETON #####
+_orderings = None
+_lock = threading.Lock()
+
+
+def get_orderings(store):  # built on first use, again whenever the card store was reloaded
+    global _orderings
+    if _orderings is None or _orderings.store is not store:
+        with _lock:
+            if _orderings is None or _orderings.store is not store:
+                _orderings = Orderings(store)
+    return _orderings
+
+
+def leading(store, sort, n):  # [id, card] pairs of the n first recipes in the store, e.g. the most clicked
+    first = get_orderings(store).first(sort, n)
+    return [(store.recipe_ids[ordinal], store.card(ordinal)) for ordinal in first if store.alive(ordinal)]
+
+
+def recipe_changed(store, ordinal, ingredients, old):  # card store listener
+    orderings = _orderings
+    if orderings is not None and orderings.store is store:
+        orderings.changed(ordinal)
+
+
+cardstore.listeners.append(recipe_changed)
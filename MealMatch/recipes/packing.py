@@ -0,0 +1,95 @@
+## Packed posting lists ##
+# Ordinal lists are stored as blocks of up to 128 values: a header (first value, byte width of the
+# gaps, gap count) followed by the gaps to the previous value at 1, 2 or 4 bytes each, the smallest
+# width that holds every gap of the block. Recipe ordinals are dense, so most blocks pack to about
+# a byte per posting, against 4 in an array and 12 for an ObjectId in mapped.value. Decoding a
+# block is one array.frombytes and one itertools.accumulate, both in C, so a list decodes in a step
+# per block and not per posting. A block also ends where the values go down, so the impact lists
+# (ascending ordinals within each ing_count) pack the same way.
+
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain
+from operator import sub
+
+
+BLOCK = 128
+HEADER = struct.Struct("=IBB")  # first value, gap width, number of gaps
+_TYPECODES = {1: "B", 2: "H", 4: "I"}
+
+
+def _width(gaps):
+    largest = max(gaps) if gaps else 0
+    return 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+
+
+def pack(values):
+    values = array("I", values)
+    gaps = list(map(sub, values[1:], values))  # gaps[i] leads from values[i] to values[i + 1]
+    starts = [0] + [i + 1 for i, gap in enumerate(gaps) if gap < 0] + [len(values)]  # ascending runs
+
+    data = bytearray()
+    for start, end in zip(starts, starts[1:]):
+        for block in range(start, end, BLOCK):
+            block_gaps = gaps[block:min(block + BLOCK, end) - 1]
+            width = _width(block_gaps)
+            data += HEADER.pack(values[block], width, len(block_gaps))
+            data += array(_TYPECODES[width], block_gaps).tobytes()
+    return PackedList(bytes(data), len(values))
+
+
+def _blocks(data):  # (offset, first value, width, count) of every block
+    position, size = 0, len(data)
+    while position < size:
+        first, width, count = HEADER.unpack_from(data, position)
+        yield position, first, width, count
+        position += HEADER.size + width * count
+
+
+def unpack(data):
+    values = array("I")
+    for position, first, width, count in _blocks(data):
+        gaps = array(_TYPECODES[width])
+        start = position + HEADER.size
+        gaps.frombytes(data[start:start + width * count])
+        values.extend(accumulate(chain((first,), gaps)))
+    return values
+
+
+class PackedList(object):  # read only sequence of ordinals, packed
+
+    __slots__ = ("data", "length", "index")
+
+    def __init__(self, data, length):
+        self.data = data  # bytes, or a memoryview into a snapshot
+        self.length = length
+        self.index = None  # (first values, offsets) of the blocks, built on the first membership probe
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(unpack(self.data))
+
+    def decode(self):
+        return unpack(self.data)
+
+    def nbytes(self):
+        return len(self.data)
+
+    def __contains__(self, value):  # ascending lists only, decodes the one block that can hold value
+        if self.index is None:
+            firsts, offsets = array("I"), array("I")
+            for position, first, width, count in _blocks(self.data):
+                firsts.append(first)
+                offsets.append(position)
+            offsets.append(len(self.data))
+            self.index = (firsts, offsets)
+        firsts, offsets = self.index
+        i = bisect_right(firsts, value) - 1
+        if i < 0:
+            return False
+        block = unpack(self.data[offsets[i]:offsets[i + 1]])
+        j = bisect_left(block, value)
+        return j < len(block) and block[j] == value
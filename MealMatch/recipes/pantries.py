@@ -0,0 +1,84 @@
+## Pantry-aware matching ##
+# With ?pantry=1 the ingredients in the signed-in user's pantry count towards a recipe's score, at
+# PANTRY_WEIGHT each instead of 1 for an ingredient of the query. They raise the recipes the query
+# matches and don't make new ones candidates, so a pantry of staples doesn't list every recipe. A
+# pantry is kept per user, normalized against the index: the staple bits it holds and its other
+# ingredients, whose lists a search reads as the index's shared bitmaps, so a search neither fetches
+# the Profile nor merges the pantry's posting lists. editpantry drops the user's entry, and an entry
+# built against an older index is built again from the ingredients it already has.
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from account_functions.models import Profile
+from . import canonical
+
+
+class Pantry(object):  # a user's pantry normalized against one index
+
+    def __init__(self, index, listed):
+        self.index = index
+        self.listed = list(listed)  # as stored in the profile
+        present = set(ingredient for ingredient in canonical.canonical_set(self.listed) if ingredient in index.postings)
+        self.ingredients = tuple(sorted(present))  # what the index knows of, part of the query cache key
+        self.staples = sum(index.staples.get(ingredient, 0) for ingredient in present)
+        self.others = tuple(sorted(present - set(index.staples)))  # counted from index.bitmap, kept current by update_recipe
+        self.weight = getattr(settings, "PANTRY_WEIGHT", 0.5)
+
+    def matches(self, ingredients, mask):
+        # (count(ordinal), most): how many pantry ingredients a recipe lists that the query doesn't name,
+        # and the most any recipe can list. ingredients and mask are the query split by split_staples.
+        query = set(ingredients)
+        staples = self.staples & ~mask & ~sum(self.index.staples.get(ingredient, 0) for ingredient in query)
+        others = [self.index.bitmap(ingredient) for ingredient in self.others if ingredient not in query]
+        staple_count = self.index.staple_count
+        count = lambda ordinal: staple_count(ordinal, staples) + sum(ordinal in bitmap for bitmap in others)
+        return count, bin(staples).count("1") + len(others)
+
+
+class PantryCache(object):  # user id -> Pantry, LRU with a TTL so edits made in other workers show up
+
+    def __init__(self, maxsize=4096, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # user id -> (expires, pantry), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, user_id, index):  # the user's Pantry for index, None for anonymous users
+        if user_id is None:
+            return None
+        listed, expires = None, None
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] >= time.time():
+                self.entries.move_to_end(user_id)
+                expires, pantry = entry
+                if pantry.index is index:  # the staples are fixed per index, the bitmaps follow its updates
+                    return pantry
+                listed = pantry.listed  # the index was reloaded, the profile didn't change
+
+        if listed is None:
+            profile = Profile.objects(user_id_reference=user_id).only("Pantry").first()
+            listed = profile.Pantry if profile is not None else []
+            expires = time.time() + self.ttl
+        pantry = Pantry(index, listed)
+        with self.lock:
+            self.entries[user_id] = (expires, pantry)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return pantry
+
+    def invalidate(self, user_id):  # the pantry was edited
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+cache = PantryCache(getattr(settings, "PANTRY_CACHE_SIZE", 4096), getattr(settings, "PANTRY_CACHE_TTL", 300))
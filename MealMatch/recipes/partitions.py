@@ -0,0 +1,136 @@
+## Partitioned scoring across cores ##
+# A broad query (think flour and eggs) is still scored on one core under the GIL. With
+# MATCH_PARTITIONS set, a worker forks that many scoring processes from its loaded index, each
+# owning one range of recipe ordinals: it keeps its share of the posting lists decoded and answers
+# with the partial top k of its range, which the worker merges. The processes see the index as it
+# was at the fork, so after a save changes the lists queries run serially until the set is forked
+# again. Clicks and ratings move all the time, so a partition scores without them and sends every
+# candidate tied with its k-th score; the worker breaks the ties with its own, current columns.
+
+import multiprocessing
+import multiprocessing.connection
+import queue
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+from . import ranking
+
+
+def serve(index, lo, hi, channels, inherited):  # runs in the forked process until the worker closes its pipes
+    for other in inherited:  # worker ends of the pipes, this process's own too, or they never see EOF
+        other.close()
+    lists = {}  # ingredient -> (postings, impact) of the range, decoded once
+
+    def partition_lists(ingredient):
+        if ingredient not in lists:
+            postings = index.postings[ingredient].decode()
+            postings = postings[bisect_left(postings, lo):bisect_left(postings, hi)]
+            lists[ingredient] = (postings, array("I", sorted(postings, key=index.impact_key)))
+        return lists[ingredient]
+
+    channels = list(channels)
+    while channels:
+        for connection in multiprocessing.connection.wait(channels):
+            try:
+                ingredients, mask, k = connection.recv()
+            except EOFError:
+                channels.remove(connection)
+                continue
+            parts = [partition_lists(ingredient) for ingredient in ingredients]
+            extra = (lambda ordinal: index.staple_count(ordinal, mask)) if mask else None
+            connection.send(ranking.pruned_top_k([p for p, i in parts], [i for p, i in parts], index.store.ing_count,
+                                                 lambda ordinal: (), k, extra, bin(mask).count("1"), ties=True))
+
+
+class Partitions(object):
+
+    def __init__(self, index, count, channels=4):
+        # channels are sets of pipes, one to every process, each carrying one scatter at a time, so
+        # that many of the worker's threads can have a query in the processes at once
+        self.version = index.version  # lists the processes were forked with
+        self.closed = False
+        self.free = queue.Queue()
+        context = multiprocessing.get_context("fork")  # the index is inherited, not pickled
+        size = len(index.store) // count + 1
+        self.processes, self.channels = [], [[] for channel in range(channels)]
+        for part in range(count):
+            lo, hi = part * size, (part + 1) * size if part < count - 1 else 1 << 32
+            pipes = [context.Pipe() for channel in self.channels]
+            for channel, (connection, child) in zip(self.channels, pipes):
+                channel.append(connection)
+            inherited = [connection for channel in self.channels for connection in channel]
+            process = context.Process(target=serve, args=(index, lo, hi, [child for connection, child in pipes], inherited),
+                                      daemon=True)
+            process.start()
+            for connection, child in pipes:
+                child.close()
+            self.processes.append(process)
+        for channel in self.channels:
+            self.free.put(channel)
+
+    def top(self, ingredients, mask, k):  # union of the partial top k lists, ties included
+        channel = self.free.get()
+        try:
+            if self.closed:
+                return None
+            for connection in channel:
+                connection.send((ingredients, mask, k))
+            return [entry for connection in channel for entry in connection.recv()]
+        finally:
+            self.release(channel)
+
+    def release(self, channel):  # back to the free channels, closed once the set is
+        if self.closed:
+            for connection in channel:
+                connection.close()
+        self.free.put(channel)
+
+    def close(self):
+        self.closed = True
+        for channel in self.channels:  # the ones in use are closed by their scatter as it releases them
+            try:
+                self.release(self.free.get(timeout=1))
+            except queue.Empty:
+                break
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+
+
+_fork_lock = threading.Lock()
+
+
+def scatter(index, ingredients, mask, k):
+    # [(score, ordinal, frequency)] holding the top k by score and every tie, or None when the query
+    # should run serially: partitioning is off, the query is too narrow to pay for the round trip, or
+    # the processes are behind the index
+    count = getattr(settings, "MATCH_PARTITIONS", 0)
+    if count < 2 or sum(len(index.postings[ingredient]) for ingredient in ingredients) < \
+            getattr(settings, "MATCH_PARTITION_MIN_POSTINGS", 50000):
+        return None
+
+    partitions = index.partitions
+    if partitions is None or partitions.closed or partitions.version != index.version:
+        with _fork_lock:
+            partitions = index.partitions
+            if partitions is not None and not partitions.closed and partitions.version == index.version:
+                pass  # forked by another thread meanwhile
+            elif partitions is None or time.time() - index.forked_at > getattr(settings, "MATCH_PARTITION_REFORK", 30):
+                if partitions is not None:
+                    partitions.close()
+                index.partitions = partitions = Partitions(index, count, getattr(settings, "MATCH_PARTITION_CHANNELS", 4))
+                index.forked_at = time.time()
+            else:
+                return None
+
+    try:
+        return partitions.top(ingredients, mask, k)
+    except (EOFError, OSError) as e:  # a scoring process died, score here until the next fork
+        print("partitioned scoring failed, running serially: ", e)
+        partitions.close()
+        return None
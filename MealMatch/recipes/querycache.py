@@ -0,0 +1,136 @@
+## Ranked result cache ##
+# The same ingredient searches come in all day, so ranked results are kept per worker, keyed on the
+# sanitized, deduplicated and sorted ingredient set. Size-bounded LRU with a TTL; entries are dropped
+# when a recipe containing or losing one of their ingredients (required, excluded and pantry ones
+# included) is saved, or when its clicks or rating move past a threshold.
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from mongoengine import signals
+
+from .models import recipe
+from . import cardstore, indexing
+
+
+def query_key(ingredients, **options):  # sorted ingredients, then the options that are set as (name, value) pairs
+    key = tuple(sorted(set(ingredient for ingredient in ingredients if ingredient)))
+    for name, value in sorted(options.items()):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = query_key(value) or None
+        if value is not None:
+            key += ((name, value),)
+    return key
+
+
+def key_ingredients(key):  # the ingredients of a query key, those of its options included
+    for part in key:
+        if isinstance(part, tuple):
+            if isinstance(part[1], tuple):
+                for ingredient in part[1]:
+                    yield ingredient
+        else:
+            yield part
+
+
+class QueryCache(object):
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self.by_ingredient = {}  # ingredient -> keys of the entries containing it
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.time() + self.ttl, value)
+            for ingredient in key_ingredients(key):
+                self.by_ingredient.setdefault(ingredient, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        del self.entries[key]
+        for ingredient in key_ingredients(key):
+            keys = self.by_ingredient.get(ingredient)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_ingredient[ingredient]
+
+    def invalidate(self, ingredients):  # every entry whose query shares an ingredient with the recipe
+        with self.lock:
+            keys = set()
+            for ingredient in ingredients or []:
+                keys.update(self.by_ingredient.get(ingredient, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_ingredient.clear()
+
+    def stats(self):
+        return {"size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations,
+                "invalidations": self.invalidations}
+
+
+cache = QueryCache(getattr(settings, "QUERY_CACHE_SIZE", 1024), getattr(settings, "QUERY_CACHE_TTL", 300))
+
+
+##### INVALIDATION #####
+_baseline = {}  # recipe id -> (clicks, rating) when its queries were last invalidated, ordinals change on a reload
+
+
+def recipe_changed(store, ordinal, ingredients, old):  # card store listener, sees saves made by every worker
+    recipe_id = store.recipe_ids[ordinal]
+    if old is None or old[2] != store.ing_count[ordinal]:  # new, edited or deleted, matching.recipe_changed compares the ingredients
+        _baseline.pop(recipe_id, None)
+        return
+    clicks, rating = _baseline.get(recipe_id, old[:2])
+    if (abs(store.clicks[ordinal] - clicks) >= getattr(settings, "QUERY_CACHE_CLICK_DELTA", 50) or
+            abs(store.rating[ordinal] - rating) >= getattr(settings, "QUERY_CACHE_RATING_DELTA", 0.5)):
+        cache.invalidate(ingredients)
+        _baseline.pop(recipe_id, None)
+    else:
+        _baseline[recipe_id] = (clicks, rating)
+
+
+def reset():  # the index was reloaded, every cached result ranks against the old one
+    cache.clear()
+    _baseline.clear()
+
+
+def recipe_saved(sender, document, **kwargs):  # invalidate right away in the worker that saved or deleted it, the ingredients
+    # it had are dropped by matching.recipe_changed when the card store puts it
+    cache.invalidate(indexing.ingredients_of(document.to_mongo()))
+
+
+cardstore.listeners.append(recipe_changed)
+signals.post_save.connect(recipe_saved, sender=recipe)
+signals.post_delete.connect(recipe_saved, sender=recipe)
@@ -0,0 +1,190 @@
+## Top-K ranking of match results ##
+# Only 12 cards are shown per page, so instead of sorting every candidate we keep a ranked prefix
+# selected with a bounded heap and only extend it when a deeper page is asked for.
+
+import heapq
+from bisect import bisect_left
+from collections import Counter
+from itertools import compress, repeat
+from operator import add, ge, mul, truediv
+
+
+def card_key(item):  # same ordering as before: frequency/ing_count*frequency, then clicks, then rating
+    card = item[1]
+    return (card["frequency"] / max(card["ing_count"], 1) * card["frequency"], card["clicks"], card["rating"])
+
+
+def top_k(items, k, key=card_key):
+    return heapq.nlargest(k, items, key=key)
+
+
+def contains(postings, ordinal):
+    i = bisect_left(postings, ordinal)
+    return i < len(postings) and postings[i] == ordinal
+
+
+def bisect_key(seq, value, key):  # bisect.bisect_right on key(item), for the impact ordered lists
+    lo, hi = 0, len(seq)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(seq[mid]) <= value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def insort_key(seq, item, key):  # bisect.insort on key(item)
+    seq.insert(bisect_key(seq, key(item), key), item)
+
+
+def _unseen_bound(frontier, extra_max=0):  # best score a recipe not seen in any list yet can still reach
+    # an unseen recipe sits behind the frontier of every list it is in, so with ing_count x it
+    # can match at most as many lists as have a frontier <= x, plus every extra match
+    bound = 0
+    for matches, ing_count in enumerate(sorted(ing for ing, t in frontier), 1):
+        bound = max(bound, (matches + extra_max) ** 2 / max(ing_count, 1))
+    return bound
+
+
+def counted_top_k(postings, ing_count, tiebreak, k, extra=None, ties=False):
+    # Same result as pruned_top_k from one counting pass over every posting, cheaper when the
+    # lists are so broad that the pruned scan would visit most of their recipes anyway
+    if k <= 0:
+        return []
+    counts = Counter()
+    for ordinals in postings:
+        counts.update(ordinals)
+    ordinals = list(counts)
+    frequencies = list(counts.values()) if extra is None else list(map(add, counts.values(), map(extra, ordinals)))
+    # f*f/max(ing_count, 1) as in pruned_top_k, mapped so the loop over every candidate stays in C
+    scores = list(map(truediv, map(mul, frequencies, frequencies), map(max, map(ing_count.__getitem__, ordinals), repeat(1))))
+    if not scores:
+        return []
+    cut = heapq.nlargest(k, scores)[-1]  # only a score at least the k-th can be in the result
+    entries = sorted((((scores[i],) + tiebreak(ordinals[i]), ordinals[i], frequencies[i])
+                      for i in compress(range(len(scores)), map(ge, scores, repeat(cut)))), reverse=True)
+    if not ties or len(entries) <= k:
+        return entries[:k]
+    last = k
+    while last < len(entries) and entries[last][0] == entries[k - 1][0]:
+        last += 1
+    return entries[:last]
+
+
+def pruned_top_k(postings, impact, ing_count, tiebreak, k, extra=None, extra_max=0, ties=False):
+    # Exact top k by (frequency/ing_count*frequency, clicks, rating) without counting every posting.
+    # postings are the query's lists sorted by ordinal (for membership probes), impact the same
+    # lists sorted by ascending ing_count. Recipes are visited best-first across the lists and the
+    # scan stops as soon as no unseen recipe can beat the k-th best, so the work follows k and
+    # not the length of the posting lists. extra(ordinal) adds matches that don't come from a list
+    # (the staples, pantry ingredients at their weight), at most extra_max of them. Returns (key,
+    # ordinal, frequency) best first, equal keys by the larger ordinal, with ties also every candidate
+    # tied with the k-th key, which is what lets partial results be merged.
+    lists = [(p, i) for p, i in zip(postings, impact) if len(p)]
+    if k <= 0:
+        return []
+
+    # a step pops a list and probes the others, past this many the lists are too broad to prune and one
+    # counting pass over every posting is cheaper
+    budget = sum(len(p) for p, i in lists) // (4 * len(lists)) if lists else 0
+    steps = 0
+    frontier = [(ing_count[order[0]], t) for t, (p, order) in enumerate(lists)]
+    heapq.heapify(frontier)
+    positions = [0] * len(lists)
+    seen = set()
+    best = []  # bounded min-heap, the k-th best key on top
+    tied = []  # candidates that didn't fit in best with the same key as the k-th
+
+    while frontier:
+        if len(best) == k and _unseen_bound(frontier, extra_max) < best[0][0][0]:  # strict, ties may still win on clicks
+            break
+        steps += 1
+        if steps > budget:
+            return counted_top_k([p for p, i in lists], ing_count, tiebreak, k, extra, ties)
+        ing, t = heapq.heappop(frontier)
+        order = lists[t][1]
+        ordinal = order[positions[t]]
+        positions[t] += 1
+        if positions[t] < len(order):
+            heapq.heappush(frontier, (ing_count[order[positions[t]]], t))
+        if ordinal in seen:
+            continue
+        seen.add(ordinal)
+
+        frequency = 1
+        for u, (p, i) in enumerate(lists):
+            if u != t and contains(p, ordinal):
+                frequency += 1
+        if extra is not None:
+            frequency += extra(ordinal)
+        key = (frequency * frequency / max(ing, 1),) + tiebreak(ordinal)
+        entry = (key, ordinal, frequency)
+        if len(best) < k:
+            heapq.heappush(best, entry)
+        elif entry > best[0]:  # (key, ordinal), the order the result is sorted in, so top k is a prefix of top 2k
+            dropped = heapq.heapreplace(best, entry)
+            if ties and dropped[0] == best[0][0]:
+                tied.append(dropped)
+            elif ties:  # the k-th key went up, what was tied with the old one is out
+                tied = []
+        elif ties and key == best[0][0]:
+            tied.append((key, ordinal, frequency))
+
+    return sorted(best + tied, reverse=True)
+
+
+class RankedResult(object):  # sequence over the ranked [id, card] pairs, sliceable by Paginator
+
+    def __init__(self, items, key=card_key, k=12):
+        self.items = list(items)
+        self.key = key
+        self.ranked = []
+        self.exhausted = False
+        self.k = k
+
+    def __len__(self):
+        return self.count()
+
+    def count(self):
+        return len(self.items)
+
+    def select(self, k):
+        return top_k(self.items, k, self.key)
+
+    def extend(self, stop):  # grow the ranked prefix to at least stop items, doubling to amortize deep paging
+        if stop <= len(self.ranked) or self.exhausted:
+            return
+        k = max(stop, 2 * len(self.ranked), self.k)
+        self.ranked = self.select(k)
+        self.exhausted = len(self.ranked) < k
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            stop = len(self) if index.stop is None else index.stop
+            if stop < 0:
+                stop += len(self)
+            self.extend(stop)
+            return self.ranked[index]
+        if index < 0:
+            index += len(self)
+        self.extend(index + 1)
+        return self.ranked[index]
+
+    def __iter__(self):
+        self.extend(len(self))
+        return iter(self.ranked)
+
+
+class LazyRankedResult(RankedResult):  # same sequence, but the selection is delegated to the match engine
+
+    def __init__(self, select, total, k=12):
+        RankedResult.__init__(self, [], k=k)
+        self.select = select
+        self.total = total
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.total()
+        return self._count
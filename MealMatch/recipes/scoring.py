@@ -0,0 +1,107 @@
+## Ranking formula ##
+# Recipes rank by their match score, frequency**2 / ing_count, then by clicks, then by average rating.
+# RANKING_WEIGHTS replaces that with a weighted sum over the recipe columns, e.g.
+# {"match": 1, "clicks": 0.2, "rating": 0.5}:
+#   match     frequency**2 / ing_count, the match score
+#   coverage  frequency / ing_count
+#   clicks    log(1 + clicks)
+#   rating    average rating
+#   recency   1 for a recipe added now, halving every RANKING_HALF_LIFE days
+# The score is evaluated over the candidates' columns at once, as chains of map() over C functions
+# with each column gathered by one itemgetter call. The k-th best score is picked from the plain
+# floats, and only the candidates scoring at least that much get a composite key (score, then the
+# tiebreak), so no tuple is built or compared for the rest.
+
+import heapq
+import math
+import time
+from itertools import compress, repeat
+from operator import add, ge, itemgetter, mul, sub, truediv
+
+from django.conf import settings
+
+
+COLUMNS = ("match", "coverage", "clicks", "rating", "recency")
+
+
+def gather(values, ordinals):  # values[ordinal] for every ordinal, in one call
+    if len(ordinals) > 1:
+        return itemgetter(*ordinals)(values)
+    return [values[ordinal] for ordinal in ordinals]
+
+
+def ratio(numerators, ing_count):  # numerator / ing_count, an empty ingredient list counts as one
+    numerators = list(numerators)
+    try:
+        return list(map(truediv, numerators, ing_count))
+    except ZeroDivisionError:
+        return list(map(truediv, numerators, map(max, ing_count, repeat(1))))
+
+
+class Formula(object):  # the default ranking, the match score with clicks and rating as tiebreak
+
+    weighted = False
+
+    def scores(self, store, ordinals, frequencies):  # float per candidate, larger ranks first
+        return ratio(map(mul, frequencies, frequencies), gather(store.ing_count, ordinals))
+
+    def tiebreak(self, store, ordinal):
+        return (store.clicks[ordinal], store.rating[ordinal])
+
+    def key(self, store, ordinal, frequency):  # composite key of one candidate, what pruned_top_k ranks by
+        return (self.scores(store, [ordinal], [frequency])[0],) + self.tiebreak(store, ordinal)
+
+    def top(self, store, ordinals, frequencies, k):  # (key, ordinal, frequency) of the k best candidates, best first
+        if k <= 0 or not ordinals:
+            return []
+        scores = self.scores(store, ordinals, frequencies)
+        cut = heapq.nlargest(k, scores)[-1]
+        survivors = compress(range(len(scores)), map(ge, scores, repeat(cut)))
+        tiebreak = self.tiebreak
+        best = heapq.nlargest(k, (((scores[i],) + tiebreak(store, ordinals[i]), -i) for i in survivors))
+        return [(key, ordinals[-negated], frequencies[-negated]) for key, negated in best]  # full ties go to the earlier one
+
+
+class Weighted(Formula):  # RANKING_WEIGHTS
+
+    weighted = True
+
+    def __init__(self, weights, half_life=30):
+        unknown = set(weights) - set(COLUMNS)
+        if unknown:
+            raise ValueError("RANKING_WEIGHTS has unknown columns: %s" % ", ".join(sorted(unknown)))
+        self.weights = [(column, weights[column]) for column in COLUMNS if weights.get(column)]
+        self.decay = math.log(2) / (half_life * 86400)
+
+    def column(self, name, store, ordinals, frequencies, ing_count):
+        if name == "match":
+            return ratio(map(mul, frequencies, frequencies), ing_count)
+        if name == "coverage":
+            return ratio(frequencies, ing_count)
+        if name == "clicks":
+            clicks = gather(store.clicks, ordinals)
+            try:
+                return list(map(math.log1p, clicks))
+            except ValueError:  # negative clicks
+                return list(map(math.log1p, map(max, clicks, repeat(0))))
+        if name == "rating":
+            return gather(store.rating, ordinals)
+        return map(math.exp, map(mul, map(sub, gather(store.created, ordinals), repeat(time.time())), repeat(self.decay)))
+
+    def scores(self, store, ordinals, frequencies):
+        ing_count = gather(store.ing_count, ordinals)
+        total = repeat(0.0, len(ordinals))
+        for name, weight in self.weights:
+            column = self.column(name, store, ordinals, frequencies, ing_count)
+            total = map(add, total, column if weight == 1 else map(mul, column, repeat(weight)))
+        return list(total)
+
+    def tiebreak(self, store, ordinal):
+        return ()
+
+
+def make_formula(weights=None, half_life=30):
+    return Weighted(weights, half_life) if weights else Formula()
+
+
+formula = make_formula(getattr(settings, "RANKING_WEIGHTS", None), getattr(settings, "RANKING_HALF_LIFE", 30))
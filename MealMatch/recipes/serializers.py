@@ -22,13 +22,12 @@ class recipeSerializer(serializers.DocumentSerializer):
 
 
 class mappedSerializer(serializers.DocumentSerializer):
-    value = mappedValueSerializer(many=True)
 
     class Meta:
 
         model = mapped
         depth = 2
-        exclude = ("id",)
+        fields = ("ingredient", "bucket", "count", "first", "last", "value")
 
 
 
@@ -0,0 +1,237 @@
+## Memory-mapped index snapshots ##
+# Every worker started from wsgi.py would otherwise load the card columns and the posting lists from
+# mongo on its own, so startup time and memory grow with the worker count. buildsnapshot writes the
+# index once into a versioned binary file and workers mmap it: the posting lists stay in the file,
+# shared between processes through the page cache, and are only decoded by the queries that name
+# them. A snapshot is published by pointing the "current" symlink in MATCH_SNAPSHOT_DIR at it with
+# os.replace, which is atomic; workers notice on their next check and swap their index over.
+#
+# Layout: MAGIC, format version and header length, a JSON header (generation, counts, change marker,
+# section table), then the sections, each 8 byte aligned, in native byte order:
+#   recipe_ids        12 byte ObjectIds by ordinal
+#   clicks, rating, ing_count, minutes   card columns (int64, float64, uint32, uint32)
+#   title, image, ingredients   NUL separated utf-8 strings, ingredients sorted
+#   counts, offsets, impact_offsets   per ingredient posting count and byte offsets into postings and impact
+#   postings          ordinals sorted, packed (packing.py)
+#   impact            the same ordinals in impact order, packed
+#   forward, forward_ids  per ordinal offset into the ingredient numbers the recipe is listed under
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime
+
+from bson import ObjectId
+from django.conf import settings
+
+from .packing import PackedList
+
+
+MAGIC = b"MMIX"
+FORMAT = 3
+CURRENT = "current"
+_HEADER = struct.Struct("<II")  # format, header length
+
+
+def snapshot_dir():
+    return getattr(settings, "MATCH_SNAPSHOT_DIR", None)
+
+
+def _strings(values):
+    return "\x00".join(value or "" for value in values).encode("utf-8")
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+##### WRITING #####
+def write_snapshot(index, path, generation=None):  # a loaded MatchIndex -> snapshot file at path
+    store = index.store
+    names = sorted(ingredient for ingredient, postings in index.postings.items() if len(postings))
+    numbers = dict((name, number) for number, name in enumerate(names))
+
+    counts, offsets, impact_offsets, postings, impact = array("I"), array("I"), array("I"), bytearray(), bytearray()
+    listed = [[] for ordinal in range(len(store))]
+    for name in names:
+        counts.append(len(index.postings[name]))
+        offsets.append(len(postings))
+        impact_offsets.append(len(impact))
+        postings += index.postings[name].data
+        impact += index.impact[name].data
+        for ordinal in index.postings[name]:
+            listed[ordinal].append(numbers[name])
+    offsets.append(len(postings))
+    impact_offsets.append(len(impact))
+
+    forward, forward_ids = array("I", [0]), array("I")
+    for numbers_listed in listed:
+        forward_ids.extend(numbers_listed)
+        forward.append(len(forward_ids))
+
+    sections = OrderedDict([
+        ("recipe_ids", b"".join(recipe_id.binary for recipe_id in store.recipe_ids)),
+        ("clicks", array("q", store.clicks).tobytes()),
+        ("rating", array("d", store.rating).tobytes()),
+        ("ing_count", array("I", store.ing_count).tobytes()),
+        ("minutes", array("I", store.minutes).tobytes()),
+        ("title", _strings(store.title)),
+        ("image", _strings(store.image)),
+        ("ingredients", _strings(names)),
+        ("counts", counts.tobytes()),
+        ("offsets", offsets.tobytes()),
+        ("impact_offsets", impact_offsets.tobytes()),
+        ("postings", bytes(postings)),
+        ("impact", bytes(impact)),
+        ("forward", forward.tobytes()),
+        ("forward_ids", forward_ids.tobytes()),
+    ])
+
+    marker = store.marker
+    header = {"generation": generation or int(time.time() * 1000), "byteorder": sys.byteorder,
+              "recipes": len(store), "ingredients": len(names), "sections": {},
+              "marker": None if marker is None else list(marker.timetuple()[:6]) + [marker.microsecond]}
+    start = 0
+    while True:  # the section offsets are in the header, so its length decides where they start
+        position = start
+        for name, data in sections.items():
+            header["sections"][name] = [position, len(data)]
+            position = _align(position + len(data))
+        encoded = json.dumps(header).encode("utf-8")
+        if _align(len(MAGIC) + _HEADER.size + len(encoded)) <= start:
+            break
+        start = _align(len(MAGIC) + _HEADER.size + len(encoded))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC + _HEADER.pack(FORMAT, len(encoded)) + encoded)
+        for name, data in sections.items():
+            f.seek(header["sections"][name][0])
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return header["generation"]
+
+
+def publish(directory, path):  # atomically point directory/current at path
+    link = os.path.join(directory, CURRENT)
+    temporary = "%s.%d" % (link, os.getpid())
+    if os.path.lexists(temporary):
+        os.remove(temporary)
+    os.symlink(os.path.basename(path), temporary)
+    os.replace(temporary, link)
+
+
+def prune(directory, keep=3):  # old snapshots, workers still mapping one keep their pages until they swap
+    current = published(directory)
+    names = sorted(name for name in os.listdir(directory) if name.startswith("index-") and name.endswith(".snap"))
+    for name in names[:-keep]:
+        path = os.path.join(directory, name)
+        if path != current:
+            os.remove(path)
+
+
+def published(directory=None):  # path of the current snapshot, None when there is none
+    directory = directory or snapshot_dir()
+    if not directory:
+        return None
+    link = os.path.join(directory, CURRENT)
+    if not os.path.lexists(link):
+        return None
+    return os.path.join(directory, os.readlink(link))
+
+
+##### READING #####
+class Snapshot(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not an index snapshot" % path)
+        version, length = _HEADER.unpack_from(self.map, len(MAGIC))
+        if version != FORMAT:
+            raise ValueError("%s has snapshot format %d, expected %d" % (path, version, FORMAT))
+        start = len(MAGIC) + _HEADER.size
+        self.header = json.loads(self.map[start:start + length].decode("utf-8"))
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError("%s was written on a %s endian machine" % (path, self.header["byteorder"]))
+        self.data = memoryview(self.map)
+        self.generation = self.header["generation"]
+        self.marker = self.header["marker"] and datetime(*self.header["marker"])
+
+        self.ingredients = self.strings("ingredients", self.header["ingredients"])
+        self.numbers = dict((name, number) for number, name in enumerate(self.ingredients))
+        self.counts = self.section("counts", "I")
+        self.offsets = self.section("offsets", "I")
+        self.impact_offsets = self.section("impact_offsets", "I")
+        self.forward = self.section("forward", "I")
+        self.forward_ids = self.section("forward_ids", "I")
+
+    def section(self, name, typecode="B"):  # zero copy view of a section
+        offset, length = self.header["sections"][name]
+        view = self.data[offset:offset + length]
+        return view if typecode == "B" else view.cast(typecode)
+
+    def strings(self, name, count):
+        if not count:
+            return []
+        return [value or None for value in bytes(self.section(name)).decode("utf-8").split("\x00")]
+
+    def recipe_ids(self):
+        data = self.section("recipe_ids")
+        return [ObjectId(bytes(data[i:i + 12])) for i in range(0, len(data), 12)]
+
+    def postings(self, number):  # packed sorted ordinals of ingredient number, a view into the file
+        data = self.section("postings")[self.offsets[number]:self.offsets[number + 1]]
+        return PackedList(data, self.counts[number])
+
+    def impact(self):  # ingredient -> packed impact ordered ordinals, views into the file
+        impact, view = {}, self.section("impact")
+        for number, name in enumerate(self.ingredients):
+            impact[name] = PackedList(view[self.impact_offsets[number]:self.impact_offsets[number + 1]],
+                                      self.counts[number])
+        return impact
+
+    def listed_under(self, ordinal):  # ingredients the recipe had when the snapshot was written
+        if ordinal + 1 >= len(self.forward):
+            return set()
+        return set(self.ingredients[number] for number in self.forward_ids[self.forward[ordinal]:self.forward[ordinal + 1]])
+
+
+class Postings(MutableMapping):  # ingredient -> packed sorted ordinals, from the snapshot unless changed since
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.changed = {}  # lists changed since the snapshot and ingredients new to it
+
+    def __getitem__(self, ingredient):
+        postings = self.changed.get(ingredient)
+        if postings is None:
+            postings = self.snapshot.postings(self.snapshot.numbers[ingredient])  # KeyError for ingredients neither side has
+        return postings
+
+    def __setitem__(self, ingredient, postings):
+        self.changed[ingredient] = postings
+
+    def __delitem__(self, ingredient):
+        raise TypeError("posting lists are only ever replaced")
+
+    def __contains__(self, ingredient):
+        return ingredient in self.changed or ingredient in self.snapshot.numbers
+
+    def __iter__(self):
+        for ingredient in self.snapshot.ingredients:
+            yield ingredient
+        for ingredient in self.changed:
+            if ingredient not in self.snapshot.numbers:
+                yield ingredient
+
+    def __len__(self):
+        return len(self.snapshot.numbers) + sum(1 for ingredient in self.changed if ingredient not in self.snapshot.numbers)
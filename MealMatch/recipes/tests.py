@@ -1,3 +1,1244 @@
-from django.test import TestCase
+import copy
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import packing, snapshot, bitmaps, ranking, querycache, cursors, matching, canonical, fuzzy, completion, views, scoring, orderings, cardstore, pantries, cookable, partitions, indexing
+from .cardstore import CardStore
+
+
+def ascending(rng, n, universe):
+    return sorted(rng.sample(range(universe), n))
+
+
+## in-memory stand-in for a pymongo collection, the operators this app uses ##
+def field(doc, path):  # (found, value) of a dotted path, a path through a list collects the values
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list):
+            values = [item[part] for item in value if isinstance(item, dict) and part in item]
+            if not values:
+                return False, None
+            value = values
+        elif isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return False, None
+    return True, value
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, part) for part in condition):
+                return False
+            continue
+        found, value = field(doc, key)
+        values = value if isinstance(value, list) else [value]
+        if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$exists":
+                    ok = found == operand
+                elif op == "$ne":
+                    ok = operand not in values if found else operand is not None
+                elif op == "$in":
+                    ok = found and any(item in operand for item in values)
+                elif op == "$all":
+                    ok = found and all(item in values for item in operand)
+                elif op == "$not":
+                    ok = not matches(doc, {key: operand})
+                elif op == "$size":
+                    ok = found and isinstance(value, list) and len(value) == operand
+                else:
+                    compare = {"$gt": lambda a: a > operand, "$gte": lambda a: a >= operand,
+                               "$lt": lambda a: a < operand, "$lte": lambda a: a <= operand}[op]
+                    ok = found and any(item is not None and compare(item) for item in values)
+                if not ok:
+                    return False
+        elif not (found and (condition in values or value == condition)):
+            return False
+    return True
+
+
+def sort_key(spec):
+    spec = [(spec, 1)] if isinstance(spec, str) else list(spec.items()) if isinstance(spec, dict) else spec
+
+    def key(doc):
+        return [Descending(field(doc, name)[1]) if direction < 0 else Ascending(field(doc, name)[1])
+                for name, direction in spec]
+    return key
+
+
+class Ascending(object):  # orders None first like mongo, whatever the types
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        if self.value is None or other.value is None:
+            return self.value is None and other.value is not None
+        return self.value < other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class Descending(Ascending):
+    def __lt__(self, other):
+        return Ascending.__lt__(Ascending(other.value), Ascending(self.value))
+
+
+class FakeCursor(list):
+    def sort(self, spec, direction=1):
+        self[:] = sorted(self, key=sort_key([(spec, direction)] if isinstance(spec, str) else spec))
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def limit(self, n):
+        del self[n:]
+        return self
+
+
+class FakeCollection(object):
+
+    def __init__(self, docs=()):
+        self.docs = []
+        for doc in docs:
+            self.insert(doc)
+
+    def project(self, doc, projection):
+        if not projection:
+            return copy.deepcopy(doc)
+        return copy.deepcopy(dict((key, value) for key, value in doc.items()
+                                  if key == "_id" or (key in projection and projection[key])))
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self.project(doc, projection) for doc in self.docs if matches(doc, query or {}))
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query, projection)
+        return found[0] if found else None
+
+    def insert(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(doc)
+        return doc["_id"]
+
+    def save(self, doc):
+        self.remove({"_id": doc.get("_id")})
+        return self.insert(doc)
+
+    def remove(self, query=None):
+        self.docs = [doc for doc in self.docs if not matches(doc, query or {})]
+
+    def update(self, query, change, upsert=False, multi=False):
+        updated = 0
+        for doc in self.docs:
+            if matches(doc, query):
+                self.apply(doc, change)
+                updated += 1
+                if not multi:
+                    break
+        if not updated and upsert:
+            doc = dict((key, value) for key, value in query.items() if not isinstance(value, dict))
+            self.apply(doc, change)
+            self.insert(doc)
+        return updated
+
+    def apply(self, doc, change):
+        if not any(op.startswith("$") for op in change):  # replacement
+            doc_id = doc.get("_id")
+            doc.clear()
+            doc.update(copy.deepcopy(change))
+            doc["_id"] = doc_id
+            return
+        for op, fields in change.items():
+            for name, operand in fields.items():
+                operand = copy.deepcopy(operand)
+                if op == "$set":
+                    doc[name] = operand
+                elif op == "$unset":
+                    doc.pop(name, None)
+                elif op == "$inc":
+                    doc[name] = doc.get(name, 0) + operand
+                elif op == "$min":
+                    doc[name] = operand if name not in doc else min(doc[name], operand)
+                elif op == "$max":
+                    doc[name] = operand if name not in doc else max(doc[name], operand)
+                elif op == "$push":
+                    items = doc.setdefault(name, [])
+                    if isinstance(operand, dict) and "$each" in operand:
+                        position = operand.get("$position", len(items))
+                        items[position:position] = operand["$each"]
+                        if "$sort" in operand:
+                            order = operand["$sort"]
+                            items.sort(key=sort_key(order) if isinstance(order, (dict, list)) else None,
+                                       reverse=not isinstance(order, (dict, list)) and order < 0)
+                    else:
+                        items.append(operand)
+                elif op == "$pull":
+                    if isinstance(operand, dict):
+                        pulled = lambda item: matches({"v": item}, {"v": operand}) if all(key.startswith("$") for key in operand) \
+                            else isinstance(item, dict) and matches(item, operand)
+                    else:
+                        pulled = lambda item: item == operand
+                    doc[name] = [item for item in doc.get(name, []) if not pulled(item)]
+                elif op == "$pullAll":
+                    doc[name] = [item for item in doc.get(name, []) if item not in operand]
+                else:
+                    raise NotImplementedError(op)
+
+    def initialize_unordered_bulk_op(self):
+        return FakeBulk(self)
+
+    def rename(self, name, dropTarget=False):
+        self.renamed = name
+
+    def ensure_index(self, *args, **kwargs):
+        pass
+
+
+class FakeBulk(object):
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.operations = []
+
+    def find(self, query):
+        bulk = self
+
+        class Selector(object):
+            upserting = False
+
+            def upsert(self):
+                self.upserting = True
+                return self
+
+            def update_one(self, change):
+                bulk.operations.append((query, change, self.upserting, False))
+
+            def update(self, change):
+                bulk.operations.append((query, change, self.upserting, True))
+        return Selector()
+
+    def execute(self):
+        if not self.operations:
+            raise ValueError("no operations")  # like pymongo's InvalidOperation
+        for query, change, upsert, multi in self.operations:
+            self.collection.update(query, change, upsert=upsert, multi=multi)
+
+
+## packed posting lists (packing.py) ##
+class PackingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.rng = random.Random(13)
+
+    def test_round_trip(self):
+        cases = [[], [0], [7], list(range(300)), [0, 255, 256, 65791, 65792, 2 ** 32 - 1]]
+        cases += [ascending(self.rng, n, universe) for n, universe in ((10, 50), (129, 200), (1000, 10 ** 6), (500, 2 ** 31))]
+        for values in cases:
+            packed = packing.pack(values)
+            self.assertEqual(len(packed), len(values))
+            self.assertEqual(list(packed.decode()), values)
+            self.assertEqual(list(packed), values)
+
+    def test_round_trip_impact_order(self):  # ascending runs that go down in between, as in the impact lists
+        values = []
+        for run in range(20):
+            values += ascending(self.rng, self.rng.randint(1, 300), 5000)
+        self.assertEqual(list(packing.pack(values).decode()), values)
+
+    def test_block_widths(self):  # a block of dense ordinals packs to a byte per gap
+        packed = packing.pack(range(packing.BLOCK))
+        self.assertEqual(packed.nbytes(), packing.HEADER.size + packing.BLOCK - 1)
+        wide = packing.pack([0, 1 << 20])
+        self.assertEqual(wide.nbytes(), packing.HEADER.size + 4)
+
+    def test_membership(self):
+        for n, universe in ((0, 10), (1, 10), (200, 300), (2000, 10 ** 5)):
+            values = ascending(self.rng, n, universe)
+            packed, members = packing.pack(values), set(values)
+            for value in range(universe + 2):
+                self.assertEqual(value in packed, value in members, value)
+
+    def test_membership_of_a_view(self):  # lists read from a snapshot are memoryviews
+        values = ascending(self.rng, 400, 3000)
+        data = packing.pack(values).data
+        packed = packing.PackedList(memoryview(b"junk" + data)[4:], len(values))
+        self.assertEqual(list(packed.decode()), values)
+        self.assertTrue(all(value in packed for value in values))
+        self.assertFalse(any(value in packed for value in set(range(3000)) - set(values)))
+
+
+## snapshot layout (snapshot.py) ##
+class FakeIndex(object):  # what write_snapshot reads of a MatchIndex
+
+    def __init__(self, store, listed):
+        self.store = store
+        postings = {}
+        for ordinal, ingredients in enumerate(listed):
+            for ingredient in ingredients:
+                postings.setdefault(ingredient, []).append(ordinal)
+        self.postings = dict((name, packing.pack(ordinals)) for name, ordinals in postings.items())
+        self.impact = dict((name, packing.pack(sorted(ordinals, key=lambda ordinal: (store.ing_count[ordinal], ordinal))))
+                           for name, ordinals in postings.items())
+
+
+class SnapshotTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.directory = tempfile.mkdtemp()
+        self.store = CardStore()
+        names = ["Salt", "Tomato", "Gurka", "Lök", "Crème fraîche", "Egg", "Pea"]
+        self.listed = []
+        for n in range(300):
+            ingredients = rng.sample(names, rng.randint(0, 5))
+            self.listed.append(ingredients)
+            self.store.put({"_id": ObjectId(), "clicks": rng.randint(0, 10 ** 6), "rating": [rng.randint(1, 5)],
+                            "ingredients_complete": ingredients + ["Water"] * rng.randint(0, 2),
+                            "title": None if n % 7 == 0 else "Recipe %d, ärtsoppa" % n,
+                            "image": None if n % 5 == 0 else "http://example.com/%d.jpg" % n,
+                            "time": "%d min" % rng.randint(1, 90), "modified": datetime(2016, 5, 1, 12, 0, 0, n)})
+        self.index = FakeIndex(self.store, self.listed)
+        self.path = os.path.join(self.directory, "index-1.snap")
+        self.generation = snapshot.write_snapshot(self.index, self.path, generation=42)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_header(self):
+        snap = snapshot.Snapshot(self.path)
+        self.assertEqual(self.generation, 42)
+        self.assertEqual(snap.generation, 42)
+        self.assertEqual(snap.marker, self.store.marker)
+        self.assertEqual(snap.header["recipes"], len(self.store))
+        self.assertEqual(snap.ingredients, sorted(self.index.postings))
+        for name, (offset, length) in snap.header["sections"].items():
+            self.assertEqual(offset % 8, 0, name)
+
+    def test_columns(self):
+        snap = snapshot.Snapshot(self.path)
+        store = self.store
+        self.assertEqual(snap.recipe_ids(), store.recipe_ids)
+        self.assertEqual(list(snap.section("clicks", "q")), list(store.clicks))
+        self.assertEqual(list(snap.section("rating", "d")), list(store.rating))
+        self.assertEqual(list(snap.section("ing_count", "I")), list(store.ing_count))
+        self.assertEqual(list(snap.section("minutes", "I")), list(store.minutes))
+        self.assertEqual(snap.strings("title", len(store)), store.title)
+        self.assertEqual(snap.strings("image", len(store)), store.image)
+
+    def test_postings(self):
+        snap = snapshot.Snapshot(self.path)
+        impact = snap.impact()
+        for name in snap.ingredients:
+            self.assertEqual(list(snap.postings(snap.numbers[name])), list(self.index.postings[name]))
+            self.assertEqual(list(impact[name]), list(self.index.impact[name]))
+        for ordinal, ingredients in enumerate(self.listed):
+            self.assertEqual(snap.listed_under(ordinal), set(ingredients))
+        self.assertEqual(snap.listed_under(len(self.listed)), set())
+
+    def test_changed_postings(self):
+        postings = snapshot.Postings(snapshot.Snapshot(self.path))
+        postings["Tomato"] = packing.pack([1, 2])
+        postings["Saffron"] = packing.pack([3])
+        self.assertEqual(list(postings["Tomato"]), [1, 2])
+        self.assertEqual(list(postings["Salt"]), list(self.index.postings["Salt"]))
+        self.assertEqual(sorted(postings), sorted(set(self.index.postings) | {"Saffron"}))
+        self.assertEqual(len(postings), len(self.index.postings) + 1)
+        self.assertNotIn("Basil", postings)
+
+    def test_rejects_other_formats(self):
+        with open(self.path, "r+b") as f:
+            f.seek(len(snapshot.MAGIC))
+            f.write(snapshot._HEADER.pack(snapshot.FORMAT + 1, 0))
+        self.assertRaises(ValueError, snapshot.Snapshot, self.path)
+
+    def test_publish(self):
+        self.assertIsNone(snapshot.published(self.directory))
+        snapshot.publish(self.directory, self.path)
+        self.assertEqual(snapshot.published(self.directory), self.path)
+
+
+## compressed bitmaps (bitmaps.py) ##
+class BitmapTests(SimpleTestCase):
+
+    def sets(self, rng):  # sparse, dense and run shaped chunks over several chunk keys
+        chunk = bitmaps.CHUNK
+        sparse = set(rng.sample(range(4 * chunk), 3000))
+        dense = set(rng.sample(range(chunk, 2 * chunk), 20000))
+        runs = set(range(2 * chunk + 100, 2 * chunk + 30000)) | set(range(5 * chunk - 10, 5 * chunk + 10))
+        return [sparse, dense, runs, sparse | dense, dense | runs, set(), {0}, {chunk - 1, chunk}]
+
+    def bitmap(self, values, optimize=False):
+        bitmap = bitmaps.RoaringBitmap.from_sorted(sorted(values))
+        return bitmap.run_optimize() if optimize else bitmap
+
+    def test_round_trip(self):
+        for values in self.sets(random.Random(11)):
+            for optimize in (False, True):
+                bitmap = self.bitmap(values, optimize)
+                self.assertEqual(list(bitmap), sorted(values))
+                self.assertEqual(len(bitmap), len(values))
+
+    def test_membership(self):
+        rng = random.Random(12)
+        for values in self.sets(rng):
+            bitmap = self.bitmap(values, True)
+            for ordinal in rng.sample(range(6 * bitmaps.CHUNK), 2000) + sorted(values)[:500]:
+                self.assertEqual(ordinal in bitmap, ordinal in values)
+
+    def test_set_algebra(self):
+        sets = self.sets(random.Random(13))
+        for a in sets:
+            for b in sets:
+                for optimize in (False, True):
+                    x, y = self.bitmap(a, optimize), self.bitmap(b)
+                    self.assertEqual(list(x & y), sorted(a & b))
+                    self.assertEqual(list(x | y), sorted(a | b))
+                    self.assertEqual(list(x - y), sorted(a - b))
+                    self.assertEqual(len(x & y), len(a & b))
+
+    def test_union_and_intersection(self):
+        sets = self.sets(random.Random(14))[:5]
+        union, common = set().union(*sets), set(sets[0]).intersection(*sets[1:3])
+        self.assertEqual(list(bitmaps.RoaringBitmap.union(self.bitmap(values) for values in sets)), sorted(union))
+        self.assertEqual(list(bitmaps.RoaringBitmap.intersection([self.bitmap(values) for values in sets[:3]])), sorted(common))
+        self.assertEqual(list(bitmaps.RoaringBitmap.intersection([])), [])
+
+
+## exact top k (ranking.pruned_top_k) ##
+class PrunedTopKTests(SimpleTestCase):
+
+    def brute(self, lists, ing_count, tiebreak, k, extra=None):
+        frequencies = {}
+        for ordinals in lists:
+            for ordinal in ordinals:
+                frequencies[ordinal] = frequencies.get(ordinal, 0) + 1
+        keys = []
+        for ordinal, frequency in frequencies.items():
+            if extra is not None:
+                frequency += extra(ordinal)
+            keys.append(((frequency * frequency / max(ing_count[ordinal], 1),) + tiebreak(ordinal), ordinal))
+        return sorted(keys, reverse=True)[:k]
+
+    def test_against_brute_force(self):
+        rng = random.Random(5)
+        for trial in range(200):
+            n = rng.randint(1, 400)
+            ing_count = [rng.randint(0, 12) for ordinal in range(n)]
+            clicks = [rng.randint(0, 3) for ordinal in range(n)]  # few values, so keys tie
+            tiebreak = lambda ordinal: (clicks[ordinal], 0.0)
+            lists = [sorted(rng.sample(range(n), rng.randint(0, n))) for t in range(rng.randint(1, 6))]
+            impact = [sorted(ordinals, key=lambda ordinal: (ing_count[ordinal], ordinal)) for ordinals in lists]
+            extra, extra_max = None, 0
+            if trial % 3 == 0:
+                staples = set(rng.sample(range(n), n // 3))
+                extra, extra_max = (lambda ordinal: 1 if ordinal in staples else 0), 1
+            k = rng.randint(1, 30)
+
+            result = ranking.pruned_top_k(lists, impact, ing_count, tiebreak, k, extra, extra_max)
+            self.assertEqual([(key, ordinal) for key, ordinal, frequency in result], self.brute(lists, ing_count, tiebreak, k, extra))
+            for key, ordinal, frequency in result:
+                self.assertEqual(frequency, sum(1 for ordinals in lists if ordinal in ordinals) +
+                                 (extra(ordinal) if extra is not None else 0))
+
+    def test_broad_lists(self):  # lists holding most recipes aren't pruned, one counting pass gives the same result
+        rng = random.Random(7)
+        n = 3000
+        ing_count = [rng.randint(3, 20) for ordinal in range(n)]
+        clicks = [rng.randint(0, 3) for ordinal in range(n)]
+        tiebreak = lambda ordinal: (clicks[ordinal], 0.0)
+        lists = [sorted(rng.sample(range(n), int(n * share))) for share in (0.3, 0.2, 0.15, 0.1, 0.08, 0.05)]
+        impact = [sorted(ordinals, key=lambda ordinal: (ing_count[ordinal], ordinal)) for ordinals in lists]
+        staples = set(rng.sample(range(n), n // 2))  # Salt
+        extra = lambda ordinal: 1 if ordinal in staples else 0
+        with mock.patch.object(ranking, "counted_top_k", wraps=ranking.counted_top_k) as counted:
+            result = ranking.pruned_top_k(lists, impact, ing_count, tiebreak, 12, extra, 1)
+        self.assertTrue(counted.called)
+        self.assertEqual([(key, ordinal) for key, ordinal, frequency in result], self.brute(lists, ing_count, tiebreak, 12, extra))
+
+        shared = n  # a one ingredient recipe in every list, after it nothing unseen can win
+        ing_count.append(1)
+        clicks.append(0)
+        narrow = [ordinals[:40] + [shared] for ordinals in lists]  # so short lists are still pruned
+        impact = [sorted(ordinals, key=lambda ordinal: (ing_count[ordinal], ordinal)) for ordinals in narrow]
+        with mock.patch.object(ranking, "counted_top_k", wraps=ranking.counted_top_k) as counted:
+            result = ranking.pruned_top_k(narrow, impact, ing_count, tiebreak, 1)
+        self.assertFalse(counted.called)
+        self.assertEqual([(key, ordinal) for key, ordinal, frequency in result], self.brute(narrow, ing_count, tiebreak, 1))
+
+    def test_counted_ties(self):  # the counting pass returns the same ties
+        ing_count = [2] * 10
+        lists = [list(range(10)), list(range(0, 10, 2))]
+        self.assertEqual(ranking.counted_top_k(lists, ing_count, lambda ordinal: (), 3, ties=True),
+                         [((2.0,), ordinal, 2) for ordinal in (8, 6, 4, 2, 0)])
+        self.assertEqual(len(ranking.counted_top_k(lists, ing_count, lambda ordinal: (), 3)), 3)
+        self.assertEqual(ranking.counted_top_k([[]], ing_count, lambda ordinal: (), 3), [])
+
+    def test_ties(self):  # with ties every candidate tied with the k-th key comes back too
+        ing_count = [2] * 10
+        lists = [list(range(10)), list(range(0, 10, 2))]
+        result = ranking.pruned_top_k(lists, lists, ing_count, lambda ordinal: (), 3, ties=True)
+        self.assertEqual(sorted(ordinal for key, ordinal, frequency in result), [0, 2, 4, 6, 8])
+        self.assertEqual(len(ranking.pruned_top_k(lists, lists, ing_count, lambda ordinal: (), 3)), 3)
+
+    def test_prefix(self):  # a page of a deeper selection is the page of a shallower one, however many keys tie
+        rng = random.Random(6)
+        n = 500
+        ing_count = [rng.randint(1, 4) for ordinal in range(n)]
+        clicks = [1] * n  # like the corpus, mostly clicks 1 and rating 0
+        tiebreak = lambda ordinal: (clicks[ordinal], 0.0)
+        lists = [sorted(rng.sample(range(n), 300)) for t in range(3)]
+        impact = [sorted(ordinals, key=lambda ordinal: (ing_count[ordinal], ordinal)) for ordinals in lists]
+        everything = ranking.pruned_top_k(lists, impact, ing_count, tiebreak, n)
+        for k in (1, 12, 24, 100, 1200):
+            self.assertEqual(ranking.pruned_top_k(lists, impact, ing_count, tiebreak, k), everything[:k])
+
+    def test_lazy_pages(self):  # pages read one after another neither repeat nor skip a recipe
+        ing_count = [3] * 100
+        lists = [list(range(100)), list(range(0, 100, 3))]
+        impact = [sorted(ordinals, key=lambda ordinal: (ing_count[ordinal], ordinal)) for ordinals in lists]
+        select = lambda k: ranking.pruned_top_k(lists, impact, ing_count, lambda ordinal: (), k)
+        result = ranking.LazyRankedResult(select, lambda: 100)
+        pages = [result[start:start + 12] for start in range(0, 100, 12)]
+        self.assertEqual([entry for page in pages for entry in page], select(100))
+
+
+## ranked result cache (querycache.py) ##
+class QueryCacheTests(SimpleTestCase):
+
+    def test_query_key(self):
+        self.assertEqual(querycache.query_key(["Tomato", "Egg", "Egg", ""]), ("Egg", "Tomato"))
+        key = querycache.query_key(["Tomato"], required=["Egg"], excluded=[], missing=None, sort="rating")
+        self.assertEqual(key, ("Tomato", ("required", ("Egg",)), ("sort", "rating")))
+        self.assertEqual(list(querycache.key_ingredients(key)), ["Tomato", "Egg"])
+
+    def test_invalidate(self):  # every entry naming the ingredient goes, in its options too
+        cache = querycache.QueryCache()
+        keys = [querycache.query_key(["Tomato", "Basil"]), querycache.query_key(["Egg"], excluded=["Tomato"]),
+                querycache.query_key(["Egg"])]
+        for key in keys:
+            cache.put(key, key)
+        cache.invalidate({"Tomato"})
+        self.assertEqual([cache.get(key) for key in keys], [None, None, keys[2]])
+        self.assertEqual(sorted(cache.by_ingredient), ["Egg"])
+        self.assertEqual(cache.invalidations, 2)
+
+    def test_lru_and_ttl(self):
+        cache = querycache.QueryCache(maxsize=2)
+        cache.put(("Egg",), 1)
+        cache.put(("Basil",), 2)
+        cache.get(("Egg",))
+        cache.put(("Onion",), 3)  # Basil is the least recently used
+        self.assertEqual(list(cache.entries), [("Egg",), ("Onion",)])
+        self.assertNotIn("Basil", cache.by_ingredient)
+        expired = querycache.QueryCache(ttl=-1)
+        expired.put(("Egg",), 1)
+        self.assertIsNone(expired.get(("Egg",)))
+        self.assertEqual((expired.expirations, len(expired.entries)), (1, 0))
+
+    @override_settings(QUERY_CACHE_CLICK_DELTA=50, QUERY_CACHE_RATING_DELTA=0.5)
+    def test_stats_threshold(self):  # small moves add up from the last invalidation, a reload forgets them
+        store = CardStore()
+        ordinal = store.put({"_id": ObjectId(), "clicks": 10, "rating": [4], "ingredients_complete": ["Egg"]})
+        cache = querycache.QueryCache()
+
+        def change(clicks=None, rating=None):
+            old = (store.clicks[ordinal], store.rating[ordinal], store.ing_count[ordinal])
+            store.clicks[ordinal] = old[0] if clicks is None else clicks
+            store.rating[ordinal] = old[1] if rating is None else rating
+            querycache.recipe_changed(store, ordinal, ["Egg"], old)
+            return cache.get(("Egg",)) is None
+
+        with mock.patch.object(querycache, "cache", cache), mock.patch.object(querycache, "_baseline", {}):
+            cache.put(("Egg",), "ranked")
+            self.assertFalse(change(clicks=40))
+            self.assertFalse(change(clicks=59))
+            self.assertEqual(querycache._baseline, {store.recipe_ids[ordinal]: (10, 4.0)})
+            self.assertTrue(change(clicks=60))
+            cache.put(("Egg",), "ranked")
+            self.assertFalse(change(rating=4.4))
+            self.assertTrue(change(rating=4.5))  # 0.5 from the 4 it had when the clicks invalidated
+            cache.put(("Egg",), "ranked")
+            change(clicks=61)
+            querycache.reset()
+            self.assertEqual((querycache._baseline, len(cache.entries)), ({}, 0))
+
+
+## continuation tokens (cursors.py) ##
+class CursorTests(SimpleTestCase):
+
+    def test_frozen_order(self):  # pages already shown keep their order, later ones add what is new and nothing twice
+        live = [("r%d" % n, {}) for n in range(30)]
+        snapshot = cursors.Snapshot(live)
+        first = snapshot[0:12]
+        live.reverse()  # the ranking moved meanwhile
+        pages = first + snapshot[12:24] + snapshot[24:36]
+        self.assertEqual(first, [("r%d" % n, {}) for n in range(12)])
+        self.assertEqual(sorted(pages), sorted(live))
+        self.assertEqual((len(snapshot), snapshot[3]), (30, ("r3", {})))
+
+    def test_open_cursor(self):
+        calls = []
+
+        def search(ingredients, **options):
+            calls.append(ingredients)
+            return [(ingredient, {}) for ingredient in ingredients]
+
+        snapshot, token = cursors.open_cursor(["Egg", "Basil"], None, search)
+        self.assertEqual(cursors.open_cursor(["Basil", "Egg"], token, search), (snapshot, token))  # same query
+        self.assertEqual(len(calls), 1)
+        other, other_token = cursors.open_cursor(["Egg"], token, search)  # a token for another query
+        self.assertIsNot(other, snapshot)
+        self.assertNotEqual(other_token, token)
+        forged = cursors.open_cursor(["Egg", "Basil"], token[:-1] + ("A" if token[-1] != "A" else "B"), search)
+        self.assertIsNot(forged[0], snapshot)
+        self.assertEqual(len(calls), 3)
+
+    def test_dropped_on_swap(self):  # a reloaded index doesn't stay pinned by the old one's results
+        calls = []
+        search = lambda ingredients, **options: calls.append(ingredients) or [(ingredient, {}) for ingredient in ingredients]
+        snapshot, token = cursors.open_cursor(["Egg"], None, search)
+        with mock.patch.object(matching, "_index", None), mock.patch.object(cardstore, "reset_store"):
+            matching.swap(matching.MatchIndex(CardStore()))
+        again, same_token = cursors.open_cursor(["Egg"], token, search)
+        self.assertIsNot(again, snapshot)
+        self.assertEqual((same_token, len(calls)), (token, 2))
+
+    def test_rebuilt_under_the_same_id(self):  # a worker without the snapshot makes it again for the token
+        search = lambda ingredients, **options: [(ingredient, {}) for ingredient in ingredients]
+        snapshot, token = cursors.open_cursor(["Egg"], None, search)
+        with mock.patch.object(cursors, "table", cursors.SnapshotTable()):
+            rebuilt, same = cursors.open_cursor(["Egg"], token, search)
+            self.assertIs(cursors.open_cursor(["Egg"], token, search)[0], rebuilt)
+        self.assertEqual((same, list(rebuilt[0:1])), (token, list(snapshot[0:1])))
+
+
+## ingredient canonicalization (canonical.py) ##
+class CanonicalTests(SimpleTestCase):
+    FOODS = ["Tomato", "Pear", "Pea", "Corn", "Lök", "Gurka", "Berry", "Potato", "Crème fraîche"]
+    SYNONYMS = {"tomat": "Tomato", "rödlök": "Lök"}
+
+    def setUp(self):
+        self.table = canonical._table, canonical._loaded_at
+        canonical._table, canonical._loaded_at = canonical.build_table(self.FOODS, self.SYNONYMS), float("inf")
+
+    def tearDown(self):
+        canonical._table, canonical._loaded_at = self.table
+
+    def test_fold(self):  # case, spacing and accents go, the Swedish letters stay
+        self.assertEqual(canonical.fold("  Crème   FRAÎCHE "), "creme fraiche")
+        self.assertEqual(canonical.fold("Smör"), "smör")
+        self.assertEqual(canonical.fold("Æble Ø"), "äble ö")
+        self.assertEqual(canonical.clean("red_onion--"), "red onion")
+
+    def test_plurals(self):
+        cases = {"tomatoes": "Tomato", "Berries": "Berry", "potatoes": "Potato", "gurkor": "Gurka", "Peas": "Pea",
+                 "lökar": "Lök", "creme fraiche": "Crème fraîche", "Tomater": "Tomato", "rödlökar": "Lök"}
+        for token, name in cases.items():
+            self.assertEqual(canonical.canonical(token), name, token)
+
+    def test_swedish_plurals_need_a_swedish_stem(self):  # pear isn't a Pea, corner no Corn
+        self.assertEqual(canonical.canonical("pear"), "Pear")
+        self.assertEqual(canonical.canonical("corner"), "corner")
+        self.assertEqual(canonical.canonical("peer"), "peer")
+
+    def test_unknown_and_sets(self):  # a token the table doesn't know stays folded
+        self.assertEqual(canonical.canonical("Saffran"), "saffran")
+        self.assertEqual(canonical.canonical_set(["Tomatoes", "tomat", "TOMATO", "", "_", "Pears"]), {"Tomato", "Pear"})
+        self.assertEqual(canonical.canonical_set(None), set())
+
+
+## typo tolerant resolution (fuzzy.py) ##
+class FuzzyTests(SimpleTestCase):
+    FOODS = ["Tomato", "Potato", "Basil", "Egg", "Garlic", "Cinnamon", "Crème fraîche", "Pea", "Pear"]
+
+    def setUp(self):
+        self.table = canonical._table, canonical._loaded_at
+        canonical._table, canonical._loaded_at = canonical.build_table(self.FOODS, {"tomat": "Tomato"}), float("inf")
+        self.index = fuzzy.FuzzyIndex(canonical._table, {"tomat": "Tomato"})
+
+    def tearDown(self):
+        canonical._table, canonical._loaded_at = self.table
+
+    def test_edit_distance(self):  # optimal string alignment, a transposition is one edit
+        self.assertEqual(fuzzy.edit_distance("abcd", "acbd", 2), 1)
+        self.assertEqual(fuzzy.edit_distance("kitten", "sitting", 5), 3)
+        self.assertEqual(fuzzy.edit_distance("kitten", "sitting", 1), 2)  # stops at limit + 1
+        self.assertEqual(fuzzy.edit_distance("a", "abcd", 1), 2)
+        self.assertEqual(fuzzy.edit_distance("basil", "basil", 0), 0)
+
+    def test_lookup(self):
+        cases = {"tomatto": "Tomato", "tomtao": "Tomato", "potatoe": "Potato", "basl": "Basil", "egs": "Egg",
+                 "garlik": "Garlic", "cinamon": "Cinnamon", "cream fraiche": "Crème fraîche", "tomaat": "Tomato"}
+        for token, name in cases.items():
+            self.assertEqual(self.index.lookup(canonical.fold(token)), name, token)
+        for token in ("eg", "xyzzy", "cinnnammonn"):  # too short to correct, or too far from any name
+            self.assertIsNone(self.index.lookup(token), token)
+
+    def test_lookup_prefers_listed_names(self):  # among equally close names the one most recipes list
+        self.assertEqual(self.index.lookup("peaa"), "Pea")
+        self.assertEqual(self.index.lookup("peaa", lambda name: 10 if name == "Pear" else 0), "Pear")
+
+    def test_resolver(self):  # known names and listed ingredients are left alone
+        with mock.patch.object(fuzzy, "_index", None):
+            resolve = fuzzy.resolver({"Tomato": [1, 2], "basel": [3]})
+            self.assertEqual([resolve(token) for token in ("tomatoes", "Tomatto", "basel", "basl", "xyzzy")],
+                             ["Tomato", "Tomato", "basel", "Basil", "xyzzy"])
+
+    @override_settings(MATCH_ENGINE=False)
+    def test_resolver_with_the_engine_off(self):  # corrects without loading the match index
+        with mock.patch.object(matching, "get_index", side_effect=AssertionError("index loaded")), \
+                mock.patch.object(fuzzy, "_index", None):
+            self.assertEqual(fuzzy.resolver()("Tomatto"), "Tomato")
+
+
+## autocorrect completions (completion.py) ##
+class CompletionTests(SimpleTestCase):
+    FOODS = ["Tomato", "Tomatillo", "Tofu", "Thyme", "Turmeric", "Crème fraîche", "Cream"]
+    POSTINGS = {"Tofu": [1, 2, 3], "Tomato": [1, 2], "Thyme": [1]}
+
+    def setUp(self):
+        self.table = canonical._table, canonical._loaded_at
+        canonical._table, canonical._loaded_at = canonical.build_table(self.FOODS, {}), float("inf")
+        self.completions = completion.Completions(canonical._table, self.POSTINGS, limit=3)
+
+    def tearDown(self):
+        canonical._table, canonical._loaded_at = self.table
+
+    def test_complete(self):  # most listed first, then by name, at most limit
+        self.assertEqual(self.completions.complete("to"), ("Tofu", "Tomato", "Tomatillo"))
+        self.assertEqual(self.completions.complete("T"), ("Tofu", "Tomato", "Thyme"))
+        self.assertEqual(self.completions.complete("TOMA"), ("Tomato", "Tomatillo"))
+        self.assertEqual(self.completions.complete("crè"), ("Cream", "Crème fraîche"))
+        self.assertEqual(self.completions.complete("crème_f"), ("Crème fraîche",))
+        self.assertEqual(self.completions.complete("x"), ())
+
+    def test_response(self):  # short prefixes are serialized up front, the tag follows the content
+        self.assertIn("to", self.completions.responses)
+        self.assertNotIn("toma", self.completions.responses)
+        self.assertEqual(self.completions.response("To"), completion.serialize(["Tofu", "Tomato", "Tomatillo"]))
+        body, etag = self.completions.response("tomat")
+        self.assertEqual(json.loads(body.decode("utf-8")), ["Tomato", "Tomatillo"])
+        self.assertEqual(etag, completion.Completions(canonical._table, dict(self.POSTINGS)).response("tomat")[1])
+        self.assertNotEqual(etag, self.completions.response("tof")[1])
+
+    @override_settings(MATCH_ENGINE=False)
+    def test_engine_off(self):  # ranked by name alone, without loading the match index
+        with mock.patch.object(matching, "get_index", side_effect=AssertionError("index loaded")), \
+                mock.patch.object(completion, "_completions", None):
+            self.assertEqual(completion.complete("to"), ["Tofu", "Tomatillo", "Tomato"])
+            self.assertIs(completion.get_completions(), completion.get_completions())
+
+
+## cacheable autocomplete endpoint (views.autocomplete) ##
+@override_settings(AUTOCOMPLETE_MAX_AGE=300)
+class AutocompleteViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.table = canonical._table, canonical._loaded_at
+        canonical._table, canonical._loaded_at = canonical.build_table(["Tomato", "Tofu", "Thyme"], {}), float("inf")
+        completions = completion.Completions(canonical._table, {"Tofu": [1, 2]})
+        self.patch = mock.patch.object(completion, "get_completions", return_value=completions)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        canonical._table, canonical._loaded_at = self.table
+
+    def get(self, prefix, if_none_match=None):
+        headers = {} if if_none_match is None else {"HTTP_IF_NONE_MATCH": if_none_match}
+        return views.autocomplete(self.factory.get("/recipes/autocomplete/", {"q": prefix}, **headers))
+
+    def test_answer(self):
+        response = self.get("to")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(response.content.decode("utf-8")), ["Tofu", "Tomato"])
+        self.assertEqual(response["ETag"], completion.serialize(["Tofu", "Tomato"])[1])
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("max-age=300", response["Cache-Control"])
+
+    def test_not_modified(self):  # a repeated keystroke carrying the tag gets no body
+        etag = self.get("to")["ETag"]
+        for if_none_match in (etag, 'W/"other", ' + etag, "*"):
+            response = self.get("to", if_none_match)
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual((response["ETag"], response.content), (etag, b""))
+        self.assertEqual(self.get("tom", etag).status_code, 200)  # another prefix, another tag
+
+    def test_get_only(self):
+        self.assertEqual(views.autocomplete(self.factory.post("/recipes/autocomplete/", {"q": "to"})).status_code, 405)
+
+
+## ranking formula (scoring.py) ##
+class ScoringTests(SimpleTestCase):
+
+    def store(self, recipes):  # (ing_count, clicks, rating, days old) per ordinal
+        store = CardStore()
+        for ing_count, clicks, rating, age in recipes:
+            created = datetime.utcnow() - timedelta(days=age)
+            recipe_id = ObjectId(ObjectId.from_datetime(created).binary[:4] + ObjectId().binary[4:])  # unique, made then
+            store.put({"_id": recipe_id, "clicks": clicks, "rating": [rating] if rating else [],
+                       "ingredients_complete": ["?"] * ing_count})
+        return store
+
+    def test_formula_top(self):  # match score, then clicks, then rating, full ties to the earlier candidate
+        store = self.store([(4, 1, 0, 0), (2, 1, 0, 0), (2, 9, 0, 0), (2, 9, 5, 0), (0, 1, 0, 0), (2, 1, 0, 0)])
+        formula = scoring.Formula()
+        ordinals, frequencies = [0, 1, 2, 3, 4, 5], [2, 1, 1, 1, 1, 1]
+        top = formula.top(store, ordinals, frequencies, 4)
+        self.assertEqual([ordinal for key, ordinal, frequency in top], [0, 4, 3, 2])
+        self.assertEqual(top[1], ((1.0, 1, 0), 4, 1))  # no ingredients counts as one, and ties with 0
+        self.assertEqual([ordinal for key, ordinal, frequency in formula.top(store, ordinals, frequencies, 6)][4:], [1, 5])
+        self.assertEqual(formula.key(store, 3, 1), (0.5, 9, 5.0))
+        self.assertEqual(formula.top(store, ordinals, frequencies, 0), [])
+
+    def test_weighted(self):
+        store = self.store([(2, 0, 5, 0), (2, 100, 0, 0), (1, 0, 0, 30)])
+        formula = scoring.Weighted({"match": 1, "clicks": 0.5, "rating": 0.2})
+        scores = formula.scores(store, [0, 1, 2], [2, 1, 1])
+        expected = [2 + 0 + 1, 0.5 + 0.5 * math.log1p(100), 1]
+        for score, value in zip(scores, expected):
+            self.assertAlmostEqual(score, value)
+        self.assertEqual([ordinal for key, ordinal, frequency in formula.top(store, [0, 1, 2], [2, 1, 1], 2)], [0, 1])
+        self.assertEqual(formula.tiebreak(store, 0), ())
+
+    def test_recency_and_coverage(self):  # recency halves every half life
+        store = self.store([(4, 0, 0, 0), (4, 0, 0, 30)])
+        scores = scoring.Weighted({"recency": 1, "coverage": 2}, half_life=30).scores(store, [0, 1], [2, 2])
+        self.assertAlmostEqual(scores[0], 2.0, places=3)
+        self.assertAlmostEqual(scores[1], 1.5, places=3)
+
+    def test_make_formula(self):
+        self.assertFalse(scoring.make_formula(None).weighted)
+        self.assertTrue(scoring.make_formula({"match": 1}).weighted)
+        self.assertRaises(ValueError, scoring.make_formula, {"match": 1, "price": 1})
+
+
+## sort permutations (orderings.py) ##
+class OrderingTests(SimpleTestCase):
+
+    def store(self, rng, n):
+        store = CardStore()
+        for ordinal in range(n):
+            store.put({"_id": ObjectId(), "clicks": rng.randint(0, 5), "rating": [rng.randint(1, 5)],
+                       "ingredients_complete": ["?"], "time": "%d min" % rng.randint(5, 60)})
+        return store
+
+    def assertFresh(self, ordering, store):  # what building it again would give
+        fresh = orderings.Ordering(store, ordering.value)
+        self.assertEqual(list(ordering.order), list(fresh.order))
+        self.assertEqual(list(ordering.rank), list(fresh.rank))
+
+    def test_move(self):
+        rng = random.Random(24)
+        store = self.store(rng, 200)
+        ordering = orderings.Ordering(store, orderings.SORTS["clicks"])
+        for step in range(300):
+            ordinal = rng.randrange(len(store) + 1)
+            if ordinal == len(store) or step % 10 == 0:  # a new recipe
+                ordinal = store.put({"_id": ObjectId(), "clicks": rng.randint(0, 5), "ingredients_complete": ["?"]})
+            elif step % 7 == 0:  # a deleted one sorts last
+                store.ing_count[ordinal] = cardstore.MISSING
+            else:
+                store.clicks[ordinal] = rng.randint(0, 5)
+            ordering.move(ordinal)
+        self.assertFresh(ordering, store)
+
+    def test_top(self):  # the first k candidates by the column, without sorting them
+        rng = random.Random(25)
+        store = self.store(rng, 300)
+        for name, value in orderings.SORTS.items():
+            ordering = orderings.Ordering(store, value)
+            candidates = rng.sample(range(len(store)), 50)
+            expected = sorted(candidates, key=lambda ordinal: (value(store, ordinal), ordinal))[:12]
+            self.assertEqual(ordering.top(candidates, 12), expected, name)
+
+    def test_grow(self):  # ordinals the store made without a listener call are placed on the next read
+        rng = random.Random(26)
+        store = self.store(rng, 20)
+        table = orderings.Orderings(store)
+        store.ordinal(ObjectId())  # only a posting list knows it, no document
+        self.assertEqual(table.first("time", 30)[-1], 20)
+        for ordering in table.orderings.values():
+            self.assertFresh(ordering, store)
+
+
+## mapped buckets (indexing.py) ##
+@override_settings(MAPPED_BUCKET_SIZE=3)
+class MappedBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        self.collection = FakeCollection()
+        self.patches = [mock.patch.object(indexing.mapped, "_get_collection", return_value=self.collection),
+                        mock.patch.object(canonical, "_table", canonical.build_table(["Egg", "Tomato"], {})),
+                        mock.patch.object(canonical, "_loaded_at", float("inf"))]
+        for patch in self.patches:
+            patch.start()
+        self.ids = [ObjectId() for n in range(8)]  # ascending
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def buckets(self, ingredient):
+        buckets = sorted(self.collection.find({"ingredient": ingredient}), key=lambda doc: doc["bucket"])
+        for doc in buckets:  # the metadata the readers select buckets by
+            self.assertEqual((doc["count"], doc["first"], doc["last"]), (len(doc["value"]), doc["value"][0], doc["value"][-1]))
+            self.assertEqual(doc["value"], sorted(doc["value"]))
+        return [doc["value"] for doc in buckets]
+
+    def test_sync_recipe(self):
+        for recipe_id in self.ids[:7]:
+            indexing.sync_recipe(recipe_id, {"Egg"})
+        self.assertEqual(self.buckets("Egg"), [self.ids[0:3], self.ids[3:6], self.ids[6:7]])
+        self.assertEqual(indexing.sync_recipe(self.ids[0], {"Egg", "Tomato"}), ({"Tomato"}, set()))
+        self.assertEqual(indexing.sync_recipe(self.ids[0], {"Tomato"}), (set(), {"Egg"}))
+        for recipe_id in self.ids[1:3]:
+            indexing.sync_recipe(recipe_id, set())
+        self.assertEqual(self.buckets("Egg"), [self.ids[3:6], self.ids[6:7]])  # the emptied bucket is gone
+        self.assertEqual(list(indexing.read_postings(self.collection)), [("Egg", self.ids[3:7]), ("Tomato", self.ids[:1])])
+        self.assertEqual(list(indexing.read_postings(self.collection, ["Tomato"])), [("Tomato", self.ids[:1])])
+
+    def test_split_bucket(self):  # an id landing in a full bucket that isn't the last splits it
+        for recipe_id in self.ids[:2] + self.ids[3:8]:
+            indexing.sync_recipe(recipe_id, {"Egg"})
+        self.assertEqual(self.buckets("Egg"), [self.ids[0:2] + self.ids[3:4], self.ids[4:7], self.ids[7:8]])
+        indexing.sync_recipe(self.ids[2], {"Egg"})
+        self.assertEqual(self.buckets("Egg"), [self.ids[0:2], self.ids[2:4], self.ids[4:7], self.ids[7:8]])
+        self.assertEqual(sorted(doc["bucket"] for doc in self.collection.find({"ingredient": "Egg"})), [0, 1, 2, 3])
+
+    def test_legacy(self):  # mapreduce.js documents are read until the build swaps the buckets in
+        self.collection.insert({"_id": "Egg", "value": self.ids[2:4], "title": "Egg"})
+        self.collection.insert({"_id": "egg", "value": self.ids[0:3]})
+        self.collection.insert({"_id": "Tomato", "value": self.ids[5:6]})
+        self.assertTrue(indexing.legacy(self.collection))
+        self.assertEqual(list(indexing.read_postings(self.collection)), [("Egg", self.ids[0:4]), ("Tomato", self.ids[5:6])])
+        self.assertEqual(list(indexing.read_postings(self.collection, ["Tomato"])), [("Tomato", self.ids[5:6])])
+        self.assertEqual(indexing.ingredient_query(self.collection, ["Tomato"]), {"_id": {"$in": ["Tomato"]}})
+        self.assertEqual(indexing.sync_recipe(self.ids[7], {"Tomato"}), (set(), set()))
+        self.assertEqual(len(self.collection.docs), 3)
+        with mock.patch.object(indexing.mapped, "ensure_indexes") as ensure:
+            indexing.migrate_mapped()  # left in place for the searches, no unique index on it
+        self.assertFalse(ensure.called)
+        self.assertFalse(hasattr(self.collection, "renamed"))
+
+
+## match index (matching.py) ##
+class MatchIndexTests(SimpleTestCase):
+    FOODS = ["Salt", "Tomato", "Egg", "Basil", "Onion", "Garlic", "Chicken", "Pasta", "Oil"]
+
+    def setUp(self):  # a canonical table of FOODS instead of food_ref
+        self.table = canonical._table, canonical._loaded_at
+        canonical._table, canonical._loaded_at = canonical.build_table(self.FOODS, {}), float("inf")
+
+    def tearDown(self):
+        canonical._table, canonical._loaded_at = self.table
+
+    def index(self, recipes):  # MatchIndex over (ingredients, ing_count, clicks) recipes, ordinals in order
+        store = CardStore()
+        index = matching.MatchIndex(store)
+        postings = {}
+        for ingredients, ing_count, clicks in recipes:
+            ordinal = store.put({"_id": ObjectId(), "clicks": clicks, "ingredients_complete": ["?"] * ing_count})
+            for ingredient in ingredients:
+                postings.setdefault(ingredient, []).append(ordinal)
+        index.postings = dict((ingredient, packing.pack(ordinals)) for ingredient, ordinals in postings.items())
+        index.forward = matching.Forward(index.postings, len(store))
+        index.order_impact()
+        index.find_staples()
+        return index
+
+    def test_forward(self):  # the ingredients of every recipe, from the packed lists
+        recipes = [(["Tomato", "Egg"], 2, 1), ([], 1, 1), (["Egg", "Basil", "Salt"], 3, 1)]
+        index = self.index(recipes)
+        self.assertEqual([index.listed_under(ordinal) for ordinal in range(4)], [set(r[0]) for r in recipes] + [set()])
+        self.assertEqual(index.forward.nbytes(), 4 * (4 + 5))
+        index.update_recipe(1, {"Onion"})
+        self.assertEqual(index.listed_under(1), {"Onion"})
+        self.assertEqual(index.forward.listed_under(1), set())  # as loaded
+
+    def test_decoded_lists(self):
+        index = self.index([(["Tomato", "Egg"], 2, 1), (["Tomato"], 3, 1), (["Egg"], 1, 1)])
+        postings, impact = index.lists("Tomato")
+        self.assertEqual((list(postings), list(impact)), ([0, 1], [0, 1]))
+        self.assertIs(index.lists("Tomato")[1], impact)  # kept decoded
+        index.update_recipe(2, {"Tomato", "Egg"})
+        self.assertEqual(list(index.lists("Tomato")[1]), [2, 0, 1])  # repacked, decoded again
+
+    @override_settings(MATCH_DECODED_POSTINGS=3)
+    def test_decoded_limit(self):
+        index = self.index([(["Tomato", "Egg"], 2, 1), (["Tomato", "Egg"], 3, 1), (["Basil", "Onion", "Egg"], 3, 1), (["Egg"], 1, 1)])
+        index.lists("Tomato")
+        index.lists("Basil")
+        self.assertEqual(list(index.decoded), ["Tomato", "Basil"])
+        index.lists("Onion")  # the least recently used goes
+        self.assertEqual(list(index.decoded), ["Basil", "Onion"])
+        self.assertEqual(list(index.lists("Egg")[0]), [0, 1, 2, 3])  # longer than the limit, decoded but not kept
+        self.assertEqual((list(index.decoded), index.decoded_size), (["Basil", "Onion"], 2))
+
+    def subset_index(self):
+        return self.index([(["Tomato", "Basil"], 2, 5),  # covered by the query
+                           (["Tomato", "Onion"], 2, 4),  # one ingredient missing
+                           (["Egg"], 3, 3),  # two missing
+                           (["Garlic"], 1, 2),  # nothing in common
+                           (["Salt", "Tomato"], 2, 1)])  # covered, with a staple
+
+    def covered(self, index, *args, **kwargs):
+        ordinals, frequencies = index.covered(["Tomato", "Basil", "Egg", "Salt"], *args, **kwargs)
+        return dict(zip(ordinals, frequencies))
+
+    def test_covered_missing(self):
+        index = self.subset_index()
+        self.assertEqual(self.covered(index, missing=0), {0: 2, 4: 2})
+        self.assertEqual(self.covered(index, missing=1), {0: 2, 1: 1, 4: 2})
+        self.assertEqual(self.covered(index, missing=2), {0: 2, 1: 1, 2: 1, 4: 2})
+
+    def test_covered_coverage(self):
+        index = self.subset_index()
+        self.assertEqual(sorted(self.covered(index, coverage=100)), [0, 4])
+        self.assertEqual(sorted(self.covered(index, coverage=50)), [0, 1, 4])
+        self.assertEqual(sorted(self.covered(index, coverage=30)), [0, 1, 2, 4])
+        self.assertEqual(sorted(self.covered(index, missing=1, coverage=60)), [0, 4])
+
+    def test_covered_constraints_and_pantry(self):
+        index = self.subset_index()
+        self.assertEqual(sorted(self.covered(index, missing=1, excluded=["Onion"])), [0, 4])
+        self.assertEqual(sorted(self.covered(index, missing=2, required=["Basil"])), [0])
+        onion = (lambda ordinal: 1 if ordinal == 1 else 0, 1, 0.5)  # a pantry with Onion, at half weight
+        self.assertEqual(self.covered(index, missing=0, added=onion), {0: 2, 1: 1.5, 4: 2})
+
+    def partitioned_index(self):
+        rng = random.Random(8)
+        foods = ["Tomato", "Egg", "Basil", "Onion", "Garlic", "Salt"]
+        return self.index([(rng.sample(foods, rng.randint(1, 4)), rng.randint(1, 6), rng.randint(0, 3)) for n in range(300)])
+
+    @override_settings(MATCH_PARTITIONS=3, MATCH_PARTITION_MIN_POSTINGS=0, MATCH_PARTITION_CHANNELS=2)
+    def test_scatter(self):  # the partial top k lists merge into the serial ranking
+        index = self.partitioned_index()
+        queries = [(["Tomato"], 0), (["Tomato", "Egg", "Basil"], 0), (["Onion", "Garlic"], index.staples["Salt"])]
+        try:
+            for ingredients, mask in queries:
+                scattered = index.ranked(ingredients, mask, 12)
+                self.assertIsNotNone(index.partitions)
+                with override_settings(MATCH_PARTITIONS=0):
+                    self.assertEqual(scattered, index.ranked(ingredients, mask, 12))
+        finally:
+            index.partitions.close()
+        self.assertIsNone(index.partitions.top(["Tomato"], 0, 12))  # closed, the query runs serially
+
+    @override_settings(MATCH_PARTITIONS=2, MATCH_PARTITION_MIN_POSTINGS=0, MATCH_PARTITION_CHANNELS=3)
+    def test_scatter_concurrently(self):  # threads don't wait for each other's whole scatter, nor mix up answers
+        index = self.partitioned_index()
+        queries = [["Tomato"], ["Egg", "Basil"], ["Onion", "Garlic", "Tomato"], ["Basil"]] * 5
+        with override_settings(MATCH_PARTITIONS=0):
+            expected = [index.ranked(ingredients, 0, 12) for ingredients in queries]
+        results = [None] * len(queries)
+
+        def run(n):
+            results[n] = index.ranked(queries[n], 0, 12)
+        try:
+            index.ranked(["Tomato"], 0, 12)  # forked here, not by every thread at once
+            threads = [threading.Thread(target=run, args=(n,)) for n in range(len(queries))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+        finally:
+            index.partitions.close()
+        self.assertEqual(results, expected)
+        for process in index.partitions.processes:
+            process.join(5)
+            self.assertFalse(process.is_alive())
+
+    def test_covered_staples_only(self):  # a recipe of staples alone is covered by a query naming them
+        index = self.index([(["Pasta", "Oil", "Salt"], 3, 1), (["Chicken", "Pasta"], 2, 1), (["Chicken", "Basil"], 2, 1)])
+        query = ["Chicken", "Pasta", "Oil", "Salt"]
+        self.assertEqual(dict(zip(*index.covered(query, missing=0))), {0: 3, 1: 2})
+        self.assertEqual(sorted(dict(zip(*index.covered(query, coverage=100)))), [0, 1])
+        self.assertEqual([index.store.ordinals[recipe_id] for recipe_id, card in index.search(query, missing=0)[0:12]], [0, 1])
+        self.assertEqual(sorted(cookable.grown(index, query, {"Oil"})), [0])
+        self.assertEqual(sorted(cookable.grown(index, query, {"Chicken"})), [1])
+
+    @override_settings(PANTRY_WEIGHT=0.5)
+    def test_pantry(self):  # counted from the index's bitmaps, so updates show without building the pantry again
+        index = self.index([(["Tomato", "Onion", "Salt"], 3, 1), (["Tomato", "Garlic"], 2, 1), (["Egg"], 1, 1)])
+        pantry = pantries.Pantry(index, ["onion", "Garlic", "Salt", "Caviar"])
+        self.assertEqual(pantry.ingredients, ("Garlic", "Onion", "Salt"))
+        count, most = pantry.matches(["Tomato"], 0)
+        self.assertEqual(([count(ordinal) for ordinal in range(3)], most), ([2, 1, 0], 3))
+        count, most = pantry.matches(["Tomato", "Onion"], index.staples["Salt"])  # what the query names isn't added
+        self.assertEqual(([count(ordinal) for ordinal in range(3)], most), ([0, 1, 0], 1))
+
+        cache = pantries.PantryCache()
+        cache.entries["user"] = (float("inf"), pantry)
+        index.update_recipe(2, {"Egg", "Onion"})
+        self.assertIs(cache.get("user", index), pantry)
+        count, most = pantry.matches(["Tomato"], 0)
+        self.assertEqual([count(ordinal) for ordinal in range(3)], [2, 1, 1])
+        reloaded = self.index([(["Onion"], 1, 1)])
+        self.assertEqual(cache.get("user", reloaded).ingredients, ("Onion",))  # built again for another index
+
+    def test_subset_search(self):  # ranked by the subset score, frequency**2 / ing_count, then clicks
+        index = self.subset_index()
+        result = index.search(["Tomato", "Basil", "Egg", "Salt"], missing=1)
+        self.assertEqual(len(result), 3)
+        self.assertEqual([index.store.ordinals[recipe_id] for recipe_id, card in result[0:3]], [0, 4, 1])
+        self.assertEqual([(card["frequency"], card["ratio"]) for recipe_id, card in result[0:3]], [(2, 100), (2, 100), (1, 50)])
+
+
+## cook now feeds (cookable.py) ##
+class CookableFeedTests(SimpleTestCase):
+    FOODS = MatchIndexTests.FOODS
+    index = MatchIndexTests.index
+
+    def setUp(self):
+        MatchIndexTests.setUp(self)
+        self.feeds = FakeCollection()
+        self.recipes = self.index([(["Tomato", "Egg"], 2, 1), (["Tomato"], 1, 1), (["Egg", "Basil"], 2, 5),
+                                   (["Basil", "Onion", "Salt"], 3, 1), (["Pasta", "Oil"], 2, 1)])
+        self.patches = [mock.patch.object(cookable.cookable_feed, "_get_collection", return_value=self.feeds),
+                        mock.patch.object(matching, "get_index", return_value=self.recipes)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        MatchIndexTests.tearDown(self)
+
+    def listed(self, user_id=1):  # ordinals of the stored feed, in its order
+        doc = self.feeds.find_one({"user_id_reference": user_id})
+        return [self.recipes.store.ordinals[fields["recipe"]] for fields in doc["entries"]]
+
+    def test_pantry_changed(self):  # added ingredients count only the recipes listing them, removed ones drop theirs
+        self.assertEqual(len(cookable.pantry_changed(1, ["tomato", "Egg"])), 2)
+        self.assertEqual(self.listed(), [0, 1])
+        cookable.pantry_changed(1, ["Tomato", "Egg", "Basil"])
+        self.assertEqual(self.listed(), [2, 0, 1])  # by score, then clicks
+        with mock.patch.object(cookable, "covered", side_effect=AssertionError("counted again")):
+            cookable.pantry_changed(1, ["Egg", "Basil", "Onion", "Salt"])
+        self.assertEqual(self.listed(), [3, 2])
+        self.feeds.update({"user_id_reference": 1}, {"$unset": {"entries": ""}, "$set": {"recipes": []}})
+        cookable.pantry_changed(1, ["Egg", "Basil"])  # a feed from before the rank keys is built again
+        self.assertEqual(self.listed(), [2])
+        self.assertNotIn("recipes", self.feeds.find_one({"user_id_reference": 1}))
+
+    def test_grown(self):
+        self.assertEqual(sorted(cookable.grown(self.recipes, ["Tomato", "Egg", "Basil"], {"Basil"})), [2])
+        self.assertEqual(sorted(cookable.grown(self.recipes, ["Tomato", "Egg"], {"Egg"})), [0])
+        self.assertEqual(cookable.grown(self.recipes, ["Tomato"], {"Onion"}), [])
+
+    def save(self, recipe_id, ingredients, clicks=1):
+        document = mock.Mock(id=recipe_id)
+        document.to_mongo.return_value = {"_id": recipe_id, "ingredients_list": ingredients,
+                                          "ingredients_complete": ingredients, "clicks": clicks}
+        cookable.recipe_saved(None, document)
+
+    def test_recipe_saved(self):  # pushed into place in the feeds it joins, pulled from the ones it left
+        cookable.build(1, ["Tomato", "Egg"])
+        cookable.build(2, ["Tomato"])
+        self.feeds.insert({"user_id_reference": 3, "pantry": ["Egg", "Tomato"], "recipes": []})  # before the keys
+        new = ObjectId()
+        self.save(new, ["Tomato", "Egg"], clicks=3)
+        feed = self.feeds.find_one({"user_id_reference": 1})["entries"]
+        self.assertEqual([fields["recipe"] for fields in feed[:2]], [new, self.recipes.store.recipe_ids[0]])  # more clicks
+        self.assertEqual(feed[0], {"recipe": new, "score": 2.0, "clicks": 3, "rating": 0.0})
+        self.assertEqual(self.listed(2), [1])
+        self.assertNotIn("entries", self.feeds.find_one({"user_id_reference": 3}))
+        self.save(new, ["Tomato", "Egg"], clicks=3)  # saved again, not twice
+        self.assertEqual(len(self.feeds.find_one({"user_id_reference": 1})["entries"]), 3)
+
+        self.save(new, ["Tomato", "Egg", "Garlic"])
+        self.assertEqual(self.listed(1), [0, 1])
+        self.save(new, ["Tomato"])
+        self.assertEqual([fields["recipe"] for fields in self.feeds.find_one({"user_id_reference": 2})["entries"]],
+                         [new, self.recipes.store.recipe_ids[1]])  # a full tie goes to the newer recipe
+        cookable.recipe_deleted(None, mock.Mock(id=new))
+        self.assertEqual((self.listed(1), self.listed(2)), ([0, 1], [1]))
+
+
+## resident card store (cardstore.py) ##
+class CardStoreRefreshTests(SimpleTestCase):
+
+    def setUp(self):
+        self.recipes, self.deleted = FakeCollection(), FakeCollection()
+        self.clock = datetime(2016, 5, 1, 12, 0, 0)
+        self.patches = [mock.patch.object(cardstore.recipe, "_get_collection", return_value=self.recipes),
+                        mock.patch.object(cardstore.deleted_recipe, "_get_collection", return_value=self.deleted),
+                        mock.patch.object(cardstore, "listeners", [self.listener]),
+                        mock.patch.object(canonical, "_table", canonical.build_table(["Egg"], {})),
+                        mock.patch.object(canonical, "_loaded_at", float("inf"))]
+        for patch in self.patches:
+            patch.start()
+        self.changes = []
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def listener(self, store, ordinal, ingredients, old):
+        self.changes.append((store.title[ordinal], old is None, store.alive(ordinal)))
+
+    def tick(self):
+        self.clock += timedelta(seconds=1)
+        return self.clock
+
+    def save(self, recipe_id, title, **fields):  # a save made in another worker, as mongo holds it
+        doc = dict(fields, _id=recipe_id, title=title, modified=self.tick(), ingredients_complete=["Egg"],
+                   ingredients_list=["Egg"])
+        self.recipes.save(doc)
+        return doc
+
+    def test_refresh_picks_up_changes(self):
+        first, second = ObjectId(), ObjectId()
+        self.save(first, "one")
+        store = CardStore().load()
+        self.save(first, "one, edited")
+        self.save(second, "two")
+        self.assertEqual(store.refresh(), 2)
+        self.assertEqual([store.title[store.ordinals[first]], store.title[store.ordinals[second]]], ["one, edited", "two"])
+        self.assertEqual(self.changes, [("one, edited", False, True), ("two", True, True)])
+        self.assertEqual(store.refresh(), 0)  # the $gte reads the newest again, holds() skips it
+
+    def test_local_save_keeps_the_marker(self):  # a save here mustn't hide changes other workers made before it
+        mine, theirs = ObjectId(), ObjectId()
+        self.save(mine, "mine")
+        self.save(theirs, "old")
+        store = CardStore().load()
+        marker = store.marker
+        self.save(theirs, "edited elsewhere")
+        store.put(self.save(mine, "saved here"), notify=True)
+        self.assertEqual(store.marker, marker)
+        store.refresh()
+        self.assertEqual(store.title[store.ordinals[theirs]], "edited elsewhere")
+        self.assertEqual([title for title, new, alive in self.changes], ["saved here", "edited elsewhere"])  # not twice
+
+    def test_tombstones(self):
+        kept, gone = ObjectId(), ObjectId()
+        self.save(kept, "kept")
+        self.save(gone, "gone")
+        store = CardStore().load()
+        self.deleted.insert({"recipe_id": gone, "deleted": datetime.now() + timedelta(seconds=1)})
+        self.recipes.remove({"_id": gone})
+        self.assertEqual(store.refresh(), 1)
+        self.assertFalse(store.alive(store.ordinals[gone]))
+        self.assertEqual(self.changes, [("gone", False, False)])
+        self.assertEqual(store.refresh(), 0)  # a tombstone is applied once
+        self.assertEqual(store.cards([kept, gone]), {kept: store.card(store.ordinals[kept])})
 
-# Create your tests here.
@@ -7,8 +7,11 @@ urlpatterns = [
 
     url(r'^recipes', views.retrieveRecipes, name="recipes"),
     url(r'^autocorrect', views.autocorrect, name="autocorrect"),
+    url(r'^autocomplete', views.autocomplete, name="autocomplete"),
     url(r'^presenterarecept/', views.presentRecipe, name="presenterarecept"),
     url(r'^starrating', views.starrating, name="starrating"),
+    url(r'^searchstats', views.searchstats, name="searchstats"),
+    url(r'^cooknow', views.cookNow, name="cooknow"),
 
     url(r'^$', views.startpage, name = "startpage" ), #VIKTIGT ATT DENNA ÄR SIST
 
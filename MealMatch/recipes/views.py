@@ -2,17 +2,20 @@
 from .models import *
 from  account_functions.models import Profile
 
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, Http404
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
 from bson.json_util import dumps
-import re
 
-from collections import OrderedDict
 from bson.objectid import ObjectId
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from account_functions.context_processors import get_user
 from account_functions.views import *
 
 from .forms import CommentForm
+from . import matching, querycache, cursors, cookable, canonical, fuzzy, completion, orderings
+from django.contrib.admin.views.decorators import staff_member_required
 
 from account_functions.decorators import check_recaptcha
 
@@ -20,7 +23,8 @@ from account_functions.decorators import check_recaptcha
 ############# VIEW FUNCTIONS #####################
 def startpage(request):
     if (request.method == "GET"):
-        return render(request, "startpage.html")
+        popular = matching.popular(getattr(settings, "START_PAGE_RECIPES", 6)) #most clicked recipes, kept in order in memory
+        return render(request, "startpage.html", {"popular": popular})
 
 
 
@@ -35,7 +39,7 @@ def presentRecipe(request):
             recipe_id = request.path[-24:]
             try:
                 mongouser = Profile.objects.get(user_id_reference=request.user.id)
-                recipe_response = recipe.objects.get(_id=ObjectId(recipe_id))
+                recipe_response = recipe.unordered.get(_id=ObjectId(recipe_id))
             except:
                 pass  # display modal saying "could not comment"
             else:
@@ -54,7 +58,10 @@ def presentRecipe(request):
 
     if request.method == "GET": #When the page is retrieved
         req_id = request.path[-24:] #Extracts the id from the path
-        recipe_response = recipe.objects.get(_id = ObjectId(req_id))#Runs query with the request ID
+        try:
+            recipe_response = recipe.unordered.get(_id = ObjectId(req_id))#Runs query with the request ID
+        except recipe.DoesNotExist: #deleted since the result list was ranked
+            raise Http404("Recipe not found")
 
 
 
@@ -86,17 +93,20 @@ def retrieveRecipes(request):
 
     if request.method == "GET":
         raw_input = request.path[17:-1].split("&") #splits into array based on &, title() makes first letters capitalized (to be reomved?)
-        input = []
-        for element in raw_input:
-            input.append(sanitize(element)) #Sanitizses !! IMPORTANT !!
+        input, required, excluded = parse_terms(raw_input) #Sanitizses !! IMPORTANT !!
         # Now that the input is cleaned, we can implement elasticsearch/fuzzy search on food_ref t
 
-        query_mapped = mapped.objects(id__in=input).only('value').key_frequency()#queries from the mapped colletion and does a key_frequency check
-        sorted_dict = OrderedDict(reversed(sorted(query_mapped.items(), key=lambda x: (x[1]['frequency']/x[1]['ing_count']*x[1]['frequency'], x[1]['clicks'], x[1]['rating'])))) #Sorts list based on frequency
-        dictlist = []
-        for key, value in sorted_dict.items():
-            temp = [key,value]
-            dictlist.append(temp)
+        #Ranks lazily against the in-process index, only the cards of the requested page are selected.
+        #The cursor freezes the ranking of the first page so next/previous pages are slices of it
+        #?subset=1 only lists recipes made from the given ingredients alone, ?missing=2 allows two more and
+        #?coverage=80 asks for 80% of a recipe's ingredients. ?pantry=1 counts the ingredients in the user's pantry too
+        #?sort=rating, clicks or time lists the same recipes by rating, popularity or prep time
+        missing = int_param(request, 'missing', 0 if request.GET.get('subset') else None)
+        coverage = int_param(request, 'coverage')
+        pantry = request.user.id if request.GET.get('pantry') else None #None for anonymous users
+        sort = request.GET.get('sort') if request.GET.get('sort') in orderings.SORTS else None
+        dictlist, cursor = cursors.open_cursor(input, request.GET.get('cursor'), matching.search, required=required,
+                                               excluded=excluded, missing=missing, coverage=coverage, pantry=pantry, sort=sort)
         paginator = Paginator(dictlist, 12)  # Show 9 contacts per page
         page = request.GET.get('page', 1)
 
@@ -106,35 +116,87 @@ def retrieveRecipes(request):
         recipes = view_paginator(page, paginator)
         page_range = paginateSlice(3, recipes, paginator)
 
-        return render(request, "recipes.html", {"user_input" : input, "recipes": recipes, "page_range" : page_range, "num_pages": paginator.num_pages})
+        terms = ["+" + element if element in required else element for element in input] + ["-" + element for element in excluded]
+        params = request.GET.copy() #search options the page links have to carry along
+        params.pop('page', None)
+        params.pop('cursor', None)
+        sort_params = params.copy() #the sort links replace the sort
+        sort_params.pop('sort', None)
+        return render(request, "recipes.html", {"user_input" : terms, "recipes": recipes, "page_range" : page_range, "num_pages": paginator.num_pages, "cursor": cursor, "params": params.urlencode(), "sortable": True, "sort": sort, "sort_params": sort_params.urlencode()})
     else:
         return render(request, "startpage.html")
 
-##Autocorrect implementation. Must be adjusted to prevent crashed (eg via elasticsearch or fewer queries)##
+##The recipes the user's pantry alone covers, read from their materialized feed (cookable.py)##
+@login_required
+def cookNow(request):
+    feed = cookable.feed(request.user.id)
+    paginator = Paginator(feed, 12)
+    recipes = view_paginator(request.GET.get('page', 1), paginator)
+    page_range = paginateSlice(3, recipes, paginator)
+    return render(request, "recipes.html", {"user_input": feed.pantry, "recipes": recipes, "page_range": page_range, "num_pages": paginator.num_pages, "cursor": "", "params": ""})
+
+##Autocorrect implementation. Answered from the in-process completions (completion.py), no query per keystroke##
 def autocorrect(request):
     input = sanitize(request.POST['input'])  # gets the user input and sanitizses using sanitize()
     if (len(input) > 0):
 
-        array = []
-        foods = food_ref.objects(food__istartswith=input)  # checks if any word starts with the user input
-        for element in foods:
-            array.append(element.food)  # appends matches to an initially empty array
+        array = completion.complete(input)  # the ingredients starting with the user input that most recipes list
         array = dumps(array)  # dumps the aray to JSON format
         return JsonResponse(array, safe=False)  # returns a JSONResponse to client-side
     else:
         return render(request, "startpage.html") #if there is no input, do as before
 
 
+##Cacheable GET variant of autocorrect, /recipes/autocomplete/?q=tom. Short prefixes are served as pre-serialized bytes,##
+##the ETag and Cache-Control let browsers and proxies answer repeated keystrokes without asking again##
+@require_GET
+def autocomplete(request):
+    body, etag = completion.response(request.GET.get('q', ''))
+    matches = [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+    if etag in matches or '*' in matches:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=getattr(settings, "AUTOCOMPLETE_MAX_AGE", 300))
+    return response
+
+
+
 
 
 
+##Hit, miss and eviction counters of this worker's result cache, used to size QUERY_CACHE_SIZE and QUERY_CACHE_TTL##
+@staff_member_required
+def searchstats(request):
+    return JsonResponse(querycache.cache.stats())
+
+
 
 ############# HELPER FUNCTIONS #############
 def sanitize(user_string):
-    user_string = re.sub("_", " ", user_string)  # Converts underscore to whitespace
-    user_string = re.sub("[^a-öA-Ö],[^-]","", user_string) #removes non alphabetic characters but allows whitespcae and single dash
-    user_string = re.sub("--", "", user_string)#removes double dash to prevent injections
-    return user_string
+    return canonical.clean(user_string) #same patterns as before, compiled once
+
+
+def parse_terms(raw_input): #"+Chicken" has to be in the recipe and "-Peanuts" must not be, other terms are matched as before
+    input, required, excluded = [], [], [] #canonical ingredients, "tomatoes" is searched as "Tomato" like the index lists it
+    resolve = fuzzy.resolver() #and "tomatoe" too, misspellings are corrected to the closest ingredient
+    for element in raw_input:
+        if element[:1] == "+" and resolve(element[1:]):
+            required.append(resolve(element[1:]))
+            input.append(required[-1])
+        elif element[:1] == "-" and resolve(element[1:]):
+            excluded.append(resolve(element[1:]))
+        else:
+            input.append(resolve(element))
+    return input, required, excluded
+
+
+def int_param(request, name, default=None): #non-negative int from the query string, default when absent or malformed
+    try:
+        return max(int(request.GET[name]), 0)
+    except (KeyError, ValueError):
+        return default
 
 
 def getComments(comments_query):
@@ -176,7 +238,7 @@ def paginateSlice(page_numbers, recipes, paginator):
 
 def get_ratings(id):
 
-    ratings = recipe.objects.get(_id = ObjectId(id)).ratings
+    ratings = recipe.unordered.get(_id = ObjectId(id)).ratings
 
 
     print ('vad är ratings? ' , ratings )
@@ -192,7 +254,7 @@ def get_ratings(id):
 
 def starrating(request):
 
-    recipe_use = recipe.objects.get(_id=ObjectId(request.POST['recipe_id']))
+    recipe_use = recipe.unordered.get(_id=ObjectId(request.POST['recipe_id']))
     print('recipe_use', recipe_use)
     recipe_use.rating.append(request.POST['rating'])
     print('bajs', request.POST['rating'] )
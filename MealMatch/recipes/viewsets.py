@@ -20,6 +20,9 @@ class mappedViewSet(viewsets.ModelViewSet):
     serializer_class = mappedSerializer
 
 
-    def get_queryset(self):
-        return mapped.objects().exclude('id')
+    def get_queryset(self): #?ingredient=Salt&first=<id>&last=<id> reads only the buckets covering that id range
+        ingredient = self.request.query_params.get('ingredient')
+        if ingredient:
+            return mapped.objects.buckets(ingredient, self.request.query_params.get('first'), self.request.query_params.get('last'))
+        return mapped.objects().order_by('ingredient', 'bucket')
 
@@ -62,20 +62,18 @@ function setURL() {
 
  //Ajax functions
  function ajax_func(){
-    var csrftoken = getCookie('csrftoken'); //retrieve the specified csrftoken cookie
-
-    var inputs = $('#ingredient-form').val()
+    var inputs = $('#ingredient-form').val().trim().replace(/\s+/g, " ").toLowerCase() //one spelling per prefix, so cached answers are reused
 
 
     $.ajax({ //do an ajax request, since default prevented
-        url : "autocorrect/", // the endpoint
-        type : "POST", // http method
-        data : {csrfmiddlewaretoken: csrftoken, input: inputs},// data sent with the post request
+        url : "/recipes/autocomplete/", // the endpoint, a GET the browser and proxies may answer from their cache
+        type : "GET", // http method
+        data : {q: inputs},
         dataType: "json",
+        cache: true,
         // handle a successful response
         success : function(array){
 
-            array = JSON.parse(array);
             automatiskKomplettering(array);
 
         }